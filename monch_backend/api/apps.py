@@ -7,3 +7,7 @@ class ApiConfig(AppConfig):
 
     def ready(self):
         import api.signals
+        from api import checks, instrumentation, replicas
+        checks.require_shared_cache()
+        instrumentation.install()
+        replicas.install()
@@ -1,9 +1,146 @@
+import copy
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from . import replicas
+from .checks import per_process_cache
 
-class CookieJWTAuthentication(JWTAuthentication):
+# JWT authentication from the Authorization header or, failing that, the
+# access_token cookie, resolving the token's user without a query on most
+# requests. Users are cached per process for AUTH_USER_LOCAL_TIMEOUT seconds
+# and in the shared cache for AUTH_USER_CACHE_TIMEOUT; saving or deleting a
+# user drops both (api/signals.py). Other processes can keep a user for up to
+# the local timeout after that, so keep it short. A per-process default cache
+# (LocMem) isn't used for users at all: changes made elsewhere (a management
+# command) could never drop it, so only the local timeout applies.
+#
+# Tokens carry the user's token_version, which saving a new password bumps
+# (User.save): a token whose version isn't the user's current one is
+# rejected, cached or not. Tokens issued before versions existed count as
+# version 0.
+#
+# Authentication also tells the replica router (api/replicas.py) who the
+# request is, so a user who just wrote keeps reading from the primary.
+
+TOKEN_VERSION_CLAIM = 'token_version'
+LOCAL_MAX_USERS = 10000
+
+_local = {}
+_local_lock = threading.Lock()
+
+def _key(user_id):
+    return f'auth:user:{user_id}'
+
+def tokens_for(user):
+    """Refresh token for `user` (its access token copies the claims)."""
+    refresh = RefreshToken.for_user(user)
+    refresh[TOKEN_VERSION_CLAIM] = user.token_version
+    return refresh
+
+def forget_users(*user_ids):
+    """Drop cached users, after their row changed."""
+    with _local_lock:
+        for user_id in user_ids:
+            _local.pop(user_id, None)
+    cache.delete_many([_key(user_id) for user_id in user_ids])
+
+def _shared():
+    return not per_process_cache()
+
+def _local_user(user_id):
+    entry = _local.get(user_id)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+def _remember_locally(user_id, user):
+    with _local_lock:
+        if len(_local) >= LOCAL_MAX_USERS:
+            _local.clear()
+        _local[user_id] = (time.monotonic() + settings.AUTH_USER_LOCAL_TIMEOUT, user)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
     def authenticate(self, request):
-        token = request.COOKIES.get('access_token')
-        if token is None:
+        raw_token = self.get_request_token(request)
+        if raw_token is None:
+            replicas.identify(None)
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        user = self.get_user(validated_token)
+        replicas.identify(user.pk)
+        return user, validated_token
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views, on a plain HttpRequest."""
+        raw_token = self.get_request_token(request)
+        if raw_token is None:
+            replicas.identify(None)
             return None
-        validated_token = self.get_validated_token(token)
-        return self.get_user(validated_token), validated_token
\ No newline at end of file
+        validated_token = self.get_validated_token(raw_token)
+        user = await self.aget_user(validated_token)
+        replicas.identify(user.pk)
+        return user, validated_token
+
+    def get_request_token(self, request):
+        # The header wins; the cookie is only read when there is no header token
+        header = self.get_header(request)
+        raw_token = self.get_raw_token(header) if header is not None else None
+        if raw_token is None:
+            raw_token = request.COOKIES.get(settings.SIMPLE_JWT['AUTH_COOKIE']) or None
+        return raw_token
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        user = _local_user(user_id)
+        if user is None:
+            shared = _shared()
+            user = cache.get(_key(user_id)) if shared else None
+            if user is None:
+                user = self._fetch(user_id)
+                if shared:
+                    cache.set(_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+            _remember_locally(user_id, user)
+        return self._checked(user, validated_token)
+
+    async def aget_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        user = _local_user(user_id)
+        if user is None:
+            shared = _shared()
+            user = await cache.aget(_key(user_id)) if shared else None
+            if user is None:
+                try:
+                    user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+                except self.user_model.DoesNotExist:
+                    raise AuthenticationFailed(_('User not found'), code='user_not_found')
+                if shared:
+                    await cache.aset(_key(user_id), user, settings.AUTH_USER_CACHE_TIMEOUT)
+            _remember_locally(user_id, user)
+        return self._checked(user, validated_token)
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+    def _fetch(self, user_id):
+        try:
+            return self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+    def _checked(self, user, validated_token):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if validated_token.get(TOKEN_VERSION_CLAIM, 0) != user.token_version:
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        # Requests get their own copy of the shared instance
+        return copy.copy(user)
@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from rest_framework.exceptions import ParseError
+from .models import User, Post, Follow, Like
+from . import timeline, response_cache, follow_graph
+
+# Set-based versions of the one-object endpoints. Each batch is a handful of
+# queries inside one transaction whatever its size. Rows are written with
+# plain INSERT / DELETE statements (insert_returning, delete_returning) that
+# send no signals, so the work of the Like/Follow receivers in
+# api/signals.py (counters, timelines, response cache versions, the follow
+# graph log) is done here for the whole batch at once. Both return the rows
+# they actually wrote, and only those are counted: a concurrent request
+# writing the same rows can't move a counter twice.
+
+def batch_values(data, name, cast=str):
+    """
+    Up to BATCH_MAX_SIZE distinct values of `name` in query params or a request
+    body, given as a list, repeated keys or one comma separated string.
+    """
+    if hasattr(data, 'getlist'):
+        values = data.getlist(name)
+    else:
+        values = data.get(name) or []
+        if not isinstance(values, list):
+            values = [values]
+    if len(values) == 1 and isinstance(values[0], str):
+        values = values[0].split(',')
+
+    try:
+        values = [cast(value.strip() if isinstance(value, str) else value) for value in values]
+    except (TypeError, ValueError):
+        raise ParseError(f'Invalid value in {name}.')
+    values = list(dict.fromkeys(value for value in values if value != ''))
+    if not values:
+        raise ParseError(f'{name} is required.')
+    if len(values) > settings.BATCH_MAX_SIZE:
+        raise ParseError(f'At most {settings.BATCH_MAX_SIZE} {name} per request.')
+    return values
+
+def bump_counters(model, pks, **deltas):
+    if pks:
+        model.objects.filter(pk__in=pks).update(**{field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()})
+
+def insert_returning(model, rows, returning):
+    """
+    INSERT `rows` (dicts of field values) into `model`'s table, skipping the
+    ones that conflict with a unique constraint, and return `returning` of the
+    rows actually inserted: a list of values, or of tuples if `returning` is a
+    tuple of field names. Needs INSERT ... RETURNING (PostgreSQL, SQLite 3.35+).
+    """
+    if not rows:
+        return []
+    connection = connections[router.db_for_write(model)]
+    objs = [model(**row) for row in rows]
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    returned = _returning(connection, model, returning)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    table = connection.ops.quote_name(model._meta.db_table)
+    size = connection.ops.bulk_batch_size(fields, objs) or len(objs)
+    found = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), size):
+            chunk = objs[start:start + size]
+            values = ', '.join(['(' + ', '.join(['%s'] * len(fields)) + ')'] * len(chunk))
+            params = [
+                field.get_db_prep_save(field.pre_save(obj, True), connection)
+                for obj in chunk for field in fields
+            ]
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT DO NOTHING RETURNING {returned}',
+                params,
+            )
+            found += cursor.fetchall()
+    return _values(found, returning)
+
+def delete_returning(queryset, returning):
+    """
+    DELETE the rows of `queryset` and return `returning` of the rows actually
+    deleted, as insert_returning does. No delete signals are sent.
+    """
+    model = queryset.model
+    using = router.db_for_write(model)
+    connection = connections[using]
+    sql, params = queryset.order_by().values('pk').query.get_compiler(using).as_sql()
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {pk} IN ({sql}) RETURNING {_returning(connection, model, returning)}',
+            params,
+        )
+        return _values(cursor.fetchall(), returning)
+
+def _returning(connection, model, returning):
+    names = returning if isinstance(returning, tuple) else (returning,)
+    return ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in names)
+
+def _values(rows, returning):
+    return [tuple(row) for row in rows] if isinstance(returning, tuple) else [row[0] for row in rows]
+
+def follow_state(user, usernames):
+    """{username: whether `user` follows them} for the users that exist."""
+    followed = set(
+        Follow.objects.filter(follower=user, following__username__in=usernames)
+        .values_list('following__username', flat=True)
+    )
+    existing = User.objects.filter(username__in=usernames).values_list('username', flat=True)
+    return {username: username in followed for username in existing}
+
+def like_posts(user, post_ids):
+    """Like every existing post in `post_ids`; returns the ids newly liked."""
+    with transaction.atomic():
+        found = Post.objects.filter(pk__in=post_ids).values_list('id', flat=True)
+        new = sorted(insert_returning(Like, [{'user_id': user.pk, 'post_id': post_id} for post_id in found], 'post_id'))
+        bump_counters(Post, new, likes_count=1)
+        transaction.on_commit(lambda: response_cache.bump(*(f'post:{post_id}' for post_id in new)))
+    return new
+
+def unlike_posts(user, post_ids):
+    """Remove `user`'s likes of `post_ids`; returns the ids that were liked."""
+    with transaction.atomic():
+        removed = sorted(delete_returning(Like.objects.filter(user=user, post_id__in=post_ids), 'post_id'))
+        bump_counters(Post, removed, likes_count=-1)
+        transaction.on_commit(lambda: response_cache.bump(*(f'post:{post_id}' for post_id in removed)))
+    return removed
+
+def follow_users(user, usernames):
+    """Follow every existing user in `usernames` except `user`; returns the usernames newly followed."""
+    with transaction.atomic():
+        targets = dict(User.objects.filter(username__in=usernames).exclude(pk=user.pk).values_list('id', 'username'))
+        rows = [{'follower_id': user.pk, 'following_id': pk} for pk in targets]
+        new = sorted(insert_returning(Follow, rows, 'following_id'))
+        _count_follows(user, new, 1)
+        timeline.backfill(user.pk, new)
+        follow_graph.record(follow_graph.FOLLOW, user.pk, new)
+    return [targets[pk] for pk in new]
+
+def unfollow_users(user, usernames):
+    """Unfollow every user in `usernames`; returns the usernames that were followed."""
+    with transaction.atomic():
+        targets = dict(User.objects.filter(username__in=usernames).values_list('id', 'username'))
+        follows = Follow.objects.filter(follower=user, following_id__in=targets)
+        removed = {pk: targets[pk] for pk in delete_returning(follows, 'following_id')}
+        _count_follows(user, list(removed), -1)
+        timeline.remove_authors(user.pk, list(removed))
+        follow_graph.record(follow_graph.UNFOLLOW, user.pk, list(removed))
+    return sorted(removed.values())
+
+def _count_follows(user, following_ids, delta):
+    if not following_ids:
+        return
+    bump_counters(User, [user.pk], following_count=delta * len(following_ids))
+    bump_counters(User, following_ids, follower_count=delta)
+    dependencies = [f'user:{user.pk}', *(f'user:{pk}' for pk in following_ids)]
+    transaction.on_commit(lambda: response_cache.bump(*dependencies))
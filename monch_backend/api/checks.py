@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+# The response cache, conditional GET versions, cached users, follow graph
+# change log and like buffer all live in the default cache, and are only
+# invalidated in the process that made the change when that cache is
+# per-process: other workers would go on serving stale responses, 304s and
+# revoked users. Several worker processes therefore need a shared backend.
+#
+# Buffered likes (LIKE_WRITE_BEHIND) are the only data kept in the cache alone
+# until a flush writes them, after the client got its 201: they need a shared
+# cache that survives a restart of the web processes (Redis with persistence)
+# whatever the number of workers.
+
+def per_process_cache():
+    return isinstance(caches['default'], LocMemCache)
+
+def require_shared_cache():
+    if settings.LIKE_WRITE_BEHIND and (per_process_cache() or isinstance(caches['default'], DummyCache)):
+        raise ImproperlyConfigured(
+            f'LIKE_WRITE_BEHIND keeps likes in the default cache until they are written, but it is '
+            f'{caches["default"].__class__.__name__}, which loses them with the process; set CACHE_BACKEND '
+            f'and CACHE_LOCATION to a persistent shared cache (Redis) or turn LIKE_WRITE_BEHIND off.'
+        )
+    if settings.WEB_CONCURRENCY > 1 and per_process_cache():
+        raise ImproperlyConfigured(
+            f'WEB_CONCURRENCY is {settings.WEB_CONCURRENCY} but the default cache is per-process '
+            f'({caches["default"].__class__.__name__}); set CACHE_BACKEND and CACHE_LOCATION to a shared '
+            f'cache (Redis, Memcached) or run a single worker.'
+        )
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from .response_cache import current_versions, dependencies, url_key
+
+# Conditional GET. The ETag of a response is a hash of the versions of
+# everything it was rendered from (the post:/thread:/user:/feed/viewer:
+# versions of api/response_cache.py), so it can be checked without touching the database
+# or rendering the body: the dependencies of each URL are remembered per
+# viewer, and a request whose If-None-Match (or If-Modified-Since) still holds
+# gets a 304. Last-Modified is the time that ETag was first seen.
+#
+# Dependencies are only trusted once a render has confirmed them; their
+# versions are read before that render, so an ETag is never newer than the
+# body it is sent with. The first request for a URL therefore gets no
+# validators, and the second one does.
+
+KEY_PREFIX = 'conditional'
+
+def _viewer(request):
+    return request.user.id if request.user.is_authenticated else 0
+
+def _key(request):
+    return url_key(KEY_PREFIX, request, _viewer(request))
+
+def _etag(request, versions):
+    # Viewers get different bodies for the same versions (liked, reposted)
+    data = json.dumps([_viewer(request), getattr(request, 'accepted_media_type', ''), sorted(versions.items())])
+    return f'W/"{hashlib.sha1(data.encode()).hexdigest()[:32]}"'
+
+def _cache_headers(request, response):
+    # Clients may keep a copy but must revalidate it; authenticated responses
+    # (viewer flags, follow state) stay out of shared caches
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    patch_vary_headers(response, ('Accept', 'Authorization', 'Cookie'))
+    return response
+
+def _validators(response, etag, modified):
+    response['ETag'] = etag
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified)
+    return response
+
+def _check(request):
+    """(state, response): the 304/412 response when a precondition decides the request."""
+    key = _key(request)
+    entry = cache.get(key)
+    etag = modified = None
+    if entry is not None:
+        etag = _etag(request, current_versions(entry['dependencies']))
+        if etag == entry['etag']:
+            modified = entry['modified']
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is not None:
+            # 304, or 412 for a failed If-Match
+            return None, _cache_headers(request, _validators(response, etag, modified))
+    return (key, entry, etag, modified), None
+
+def _finish(request, response, state, extra_dependencies):
+    key, entry, etag, modified = state
+    if response.status_code != 200 or response.get('X-Cache') == 'STALE':
+        # A stale cached body is older than the versions read above
+        return response
+
+    found = {*extra_dependencies, *dependencies(response.data)}
+    if settings.LIKE_WRITE_BEHIND and request.user.is_authenticated:
+        # The viewer's buffered likes change their copy before any post: version
+        found.add(f'viewer:{request.user.pk}')
+    found = sorted(found)
+    if entry is None or found != entry['dependencies']:
+        # New or changed dependencies: their versions weren't read before rendering
+        cache.set(key, {'dependencies': found, 'etag': None, 'modified': None}, settings.CONDITIONAL_GET_TIMEOUT)
+        return _cache_headers(request, response)
+
+    if modified is None:
+        modified = int(time.time())
+        cache.set(key, {'dependencies': found, 'etag': etag, 'modified': modified}, settings.CONDITIONAL_GET_TIMEOUT)
+    return _cache_headers(request, _validators(response, etag, modified))
+
+def conditional_response(request, render, extra_dependencies=()):
+    """
+    `render()`, or a 304 when the client's copy is still current. Successful
+    responses get ETag/Last-Modified once their dependencies are known.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return render()
+    state, response = _check(request)
+    if response is not None:
+        return response
+    return _finish(request, render(), state, extra_dependencies)
+
+async def aconditional_response(request, render, extra_dependencies=()):
+    """conditional_response for async views; `render()` returns an awaitable."""
+    if request.method not in ('GET', 'HEAD'):
+        return await render()
+    state, response = await sync_to_async(_check)(request)
+    if response is not None:
+        return response
+    response = await render()
+    return await sync_to_async(_finish)(request, response, state, extra_dependencies)
@@ -0,0 +1,122 @@
+import zlib
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from rest_framework.exceptions import NotFound
+from .models import Follow, Like, Post, PostMedia
+from .pagination import decode_cursor, encode_cursor
+
+# Streaming NDJSON export of a user's history: their profile, posts and
+# replies, likes, follows and followers, one JSON object per line and a final
+# {"type": "end"} line. Each section is read in id order with
+# .iterator(chunk_size), a server-side cursor on PostgreSQL, and written out in
+# BUFFER_SIZE chunks, so memory stays flat whatever the size of the account.
+#
+# Every record carries a cursor that restarts the export right after it. Rows
+# created while exporting get higher ids, so a resumed export still picks them
+# up; a stream without the end line was cut short and can be resumed from its
+# last cursor.
+
+BUFFER_SIZE = 64 * 1024
+
+def _profile(user, after, chunk_size, request):
+    if after is None:
+        yield user.id, {
+            'id': user.id,
+            'username': user.username,
+            'display_name': user.display_name,
+            'bio': user.bio,
+            'avatar': _url(user.avatar, request),
+            'date_joined': user.date_joined,
+        }
+
+def _posts(user, after, chunk_size, request):
+    posts = (
+        Post.objects.filter(user=user, id__gt=after or 0).order_by('id')
+        .only('id', 'content', 'created_at', 'parent_post_id', 'repost_of_id', 'likes_count', 'replies_count', 'reposts_count')
+        .prefetch_related(Prefetch('media', queryset=PostMedia.objects.only('id', 'post_id', 'media_file', 'media_type').order_by('id')))
+    )
+    for post in posts.iterator(chunk_size):
+        yield post.id, {
+            'id': post.id,
+            'content': post.content,
+            'created_at': post.created_at,
+            'parent_post': post.parent_post_id,
+            'repost_of': post.repost_of_id,
+            'likes': post.likes_count,
+            'replies_count': post.replies_count,
+            'reposts_count': post.reposts_count,
+            'media': [{'url': _url(media.media_file, request), 'media_type': media.media_type} for media in post.media.all()],
+        }
+
+def _likes(user, after, chunk_size, request):
+    likes = (
+        Like.objects.filter(user=user, id__gt=after or 0).order_by('id')
+        .values_list('id', 'post_id', 'post__user__username', 'created_at')
+    )
+    for like_id, post_id, author, created_at in likes.iterator(chunk_size):
+        yield like_id, {'post': post_id, 'post_author': author, 'created_at': created_at}
+
+def _follows(direction, other):
+    def rows(user, after, chunk_size, request):
+        follows = (
+            Follow.objects.filter(**{direction: user}, id__gt=after or 0).order_by('id')
+            .values_list('id', f'{other}__username', 'created_at')
+        )
+        for follow_id, username, created_at in follows.iterator(chunk_size):
+            yield follow_id, {'username': username, 'created_at': created_at}
+    return rows
+
+# (record type, rows) in export order; rows(user, after, chunk_size, request)
+# yields (id, record) in id order, starting after `after`
+SECTIONS = (
+    ('user', _profile),
+    ('post', _posts),
+    ('like', _likes),
+    ('following', _follows('follower', 'following')),
+    ('follower', _follows('following', 'follower')),
+)
+
+def _url(file, request):
+    if not file:
+        return None
+    return request.build_absolute_uri(file.url) if request is not None else file.url
+
+def parse_cursor(cursor):
+    """(section index, id) an export cursor resumes after; raises NotFound if invalid."""
+    position = decode_cursor(cursor)
+    names = [name for name, _ in SECTIONS]
+    if position.get('section') not in names or not isinstance(position.get('after'), int):
+        raise NotFound('Invalid cursor.')
+    return names.index(position['section']), position['after']
+
+def records(user, cursor=None, chunk_size=None, request=None):
+    """Export records of `user` as dicts, starting after `cursor`."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    start, after = parse_cursor(cursor) if cursor else (0, None)
+    for index, (name, rows) in enumerate(SECTIONS[start:], start):
+        for row_id, record in rows(user, after if index == start else None, chunk_size, request):
+            yield {'type': name, **record, 'cursor': encode_cursor({'section': name, 'after': row_id})}
+    yield {'type': 'end'}
+
+def export_chunks(user, cursor=None, chunk_size=None, request=None, compress=False):
+    """
+    The export as NDJSON bytes in chunks of about BUFFER_SIZE, gzip
+    compressed on the fly if `compress`.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    buffer = bytearray()
+    for record in records(user, cursor, chunk_size, request):
+        buffer += encoder.encode(record).encode()
+        buffer += b'\n'
+        if len(buffer) >= BUFFER_SIZE:
+            chunk = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+            buffer.clear()
+            if chunk:
+                yield chunk
+    chunk = bytes(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
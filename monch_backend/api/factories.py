@@ -2,7 +2,6 @@ import factory
 from factory.django import DjangoModelFactory
 from faker import Faker
 from .models import User, Post, Follow, Like
-import random
 
 fake = Faker()
 
@@ -11,8 +10,7 @@ class UserFactory(DjangoModelFactory):
         model = User
     username = factory.Faker('user_name')
     display_name = factory.Faker('name')
-    bio = factory.Faker('text')
-    avatar_url = factory.Faker('image_url')
+    bio = factory.Faker('text', max_nb_chars=150)
 
 class PostFactory(DjangoModelFactory):
     class Meta:
@@ -30,5 +28,5 @@ class FollowFactory(DjangoModelFactory):
 class LikeFactory(DjangoModelFactory):
     class Meta:
         model = Like
-    user = factory.LazyFunction(lambda: random.choice(User.objects.all()))
-    post = factory.LazyFunction(lambda: random.choice(Post.objects.all()))
\ No newline at end of file
+    user = factory.SubFactory(UserFactory)
+    post = factory.SubFactory(PostFactory)
\ No newline at end of file
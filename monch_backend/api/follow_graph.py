@@ -0,0 +1,261 @@
+import logging
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections, transaction
+from .models import Follow
+from .checks import per_process_cache
+
+# In-memory follow graph. Each process keeps both directions of every Follow
+# edge as sorted int64 arrays keyed by user id, so graph questions (mutual
+# follows, friends of friends) are set operations on small arrays instead of
+# self-joins on api_follow.
+#
+# Each web process loads the graph at startup (wsgi.py / asgi.py) from a
+# snapshot written by `manage.py build_follow_graph`, built from the Follow
+# table when there is none, and keeps it current through a change log in the
+# default cache: every follow/unfollow gets a sequence number and each process
+# replays what it hasn't seen before answering. That cache must be shared when
+# there are several processes (api/checks.py). With a per-process cache
+# (locmem) nobody else would read the log, and locmem culls old entries past
+# MAX_ENTRIES, so changes are applied to the process's graph directly instead.
+# When the log can't bridge the
+# gap (entries expired, cache cleared) the graph is rebuilt in a background
+# thread while requests go on using the one they have.
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'MFG1'
+SEQUENCE_KEY = 'follow-graph:sequence'
+BATCH_SIZE = 10000
+FOLLOW, UNFOLLOW = 'follow', 'unfollow'
+# Seconds a logged change may be missing before the log is considered broken:
+# a writer takes its sequence number just before storing the change
+MISSING_GRACE = 5
+
+def _insert(adjacency, key, value):
+    values = adjacency.get(key)
+    if values is None:
+        adjacency[key] = array('q', [value])
+        return
+    index = bisect_left(values, value)
+    if index == len(values) or values[index] != value:
+        values.insert(index, value)
+
+def _remove(adjacency, key, value):
+    values = adjacency.get(key)
+    if values is None:
+        return
+    index = bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        values.pop(index)
+        if not values:
+            del adjacency[key]
+
+
+class FollowGraph:
+    def __init__(self, sequence=0):
+        self.following = {}
+        self.followers = {}
+        self.sequence = sequence
+        self.missing_since = None
+
+    @classmethod
+    def build(cls):
+        """The graph of every Follow row, as of the current change log sequence."""
+        # Read the sequence first: changes made while scanning are replayed later
+        graph = cls(cache.get(SEQUENCE_KEY, 0))
+        edges = Follow.objects.order_by('follower_id', 'following_id').values_list('follower_id', 'following_id')
+        current, targets = None, None
+        for follower_id, following_id in edges.iterator(chunk_size=BATCH_SIZE):
+            if follower_id != current:
+                current, targets = follower_id, graph.following.setdefault(follower_id, array('q'))
+            targets.append(following_id)
+        graph._index_followers()
+        return graph
+
+    def _index_followers(self):
+        self.followers = {}
+        for follower_id in sorted(self.following):
+            for following_id in self.following[follower_id]:
+                self.followers.setdefault(following_id, array('q')).append(follower_id)
+
+    @property
+    def edge_count(self):
+        return sum(len(targets) for targets in self.following.values())
+
+    def apply(self, change, follower_id, following_id):
+        # Changes are idempotent, so replaying one already applied is harmless
+        if change == FOLLOW:
+            _insert(self.following, follower_id, following_id)
+            _insert(self.followers, following_id, follower_id)
+        else:
+            _remove(self.following, follower_id, following_id)
+            _remove(self.followers, following_id, follower_id)
+
+    def following_of(self, user_id):
+        return self.following.get(user_id, ())
+
+    def followers_of(self, user_id):
+        return self.followers.get(user_id, ())
+
+    def mutuals(self, user_id):
+        """Sorted ids of the users `user_id` follows who follow them back."""
+        return sorted(set(self.following_of(user_id)).intersection(self.followers_of(user_id)))
+
+    def suggestions(self, user_id, limit):
+        """
+        Up to `limit` (user id, [ids of followed users who follow them]) pairs
+        of users `user_id` doesn't follow yet, the most followed by the people
+        they follow first, then the most followed overall.
+        """
+        following = self.following_of(user_id)
+        fan_out = settings.FOLLOW_GRAPH_SUGGESTION_FAN_OUT
+        # Look through the best connected accounts first when capping the scan
+        via = sorted(following, key=lambda pk: -len(self.followers_of(pk)))[:fan_out]
+        scores = Counter()
+        for friend_id in via:
+            targets = self.following_of(friend_id)
+            # A sample of large lists rather than their first (lowest, oldest) ids
+            scores.update(random.sample(targets, fan_out) if len(targets) > fan_out else targets)
+
+        excluded = set(following)
+        excluded.add(user_id)
+        ranked = sorted(
+            (pk for pk in scores if pk not in excluded),
+            key=lambda pk: (-scores[pk], -len(self.followers_of(pk)), pk),
+        )[:limit]
+        known = set(via)
+        return [(pk, [friend for friend in self.followers_of(pk) if friend in known]) for pk in ranked]
+
+    def dump(self, path):
+        """Write a CSR snapshot (user ids, offsets, targets) of the following lists."""
+        user_ids = array('q', sorted(self.following))
+        offsets, targets = array('q', [0]), array('q')
+        for user_id in user_ids:
+            targets.extend(self.following[user_id])
+            offsets.append(len(targets))
+        partial = f'{path}.partial'
+        with open(partial, 'wb') as file:
+            file.write(SNAPSHOT_MAGIC + struct.pack('<qqq', self.sequence, len(user_ids), len(targets)))
+            for values in (user_ids, offsets, targets):
+                values.tofile(file)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f'{path} is not a follow graph snapshot')
+            sequence, user_count, edge_count = struct.unpack('<qqq', file.read(24))
+            user_ids, offsets, targets = array('q'), array('q'), array('q')
+            user_ids.fromfile(file, user_count)
+            offsets.fromfile(file, user_count + 1)
+            targets.fromfile(file, edge_count)
+        graph = cls(sequence)
+        for index, user_id in enumerate(user_ids):
+            graph.following[user_id] = targets[offsets[index]:offsets[index + 1]]
+        graph._index_followers()
+        return graph
+
+    def catch_up(self):
+        """Replay logged changes this graph hasn't seen; False if the log can't bridge the gap."""
+        latest = cache.get(SEQUENCE_KEY, 0)
+        if latest < self.sequence:
+            return False
+        if latest == self.sequence:
+            return True
+        if latest - self.sequence > settings.FOLLOW_GRAPH_MAX_REPLAY:
+            return False
+        keys = [_change_key(sequence) for sequence in range(self.sequence + 1, latest + 1)]
+        changes = cache.get_many(keys)
+        for key in keys:
+            if key not in changes:
+                # Possibly still being written: stop here for now, but not for long
+                if self.missing_since is None:
+                    self.missing_since = time.monotonic()
+                return time.monotonic() - self.missing_since < MISSING_GRACE
+            self.apply(*changes[key])
+            self.sequence += 1
+            self.missing_since = None
+        return True
+
+
+_graph = None
+_lock = threading.Lock()
+_rebuilding = threading.Lock()
+
+def _change_key(sequence):
+    return f'follow-graph:change:{sequence}'
+
+def _load():
+    path = settings.FOLLOW_GRAPH_SNAPSHOT
+    if path and os.path.exists(path):
+        graph = FollowGraph.load(path)
+        if graph.catch_up():
+            return graph
+    graph = FollowGraph.build()
+    graph.catch_up()
+    return graph
+
+def load():
+    """(Re)load this process's graph from the snapshot or the Follow table."""
+    global _graph
+    graph = _load()
+    with _lock:
+        _graph = graph
+    return graph
+
+def warm_up():
+    """Load the graph before serving requests; called by wsgi.py and asgi.py."""
+    try:
+        load()
+    except DatabaseError:
+        # E.g. not migrated yet; the first request that needs it loads it
+        logger.exception('Loading the follow graph at startup failed')
+
+def _rebuild():
+    try:
+        load()
+    except Exception:
+        logger.exception('Rebuilding the follow graph failed')
+    finally:
+        connections.close_all()
+        _rebuilding.release()
+
+def follow_graph():
+    """This process's graph, brought up to date with the change log."""
+    with _lock:
+        graph = _graph
+        if graph is not None and graph.catch_up():
+            return graph
+    if graph is None:
+        # Not warmed up (management commands, tests)
+        return load()
+    # The log can't bridge the gap: answer from this graph until the rebuild is done
+    if _rebuilding.acquire(blocking=False):
+        threading.Thread(target=_rebuild, name='follow-graph-rebuild', daemon=True).start()
+    return graph
+
+def record(change, follower_id, following_ids):
+    """Log follows/unfollows of `follower_id` once the current transaction commits."""
+    def log():
+        if per_process_cache():
+            with _lock:
+                if _graph is not None:
+                    for following_id in following_ids:
+                        _graph.apply(change, follower_id, following_id)
+            return
+        cache.add(SEQUENCE_KEY, 0, None)
+        for following_id in following_ids:
+            sequence = cache.incr(SEQUENCE_KEY)
+            cache.set(_change_key(sequence), (change, follower_id, following_id), settings.FOLLOW_GRAPH_LOG_TIMEOUT)
+    if following_ids:
+        transaction.on_commit(log)
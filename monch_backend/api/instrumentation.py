@@ -0,0 +1,199 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
+from rest_framework import serializers
+
+# Per-request instrumentation, cheap enough to leave on in production.
+# RequestMetricsMiddleware records each request's SQL query count and time,
+# the time spent in serializers (their own queries excluded) and the response
+# size, labelled with the view and action that served it (PostViewSet.list).
+# Each response gets a Server-Timing header; requests slower than
+# SLOW_REQUEST_MS are logged with their most repeated SQL shapes, since the
+# same shape many times in one request is the N+1 fingerprint; and everything
+# feeds the Prometheus histograms served by metrics_view.
+#
+# Queries are counted by an execute wrapper on every database connection and
+# serializers by timing Serializer.data / ListSerializer.data (install(),
+# called by ApiConfig.ready). Both read the current request from a context
+# variable, which sync_to_async carries over, so async views are measured too.
+#
+# With several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+# directory so metrics_view reports all of them (see prometheus_client's
+# multiprocess mode).
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+REQUEST_SECONDS = Histogram(
+    'monch_request_seconds', 'Time to build the response', ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS,
+)
+DB_SECONDS = Histogram('monch_request_db_seconds', 'Time spent in SQL queries', ['endpoint'], buckets=LATENCY_BUCKETS)
+SERIALIZE_SECONDS = Histogram(
+    'monch_request_serialize_seconds', 'Time spent in serializers, queries excluded', ['endpoint'], buckets=LATENCY_BUCKETS,
+)
+QUERIES = Histogram('monch_request_queries', 'SQL queries per request', ['endpoint'], buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+RESPONSE_BYTES = Histogram(
+    'monch_response_bytes', 'Response body size', ['endpoint'], buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576),
+)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'endpoint', 'queries', 'db_time', 'serialize_time', 'serializing', 'shapes')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.endpoint = 'unmatched'
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serializing = False
+        self.shapes = Counter()
+
+
+@lru_cache(maxsize=1024)
+def sql_shape(sql):
+    """`sql` with literals and IN lists collapsed, so N+1 queries share a shape."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+\b', '?', sql)
+    sql = re.sub(r'%s|\?', '?', sql)
+    return re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries += 1
+        metrics.shapes[sql_shape(sql)] += 1
+
+def _timed(data):
+    def timed_data(self):
+        metrics = _current.get()
+        if metrics is None or metrics.serializing:
+            return data.fget(self)
+        # Outermost serializer only; its queries are already in db_time
+        metrics.serializing = True
+        started, db_time = time.perf_counter(), metrics.db_time
+        try:
+            return data.fget(self)
+        finally:
+            metrics.serializing = False
+            metrics.serialize_time += time.perf_counter() - started - (metrics.db_time - db_time)
+    return property(timed_data)
+
+def _watch_connection(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+def install():
+    """Count queries on every database connection and time serializers."""
+    connection_created.connect(_watch_connection, dispatch_uid='api.instrumentation')
+    for connection in connections.all(initialized_only=True):
+        _watch_connection(connection)
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(cls.data.fget, 'timed', False):
+            cls.data = _timed(cls.data)
+            cls.data.fget.timed = True
+
+def endpoint_name(view_func, method):
+    # ViewSet.action for viewsets, View.method for other DRF views
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__qualname__', 'unknown')
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{cls.__name__}.{actions.get(method.lower(), method.lower())}'
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.endpoint = endpoint_name(view_func, request.method)
+
+    def finish(self, request, response, metrics):
+        elapsed = time.perf_counter() - metrics.started
+        size = None if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+            f'serialize;dur={metrics.serialize_time * 1000:.1f}',
+            f'total;dur={elapsed * 1000:.1f}',
+        ])
+
+        endpoint = metrics.endpoint
+        REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(elapsed)
+        DB_SECONDS.labels(endpoint).observe(metrics.db_time)
+        SERIALIZE_SECONDS.labels(endpoint).observe(metrics.serialize_time)
+        QUERIES.labels(endpoint).observe(metrics.queries)
+        if size is not None:
+            RESPONSE_BYTES.labels(endpoint).observe(size)
+
+        if elapsed * 1000 >= settings.SLOW_REQUEST_MS:
+            repeated = [(count, shape) for shape, count in metrics.shapes.most_common(3) if count > 1]
+            logger.warning(
+                'Slow request %s %s (%s) %s: %.0f ms, %d queries in %.0f ms, serialize %.0f ms, %s bytes%s',
+                request.method, request.get_full_path(), endpoint, response.status_code, elapsed * 1000,
+                metrics.queries, metrics.db_time * 1000, metrics.serialize_time * 1000,
+                'streamed' if size is None else size,
+                ''.join(f'\n  {count}x {shape[:300]}' for count, shape in repeated),
+            )
+        return response
+
+
+def metrics_view(request):
+    """Prometheus text format; needs `Authorization: Bearer <METRICS_TOKEN>`, or DEBUG without a token."""
+    if settings.METRICS_TOKEN:
+        if not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+            return HttpResponse(status=403)
+    elif not settings.DEBUG:
+        return HttpResponse(status=403)
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,205 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Q
+from .models import Like, Post, User
+from . import response_cache
+from .batch import bump_counters, delete_returning, insert_returning
+
+# Write-behind likes, enabled by LIKE_WRITE_BEHIND. A like or unlike doesn't
+# touch the likes table: it is logged in the cache as an intent
+# (user, post, liked) under a sequence number, and the user's latest intent
+# per post is kept as "pending" so their own pages show it right away
+# (ViewerState adds it over what the database says, counts included). A
+# pending entry is dropped once its intent is written, unless a newer click
+# replaced it meanwhile; one landing between that check and the delete loses
+# its entry (not its intent) and shows after the next flush instead.
+#
+# flush() applies the log in order, at most LIKE_FLUSH_BATCH_SIZE intents at a
+# time: intents are coalesced to the last one per (user, post), new likes are
+# inserted and removed ones deleted with one statement each, and likes_count
+# is moved by one UPDATE per distinct delta, so a burst of likes on a hot post
+# is a few statements instead of a transaction per click. The statements
+# (api/batch.py's insert_returning / delete_returning) return the rows they
+# actually wrote, which is what the counts are moved by; they send no
+# signals, so the response cache versions are bumped here too.
+#
+# Every process runs a flusher thread (LIKE_FLUSH_THREAD) started by its first
+# like, and `manage.py flush_likes` flushes too. A lock in the cache lets one
+# flush run at a time. Until it is flushed a like exists only in the cache,
+# although the client was answered 201: the cache must be shared and
+# persistent (Redis with persistence on), and startup fails on a per-process
+# one (api/checks.py).
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_KEY = 'likes:sequence'
+FLUSHED_KEY = 'likes:flushed'
+LOCK_KEY = 'likes:flush-lock'
+LOCK_TIMEOUT = 60
+# Seconds a logged intent may be missing before it is skipped: a writer takes
+# its sequence number just before storing the intent
+MISSING_GRACE = 5
+
+def _intent_key(sequence):
+    return f'likes:intent:{sequence}'
+
+def _pending_key(user_id, post_id):
+    return f'likes:pending:{user_id}:{post_id}'
+
+def pending(user_id, post_ids):
+    """{post id: liked} of `user_id`'s intents on `post_ids` that may not be flushed yet."""
+    keys = {_pending_key(user_id, post_id): post_id for post_id in post_ids}
+    return {keys[key]: liked for key, (_, liked) in cache.get_many(list(keys)).items()}
+
+def liked_state(user_id, post_ids):
+    """{post id: whether `user_id` likes it}, pending intents included."""
+    state = pending(user_id, post_ids)
+    unknown = [post_id for post_id in post_ids if post_id not in state]
+    liked = set(Like.objects.filter(user_id=user_id, post_id__in=unknown).values_list('post_id', flat=True))
+    state.update({post_id: post_id in liked for post_id in unknown})
+    return state
+
+def set_liked(user, post_ids, liked):
+    """Buffer `user` liking (or unliking) `post_ids`; returns the ids whose state changed."""
+    state = liked_state(user.pk, post_ids)
+    changed = [post_id for post_id in post_ids if state[post_id] != liked]
+    if changed:
+        record(user.pk, changed, liked)
+    return changed
+
+def record(user_id, post_ids, liked):
+    try:
+        last = cache.incr(SEQUENCE_KEY, len(post_ids))
+    except ValueError:
+        cache.add(SEQUENCE_KEY, 0, None)
+        last = cache.incr(SEQUENCE_KEY, len(post_ids))
+    first = last - len(post_ids) + 1
+    timeout = settings.LIKE_BUFFER_TIMEOUT
+    cache.set_many({_intent_key(first + index): (user_id, post_id, liked) for index, post_id in enumerate(post_ids)}, timeout)
+    # With the intent's sequence number, so flush() can tell whether it was written
+    cache.set_many({_pending_key(user_id, post_id): (first + index, liked) for index, post_id in enumerate(post_ids)}, timeout)
+    # The viewer's conditional GETs must not answer 304 with their old state
+    response_cache.bump(f'viewer:{user_id}')
+    start_flusher()
+
+def flush():
+    """Apply the next batch of logged intents; returns how many were consumed (0: nothing to do or busy)."""
+    if not cache.add(LOCK_KEY, 1, LOCK_TIMEOUT):
+        return 0
+    try:
+        flushed = cache.get(FLUSHED_KEY, 0)
+        latest = cache.get(SEQUENCE_KEY, 0)
+        if latest < flushed:
+            logger.warning('Like log restarted at %d after %d was flushed', latest, flushed)
+            flushed = 0
+        start = flushed
+        sequences = range(flushed + 1, min(latest, flushed + settings.LIKE_FLUSH_BATCH_SIZE) + 1)
+        intents = cache.get_many([_intent_key(sequence) for sequence in sequences])
+
+        wanted = {}
+        for sequence in sequences:
+            intent = intents.get(_intent_key(sequence))
+            if intent is None:
+                missing_since = cache.get_or_set(f'likes:missing:{sequence}', time.time(), LOCK_TIMEOUT)
+                if time.time() - missing_since < MISSING_GRACE:
+                    # Possibly still being written: stop here for now
+                    break
+                logger.warning('Like intent %d is missing, skipped', sequence)
+            else:
+                user_id, post_id, liked = intent
+                wanted[user_id, post_id] = liked
+            flushed = sequence
+
+        apply(wanted)
+        cache.set(FLUSHED_KEY, flushed, None)
+        cache.delete_many([_intent_key(sequence) for sequence in sequences if sequence <= flushed])
+        _forget_pending(wanted, flushed)
+        return flushed - start
+    finally:
+        cache.delete(LOCK_KEY)
+
+def _forget_pending(written, flushed):
+    """Drop the pending entries of `written` (user id, post id) pairs whose intent is at or before `flushed`."""
+    keys = [_pending_key(user_id, post_id) for user_id, post_id in written]
+    entries = cache.get_many(keys)
+    cache.delete_many([key for key, (sequence, _) in entries.items() if sequence <= flushed])
+
+def apply(wanted):
+    """Make the likes table match {(user id, post id): liked}."""
+    if not wanted:
+        return
+    with transaction.atomic():
+        users = {user_id for user_id, _ in wanted}
+        posts = {post_id for _, post_id in wanted}
+        # Posts or users deleted since the click
+        live_posts = set(Post.objects.filter(pk__in=posts).values_list('id', flat=True))
+        live_users = set(User.objects.filter(pk__in=users).values_list('id', flat=True))
+
+        rows = [
+            {'user_id': user_id, 'post_id': post_id} for (user_id, post_id), liked in wanted.items()
+            if liked and user_id in live_users and post_id in live_posts
+        ]
+        # Likes already there are skipped, and unlikes of missing ones find nothing
+        new = insert_returning(Like, rows, ('user_id', 'post_id'))
+        unliked = defaultdict(list)
+        for (user_id, post_id), liked in wanted.items():
+            if not liked:
+                unliked[post_id].append(user_id)
+        removed = []
+        if unliked:
+            likes = Like.objects.filter(reduce(or_, (
+                Q(post_id=post_id, user_id__in=user_ids) for post_id, user_ids in unliked.items()
+            )))
+            removed = delete_returning(likes, ('user_id', 'post_id'))
+
+        deltas = defaultdict(int)
+        for _, post_id in new:
+            deltas[post_id] += 1
+        for _, post_id in removed:
+            deltas[post_id] -= 1
+        by_delta = defaultdict(list)
+        for post_id, delta in deltas.items():
+            if delta:
+                by_delta[delta].append(post_id)
+        for delta, post_ids in by_delta.items():
+            bump_counters(Post, post_ids, likes_count=delta)
+        changed = [f'post:{post_id}' for post_id in deltas]
+        transaction.on_commit(lambda: response_cache.bump(*changed))
+
+def flush_all():
+    """Flush until the log is empty (or another flusher holds the lock)."""
+    while flush():
+        pass
+
+
+_flusher = None
+_flusher_lock = threading.Lock()
+
+def start_flusher():
+    global _flusher
+    if _flusher is not None or not settings.LIKE_FLUSH_THREAD:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_forever, name='like-flusher', daemon=True)
+            _flusher.start()
+            atexit.register(flush_all)
+
+def _flush_forever():
+    while True:
+        time.sleep(settings.LIKE_FLUSH_INTERVAL)
+        try:
+            flush_all()
+        except Exception:
+            logger.exception('Flushing likes failed')
+        finally:
+            # This thread's connections; don't hold one open while sleeping
+            connections.close_all()
@@ -0,0 +1,131 @@
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from api.authentication import tokens_for
+from api.models import Post
+
+SERVERS = {
+    # name: (command, extra environment); both servers read the worker count from WEB_CONCURRENCY
+    'wsgi': (['gunicorn', 'monch_backend.wsgi:application', '--bind', '127.0.0.1:{port}'], {}),
+    'asgi': (
+        ['uvicorn', 'monch_backend.asgi:application', '--port', '{port}', '--no-access-log'],
+        {'ASYNC_READ_VIEWS': '1'},
+    ),
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the WSGI server (gunicorn) with the ASGI server (uvicorn, async read views) '
+        'at the same worker count on the home feed, post detail, profile and whoami reads'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Username the requests authenticate as')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+        parser.add_argument('--requests', type=int, default=400, help='Requests per concurrency level')
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=sorted(SERVERS, reverse=True))
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'].lower())
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User '{options['user']}' not found")
+        token = str(tokens_for(user).access_token)
+        post_id = Post.objects.filter(parent_post__isnull=True).order_by('-id').values_list('id', flat=True).first()
+        if post_id is None:
+            raise CommandError('No posts to read; run generate_data first')
+        paths = ['/api/posts/following/', f'/api/posts/{post_id}/', f'/api/users/{user.username}/', '/api/whoami/']
+
+        self.stdout.write(f"{options['workers']} workers, {options['requests']} requests per level over {', '.join(paths)}")
+        self.stdout.write(f"{'server':<6} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        for name in options['servers']:
+            port = free_port()
+            server = self.start(name, port, options['workers'])
+            try:
+                for concurrency in options['concurrency']:
+                    row = self.run_level(port, paths, token, concurrency, options['requests'])
+                    self.stdout.write(f'{name:<6} {concurrency:>5} ' + ' '.join(f'{value:>8.1f}' for value in row[:4]) + f' {row[4]:>6}')
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    def start(self, name, port, workers):
+        command, environment = SERVERS[name]
+        command = [part.format(port=port) for part in command]
+        server = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env={**os.environ, **environment, 'WEB_CONCURRENCY': str(workers)},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(
+                    f"{name} server exited: is {command[0]} installed, and CACHE_BACKEND shared when running several workers?"
+                )
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=1):
+                    break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            server.terminate()
+            raise CommandError(f'{name} server did not start')
+        # Warm every worker up (imports, connections, caches)
+        self.run_level(port, ['/health/'], None, workers * 4, workers * 20)
+        return server
+
+    def run_level(self, port, paths, token, concurrency, count):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        per_client = [count // concurrency + (1 if index < count % concurrency else 0) for index in range(concurrency)]
+
+        def client(index):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            timings, errors = [], 0
+            for number in range(per_client[index]):
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', paths[(index + number) % len(paths)], headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status != 200:
+                        errors += 1
+                except (OSError, http.client.HTTPException):
+                    errors += 1
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                timings.append(time.perf_counter() - started)
+            connection.close()
+            return timings, errors
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(client, range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        timings = [timing * 1000 for result in results for timing in result[0]]
+        errors = sum(result[1] for result in results)
+        return (
+            len(timings) / elapsed,
+            statistics.median(timings),
+            percentile(timings, 0.95),
+            percentile(timings, 0.99),
+            errors,
+        )
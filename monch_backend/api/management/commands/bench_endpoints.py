@@ -0,0 +1,451 @@
+import io
+import json
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import URLPattern, URLResolver, get_resolver, resolve
+from PIL import Image
+from api import search
+from api.authentication import tokens_for
+from api.models import Follow, Like, Post, User
+
+# Endpoint benchmark: seeds a throwaway test database with generate_data,
+# drives every route of api/urls.py through the Django test client and
+# reports p50/p95/p99 latency, SQL queries and response size per scenario.
+#
+# Scenarios run round-robin, one request each per round, so caches and the
+# follow graph are in the steady state a busy process would see; writes come
+# in pairs that undo each other (like/unlike, follow/unfollow, create/delete)
+# so the dataset doesn't drift over the run. Requests authenticate as the
+# timeline-owning user who follows the most accounts, with a real JWT.
+#
+# Budgets (api/bench_budgets.json) cap each scenario's worst query count and
+# response size and its p95 latency; the run fails when one is exceeded.
+# Query counts don't depend on the machine or dataset size, only on which
+# relations (replies, reposts, media) show up on a page, so those budgets are
+# the count with all of them present: a new N+1 fails the run on any dataset. Latency budgets are generous, and
+# --latency-scale stretches them on slow machines.
+#
+# --output writes the results as JSON; --compare prints the change against
+# such a file, e.g. one written on the previous commit.
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'bench_budgets.json')
+# Requests per scenario for the ones that hash passwords
+SLOW_REQUESTS = 5
+
+def percentiles(values):
+    if len(values) < 2:
+        return values * 3
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+def url_routes(patterns, prefix=''):
+    """Route of every URL pattern (regex or path syntax), format-suffix variants left out."""
+    for pattern in patterns:
+        # Joined the way ResolverMatch.route joins them
+        part = str(pattern.pattern)
+        route = prefix + (part[1:] if prefix and part.startswith('^') else part)
+        if isinstance(pattern, URLResolver):
+            yield from url_routes(pattern.url_patterns, route)
+        elif isinstance(pattern, URLPattern) and 'format>' not in route:
+            yield route
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 80, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class Step:
+    """
+    One request of a scenario. `path` and `data` may be callables of the
+    round's state, which earlier steps fill with the `save` field of their
+    JSON response (a created post's id, say).
+    """
+
+    def __init__(self, name, method, path, data=None, *, client='viewer', json=False, save=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.client = client
+        self.json = json
+        self.save = save
+
+    def resolve(self, state):
+        path = self.path(state) if callable(self.path) else self.path
+        data = self.data(state) if callable(self.data) else self.data
+        return path, data
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every API route in-process on a generated dataset: latency percentiles, '
+        'query counts and response sizes, checked against api/bench_budgets.json'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Dataset size, see generate_data')
+        parser.add_argument('--posts-per-user', type=float, default=20)
+        parser.add_argument('--follows-per-user', type=float, default=50)
+        parser.add_argument('--likes-per-post', type=float, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured rounds first')
+        parser.add_argument('--only', nargs='+', default=[], help='Scenarios to run (prefixes, e.g. posts. users.retrieve)')
+        parser.add_argument('--budgets', default=BUDGETS_PATH, help='Budgets file; "" to skip the checks')
+        parser.add_argument('--latency-scale', type=float, default=1.0, help='Multiply every latency budget')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Results JSON of an earlier run to show the difference against')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database, and reuse it when already seeded')
+
+    def handle(self, *args, **options):
+        self.options = options
+        budgets = self.load_budgets(options['budgets'])
+        previous = self.load_json(options['compare']) if options['compare'] else None
+
+        with self.test_database():
+            with tempfile.TemporaryDirectory() as directory, override_settings(
+                # Nothing the benchmark writes may reach the real storage, cache or graph snapshot
+                STORAGES={
+                    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+                    'staticfiles': settings.STORAGES['staticfiles'],
+                },
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench'}},
+                FOLLOW_GRAPH_SNAPSHOT=os.path.join(directory, 'follow_graph.bin'),
+                SLOW_REQUEST_MS=float('inf'),
+            ):
+                dataset = self.seed()
+                results = self.run(self.scenarios())
+
+        report = {
+            'commit': git_commit(),
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'dataset': dataset,
+            'requests': options['requests'],
+            'scenarios': results,
+        }
+        self.print_results(results, previous)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+                output.write('\n')
+            self.stdout.write(f"Results written to {options['output']}")
+
+        failures = self.over_budget(results, budgets)
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError(f'{len(failures)} budget(s) exceeded')
+        self.stdout.write(self.style.SUCCESS('Every scenario within budget' if budgets else 'Done (no budgets checked)'))
+
+    @contextmanager
+    def test_database(self):
+        """Run on a throwaway test database (kept with --keepdb)."""
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=self.options['keepdb'])
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=self.options['keepdb'])
+            teardown_test_environment()
+
+    def load_json(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+
+    def load_budgets(self, path):
+        if not path:
+            return {}
+        budgets = self.load_json(path)['scenarios']
+        scale = self.options['latency_scale']
+        for budget in budgets.values():
+            if 'p95_ms' in budget:
+                budget['p95_ms'] *= scale
+        return budgets
+
+    # Dataset
+
+    def seed(self):
+        options = self.options
+        if not (options['keepdb'] and User.objects.exists()):
+            self.stdout.write(f"Seeding {options['users']} users (seed {options['seed']})...")
+            call_command(
+                'generate_data', users=options['users'], posts_per_user=options['posts_per_user'],
+                follows_per_user=options['follows_per_user'], likes_per_post=options['likes_per_post'],
+                seed=options['seed'], timelines=100, stdout=io.StringIO(),
+            )
+        else:
+            # Rebuilt from the database: the snapshot of the first run is gone
+            call_command('build_follow_graph', stdout=io.StringIO())
+
+        timeline_users = User.objects.order_by('id').values_list('id', flat=True)[:100]
+        self.viewer = User.objects.filter(id__in=list(timeline_users)).order_by('-following_count', 'id').first()
+        self.popular = User.objects.exclude(pk=self.viewer.pk).order_by('-follower_count', 'id').first()
+        self.stranger = User.objects.exclude(followers__follower=self.viewer).exclude(pk=self.viewer.pk).order_by('id').first()
+        self.strangers = list(
+            User.objects.exclude(followers__follower=self.viewer).exclude(pk=self.viewer.pk)
+            .order_by('-id').values_list('username', flat=True)[:20]
+        )
+        top_level = Post.objects.filter(parent_post__isnull=True, repost_of__isnull=True)
+        self.thread = top_level.order_by('-replies_count', 'id').first()
+        self.recent = list(top_level.order_by('-created_at', '-id').values_list('id', flat=True)[:20])
+        self.unliked = top_level.exclude(likes__user=self.viewer).order_by('-id').first()
+        self.unliked_ids = list(
+            top_level.exclude(likes__user=self.viewer).order_by('id').values_list('id', flat=True)[:20]
+        )
+        self.word = max(search.search_terms(self.thread.content), key=len)
+        self.follow = Follow.objects.filter(follower=self.viewer).order_by('id').first()
+        self.like = Like.objects.filter(user=self.viewer).order_by('id').first() or Like.objects.order_by('id').first()
+        self.image = png_bytes()
+
+        dataset = {
+            'users': User.objects.count(),
+            'posts': Post.objects.count(),
+            'follows': Follow.objects.count(),
+            'likes': Like.objects.count(),
+            'seed': self.options['seed'],
+            'viewer': {'username': self.viewer.username, 'following': self.viewer.following_count},
+        }
+        self.admin, _ = User.objects.get_or_create(username='bench-admin', defaults={'is_staff': True})
+        return dataset
+
+    # Scenarios
+
+    def scenarios(self):
+        """Groups of steps; a group's steps run in order, once per round."""
+        viewer, popular, thread = self.viewer.username, self.popular.username, self.thread.pk
+        upload = lambda: io.BytesIO(self.image)  # noqa: E731
+        run = uuid.uuid4().hex[:8]  # registered usernames stay unique with --keepdb
+        groups = [
+            [Step('api.root', 'GET', '/api/')],
+            [Step('posts.list', 'GET', '/api/posts/')],
+            [Step('posts.list.anonymous', 'GET', '/api/posts/', client='anonymous')],
+            [Step('posts.multi_get', 'GET', '/api/posts/?ids=' + ','.join(map(str, self.recent)))],
+            [Step('posts.search', 'GET', f'/api/posts/search/?q={self.word}')],
+            [Step('posts.following', 'GET', '/api/posts/following/')],
+            [Step('posts.retrieve', 'GET', f'/api/posts/{thread}/')],
+            [Step('posts.retrieve.anonymous', 'GET', f'/api/posts/{thread}/', client='anonymous')],
+            [Step('posts.replies', 'GET', f'/api/posts/{thread}/replies/')],
+            [Step('posts.thread', 'GET', f'/api/posts/{thread}/thread/')],
+            [
+                Step('posts.create', 'POST', '/api/posts/', lambda state: {'content': 'Benchmark post'}, save='id'),
+                Step('posts.destroy', 'DELETE', lambda state: f"/api/posts/{state['id']}/"),
+            ],
+            [
+                Step('posts.create.media', 'POST', '/api/posts/', lambda state: {'content': 'Benchmark photo', 'media': upload()}, save='id'),
+                Step('posts.media', 'GET', lambda state: f"/api/posts/{state['id']}/media/"),
+                Step('posts.media.retry', 'POST', lambda state: f"/api/posts/{state['id']}/media/"),
+                Step('posts.update', 'PATCH', lambda state: f"/api/posts/{state['id']}/", {'content': 'Edited'}),
+                Step('posts.destroy.media', 'DELETE', lambda state: f"/api/posts/{state['id']}/"),
+            ],
+            [
+                Step('posts.repost', 'POST', f'/api/posts/{thread}/toggle_repost/'),
+                Step('posts.unrepost', 'POST', f'/api/posts/{thread}/toggle_repost/'),
+            ],
+            [
+                Step('posts.like', 'POST', f'/api/posts/{self.unliked.pk}/like/'),
+                Step('posts.unlike', 'DELETE', f'/api/posts/{self.unliked.pk}/like/'),
+            ],
+            [Step('users.list', 'GET', '/api/users/')],
+            [Step('users.multi_get', 'GET', '/api/users/?usernames=' + ','.join(self.strangers))],
+            [Step('users.retrieve', 'GET', f'/api/users/{popular}/')],
+            [Step('users.retrieve.anonymous', 'GET', f'/api/users/{popular}/', client='anonymous')],
+            [Step('users.posts', 'GET', f'/api/users/{popular}/posts/')],
+            [Step('users.replies', 'GET', f'/api/users/{popular}/replies/')],
+            [Step('users.followers', 'GET', f'/api/users/{popular}/followers/')],
+            [Step('users.following', 'GET', f'/api/users/{viewer}/following/')],
+            [Step('users.mutuals', 'GET', f'/api/users/{viewer}/mutuals/')],
+            [Step('users.suggestions', 'GET', '/api/users/suggestions/')],
+            [Step('users.search', 'GET', f'/api/users/search/?q={popular[:3]}')],
+            [Step('users.check_username', 'GET', '/api/users/check-username/?username=bench-nobody')],
+            [Step('users.update', 'PATCH', f'/api/users/{viewer}/', {'bio': 'Benchmarking'}, json=True)],
+            [Step('follows.list', 'GET', '/api/follows/')],
+            [Step('follows.retrieve', 'GET', f'/api/follows/{self.follow.pk}/')],
+            [Step('follows.test_follow', 'GET', '/api/follows/test_follow/')],
+            [Step('follows.is_following', 'GET', f'/api/follows/is_following/?username={popular}')],
+            [Step('follows.state', 'GET', '/api/follows/state/?usernames=' + ','.join(self.strangers))],
+            [
+                Step('follows.toggle.follow', 'POST', '/api/follows/toggle/', {'username': self.stranger.username}, json=True),
+                Step('follows.toggle.unfollow', 'POST', '/api/follows/toggle/', {'username': self.stranger.username}, json=True),
+            ],
+            [
+                Step('follows.bulk.follow', 'POST', '/api/follows/bulk/', {'usernames': self.strangers}, json=True),
+                Step('follows.bulk.unfollow', 'DELETE', '/api/follows/bulk/', {'usernames': self.strangers}, json=True),
+            ],
+            [Step('likes.list', 'GET', '/api/likes/')],
+            [Step('likes.retrieve', 'GET', f'/api/likes/{self.like.pk}/')],
+            [Step('likes.liked_posts', 'GET', '/api/likes/liked-posts/')],
+            [
+                Step('likes.bulk.like', 'POST', '/api/likes/bulk/', {'post_ids': self.unliked_ids}, json=True),
+                Step('likes.bulk.unlike', 'DELETE', '/api/likes/bulk/', {'post_ids': self.unliked_ids}, json=True),
+            ],
+            [Step('whoami', 'GET', '/api/whoami/')],
+            [Step('cache_stats', 'GET', '/api/cache-stats/', client='admin')],
+            [Step('export', 'GET', '/api/export/')],
+            [
+                Step('auth.refresh', 'POST', '/api/token/refresh/', lambda state: {'refresh': str(tokens_for(self.viewer))}, json=True),
+                Step('auth.logout', 'POST', '/api/logout/', lambda state: {'refresh': str(tokens_for(self.viewer))}, json=True),
+            ],
+        ]
+        slow = [
+            [Step('auth.login', 'POST', '/api/login/', {'username': viewer, 'password': 'password'}, json=True, client='anonymous')],
+            [Step(
+                'users.register', 'POST', '/api/users/register/',
+                lambda state: {'username': f"bench{run}r{state['round']}", 'password': 'password'}, json=True, client='anonymous',
+            )],
+        ]
+        only = self.options['only']
+        if only:
+            keep = lambda group: any(step.name.startswith(prefix) for step in group for prefix in only)  # noqa: E731
+            groups, slow = [group for group in groups if keep(group)], [group for group in slow if keep(group)]
+        if not only:
+            self.warn_uncovered(groups + slow)
+        return groups, slow
+
+    def warn_uncovered(self, groups):
+        state = {'id': self.thread.pk, 'round': 0}
+        covered = {resolve(step.resolve(state)[0].partition('?')[0]).route for group in groups for step in group}
+        uncovered = [route for route in url_routes(get_resolver().url_patterns) if route.startswith('api/') and route not in covered]
+        if uncovered:
+            self.stderr.write('Routes without a scenario: ' + ', '.join(uncovered))
+
+    # Measuring
+
+    def clients(self):
+        viewer, admin = Client(), Client()
+        viewer.defaults['HTTP_AUTHORIZATION'] = f'Bearer {tokens_for(self.viewer).access_token}'
+        admin.defaults['HTTP_AUTHORIZATION'] = f'Bearer {tokens_for(self.admin).access_token}'
+        return {'viewer': viewer, 'admin': admin, 'anonymous': Client()}
+
+    def run(self, scenarios):
+        groups, slow = scenarios
+        clients = self.clients()
+        samples = {}
+        rounds = self.options['warmup'] + self.options['requests']
+        self.stdout.write(f"Running {sum(map(len, groups + slow))} scenarios, {self.options['requests']} requests each...")
+        for number in range(rounds):
+            measured = number >= self.options['warmup']
+            for group in groups:
+                self.run_group(group, clients, samples, number, measured)
+            if number < SLOW_REQUESTS + 1:
+                for group in slow:
+                    self.run_group(group, clients, samples, number, number >= 1)
+        return {name: self.summarize(sample) for name, sample in samples.items()}
+
+    def run_group(self, group, clients, samples, number, measured):
+        state = {'round': number}
+        for step in group:
+            path, data = step.resolve(state)
+            response, elapsed, queries, size = self.request(clients[step.client], step, path, data)
+            if step.save and response.status_code < 400:
+                state[step.save] = response.json()[step.save]
+            sample = samples.setdefault(step.name, {'method': step.method, 'path': path, 'timings': [], 'queries': [], 'bytes': [], 'errors': {}})
+            if response.status_code >= 400:
+                sample['errors'][response.status_code] = sample['errors'].get(response.status_code, 0) + 1
+            if measured:
+                sample['timings'].append(elapsed * 1000)
+                sample['queries'].append(queries)
+                sample['bytes'].append(size)
+
+    def request(self, client, step, path, data):
+        kwargs = {}
+        if step.json:
+            kwargs = {'data': json.dumps(data), 'content_type': 'application/json'}
+        elif data is not None:
+            # Only post() encodes a form itself
+            kwargs = {'data': data} if step.method == 'POST' else {
+                'data': encode_multipart(BOUNDARY, data), 'content_type': MULTIPART_CONTENT,
+            }
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        # Some views print debugging lines; keep them out of the report
+        with connection.execute_wrapper(count), redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            response = getattr(client, step.method.lower())(path, **kwargs)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - started
+        return response, elapsed, queries, len(body)
+
+    def summarize(self, sample):
+        timings = sample['timings']
+        p50, p95, p99 = percentiles(timings)
+        return {
+            'method': sample['method'],
+            'path': sample['path'],
+            'requests': len(timings),
+            'p50_ms': round(p50, 2),
+            'p95_ms': round(p95, 2),
+            'p99_ms': round(p99, 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries': max(sample['queries']),
+            'bytes': max(sample['bytes']),
+            'errors': {str(status): count for status, count in sorted(sample['errors'].items())},
+        }
+
+    # Reporting
+
+    def print_results(self, results, previous):
+        before = (previous or {}).get('scenarios', {})
+        header = f"{'scenario':<26} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>7} {'bytes':>8}"
+        if previous:
+            self.stdout.write(f"Compared with {previous.get('commit') or self.options['compare']} ({previous.get('date')})")
+            header += f" {'p95 +/-':>8} {'queries +/-':>11}"
+        self.stdout.write(header)
+        for name, result in sorted(results.items()):
+            line = (
+                f"{name:<26} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+                f"{result['queries']:>7} {result['bytes']:>8}"
+            )
+            if name in before:
+                old = before[name]
+                change = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 if old['p95_ms'] else 0
+                line += f" {change:>+7.0f}% {result['queries'] - old['queries']:>+11}"
+            if result['errors']:
+                line += '  errors ' + ', '.join(f'{status}x{count}' for status, count in result['errors'].items())
+            self.stdout.write(line)
+
+    def over_budget(self, results, budgets):
+        failures = []
+        for name, result in sorted(results.items()):
+            if result['errors']:
+                failures.append(f"{name}: error responses {result['errors']}")
+        for name, budget in sorted(budgets.items()):
+            result = results.get(name)
+            if result is None:
+                continue
+            for key, limit in budget.items():
+                if result[key] > limit:
+                    failures.append(f'{name}: {key} {result[key]} over budget {limit:g}')
+        return failures
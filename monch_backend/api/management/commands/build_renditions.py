@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import django
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from api import media
+from api.models import PostMedia
+
+class Command(BaseCommand):
+    help = 'Backfill resized AVIF / WebP renditions for existing post media and avatars'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--force', action='store_true', help='Rebuild renditions that already exist (e.g. after changing the sizes)')
+        parser.add_argument('--skip-avatars', action='store_true')
+        parser.add_argument('--skip-media', action='store_true')
+
+    def handle(self, *args, **options):
+        jobs = []
+        if not options['skip_media']:
+            rows = PostMedia.objects.filter(status=PostMedia.READY, media_type='image')
+            if not options['force']:
+                rows = rows.filter(renditions={})
+            # Reposts share files with the original: one job per file
+            seen = set()
+            for media_id, name in rows.order_by('id').values_list('id', 'media_file').iterator(chunk_size=options['batch_size']):
+                if name not in seen:
+                    seen.add(name)
+                    jobs.append((media.build_media_renditions, media_id))
+        if not options['skip_avatars']:
+            users = get_user_model().objects.exclude(avatar='').exclude(avatar__isnull=True)
+            if not options['force']:
+                users = users.filter(avatar_renditions={})
+            jobs += [(media.build_avatar_renditions, user_id) for user_id in users.order_by('id').values_list('id', flat=True)]
+
+        # Same spawned pool as process_media: Pillow work is CPU bound
+        done = failed = 0
+        with ProcessPoolExecutor(
+            max_workers=max(1, options['workers']),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        ) as pool:
+            for start in range(0, len(jobs), options['batch_size']):
+                batch = jobs[start:start + options['batch_size']]
+                futures = {pool.submit(function, pk): (function.__name__, pk) for function, pk in batch}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                        done += 1
+                    except Exception as error:
+                        failed += 1
+                        self.stderr.write(f'{futures[future][0]}({futures[future][1]}) failed: {error!r}')
+                self.stdout.write(f'Processed {min(start + options["batch_size"], len(jobs))}/{len(jobs)} images')
+
+        self.stdout.write(self.style.SUCCESS(f'Built renditions for {done} images ({failed} failed)'))
@@ -0,0 +1,47 @@
+import sys
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import NotFound
+from api.export import export_chunks, parse_cursor
+
+class Command(BaseCommand):
+    help = "Stream a user's posts, replies, likes and follows as NDJSON (gzipped if the output ends in .gz)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output', help='File to write to instead of stdout')
+        parser.add_argument('--cursor', help="Resume after this record's cursor, appending to --output")
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(username=options['username'].lower())
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' not found")
+        cursor = options['cursor']
+        if cursor:
+            try:
+                parse_cursor(cursor)
+            except NotFound:
+                raise CommandError('Invalid cursor')
+
+        output = options['output']
+        # Resumed gzip output is appended as a new gzip member, which readers
+        # decompress as one stream
+        chunks = export_chunks(
+            user, cursor, options['chunk_size'], compress=bool(output and output.endswith('.gz')),
+        )
+        if output is None:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        written = 0
+        with open(output, 'ab' if cursor else 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Exported {user.username} to {output} ({written} bytes)'))
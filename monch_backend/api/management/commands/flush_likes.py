@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from api import like_buffer
+
+class Command(BaseCommand):
+    help = 'Write buffered likes and unlikes (LIKE_WRITE_BEHIND) to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the buffer is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the buffer is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            written = like_buffer.flush()
+            if written:
+                self.stdout.write(f'Applied {written} buffered likes and unlikes')
+                continue
+            if options['once']:
+                break
+            # Don't hold a connection open while idle
+            connections.close_all()
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Like buffer empty'))
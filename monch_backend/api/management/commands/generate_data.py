@@ -0,0 +1,276 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+from api import search, timeline
+from api.models import Follow, Like, Post, TimelineEntry, User
+
+# Synthetic data at production scale, to make feed, search and thread
+# problems show up locally. The same --seed gives the same dataset.
+#
+# The shapes follow real social data rather than uniform noise:
+# - who gets followed is Zipf distributed over a random ranking of users, and
+#   how many accounts each user follows is Pareto distributed, so a few
+#   accounts hold a large share of all follows
+# - how much users post and how many likes a post gets are Pareto distributed
+# - replies go to the latest post of an author picked by popularity, or
+#   continue one of a pool of running conversations, which grows deep chains
+# - post text is drawn from a fixed vocabulary with Zipf word frequencies
+#
+# Rows are written in batches with bulk_create, or COPY on PostgreSQL, with
+# ids assigned here so replies, reposts and likes can point at rows of the
+# same batch. Neither sends signals, so each batch of posts is indexed for
+# search here, and at the end the counters are recomputed (reconcile_counters),
+# the follow graph snapshot is written and the home timelines of the first
+# --timelines users are built (building every one would take longer than the
+# rest together; rebuild_timelines does the others).
+
+TIMESTAMPED = ((Post, 'created_at'), (Follow, 'created_at'), (Like, 'created_at'))
+CONVERSATIONS = 1000
+MAX_FOLLOWS = 5000
+MAX_LIKES = 10000
+
+@contextmanager
+def generated_timestamps():
+    # bulk_create would stamp every row with now() through auto_now_add
+    fields = [model._meta.get_field(name) for model, name in TIMESTAMPED]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Generate a large synthetic dataset (users, follows, posts, replies, reposts, likes) with realistic distributions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--posts-per-user', type=float, default=20, help='Average; Pareto distributed')
+        parser.add_argument('--follows-per-user', type=float, default=50, help='Average; Pareto distributed')
+        parser.add_argument('--likes-per-post', type=float, default=5, help='Average; Pareto distributed')
+        parser.add_argument('--reply-ratio', type=float, default=0.4, help='Share of posts that are replies')
+        parser.add_argument('--repost-ratio', type=float, default=0.05, help='Share of posts that are reposts')
+        parser.add_argument('--max-depth', type=int, default=50, help='Longest reply chain')
+        parser.add_argument('--days', type=int, default=365, help='Period the posts are spread over, up to now')
+        parser.add_argument('--timelines', type=int, default=1000, help='Home timelines to build, for the first users generated')
+        parser.add_argument('--password', default='password', help='Password of every generated user')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help='Empty the users, posts, follows and likes tables first')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker()
+        self.fake.seed_instance(options['seed'])
+        self.now = timezone.now()
+        self.start = self.now - timedelta(days=options['days'])
+
+        if options['clear']:
+            self.clear()
+        with generated_timestamps():
+            users = self.step('users', self.create_users)
+            self.step('follows', self.create_follows, users)
+            self.step('posts, replies, reposts and likes', self.create_posts, users)
+        if connection.vendor == 'postgresql':
+            # COPY wrote explicit ids past the sequences
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, Follow, Post, Like]):
+                    cursor.execute(sql)
+
+        self.step('counters', call_command, 'reconcile_counters', stdout=self.stdout)
+        if settings.FOLLOW_GRAPH_SNAPSHOT:
+            self.step('follow graph', call_command, 'build_follow_graph', stdout=self.stdout)
+        self.step('timelines', self.build_timelines, users)
+        self.stdout.write(self.style.SUCCESS('Synthetic data generated'))
+
+    def step(self, name, function, *args, **kwargs):
+        self.stdout.write(f'Generating {name}...')
+        started = time.monotonic()
+        result = function(*args, **kwargs)
+        self.stdout.write(f'  done in {time.monotonic() - started:.1f}s')
+        return result
+
+    def clear(self):
+        tables = [model._meta.db_table for model in (Like, TimelineEntry, Follow, Post, User)]
+        connection.ops.execute_sql_flush(
+            connection.ops.sql_flush(no_style(), tables, reset_sequences=True, allow_cascade=True),
+        )
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+
+    def insert(self, model, rows):
+        if connection.vendor == 'postgresql':
+            fields = model._meta.concrete_fields
+            columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+            with connection.cursor() as cursor:
+                with cursor.cursor.copy(f'COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN') as copy:
+                    for row in rows:
+                        copy.write_row([field.get_db_prep_save(getattr(row, field.attname), connection) for field in fields])
+        else:
+            model.objects.bulk_create(rows, batch_size=self.options['batch_size'])
+        rows.clear()
+
+    def pareto(self, mean, alpha, cap):
+        # Pareto(alpha) has mean alpha / (alpha - 1); scaled to `mean`, at least 1
+        scale = mean * (alpha - 1) / alpha
+        return max(1, min(cap, int(self.rng.paretovariate(alpha) * scale)))
+
+    def create_users(self):
+        count = self.options['users']
+        first_id = next_id(User)
+        password = make_password(self.options['password'])
+        joined = self.start - timedelta(days=365)
+        rows = []
+        for user_id in range(first_id, first_id + count):
+            suffix = str(user_id)
+            name = self.fake.user_name().lower()[:User._meta.get_field('username').max_length - len(suffix)]
+            rows.append(User(
+                id=user_id,
+                username=f'{name}{suffix}',
+                password=password,
+                display_name=self.fake.name()[:30],
+                bio=self.sentence(3, 20)[:150] if self.rng.random() < 0.6 else None,
+                date_joined=joined + (self.start - joined) * self.rng.random(),
+            ))
+            if len(rows) >= self.options['batch_size']:
+                self.insert(User, rows)
+        self.insert(User, rows)
+
+        ids = list(range(first_id, first_id + count))
+        ranks = list(range(1, count + 1))
+        self.rng.shuffle(ranks)
+        # Popularity (who gets followed, replied to, reposted) and activity
+        # (who posts and likes) as cumulative weights for rng.choices
+        self.popularity = list(accumulate(1 / rank for rank in ranks))
+        self.activity = list(accumulate(self.rng.paretovariate(1.2) for _ in ids))
+        self.stdout.write(f'  {count} users')
+        return ids
+
+    def create_follows(self, users):
+        follow_id = next_id(Follow)
+        cap = min(MAX_FOLLOWS, len(users) - 1)
+        rows, total = [], 0
+        for follower in users:
+            wanted = self.pareto(self.options['follows_per_user'], 1.5, cap)
+            following = set(self.rng.choices(users, cum_weights=self.popularity, k=wanted))
+            following.discard(follower)
+            for followed in following:
+                created_at = self.start + (self.now - self.start) * self.rng.random()
+                rows.append(Follow(id=follow_id, follower_id=follower, following_id=followed, created_at=created_at))
+                follow_id += 1
+            total += len(following)
+            if len(rows) >= self.options['batch_size']:
+                with transaction.atomic():
+                    self.insert(Follow, rows)
+        with transaction.atomic():
+            self.insert(Follow, rows)
+        self.stdout.write(f'  {total} follows')
+
+    def create_posts(self, users):
+        options = self.options
+        count = int(len(users) * options['posts_per_user'])
+        post_id = first_id = next_id(Post)
+        like_id = next_id(Like)
+        like_cap = min(MAX_LIKES, len(users))
+        latest = {}  # author -> id of their latest top-level post
+        last_top = None
+        conversations = []  # [reply id, depth] tips of running reply chains
+        posts, likes = [], []
+        totals = {'top-level posts': 0, 'replies': 0, 'reposts': 0, 'likes': 0}
+
+        authors = iter(())
+        for index in range(count):
+            author = next(authors, None)
+            if author is None:
+                authors = iter(self.rng.choices(users, cum_weights=self.activity, k=options['batch_size']))
+                author = next(authors)
+            created_at = self.start + (self.now - self.start) * (index / count)
+            post = Post(id=post_id, user_id=author, created_at=created_at)
+            kind = self.rng.random()
+            target = latest.get(self.rng.choices(users, cum_weights=self.popularity)[0], last_top)
+
+            if target is not None and kind < options['repost_ratio']:
+                # Reposts are pointer rows, without content or media of their own
+                post.repost_of_id = target
+                totals['reposts'] += 1
+            elif target is not None and kind < options['repost_ratio'] + options['reply_ratio']:
+                post.content = self.sentence(1, 25)
+                if conversations and self.rng.random() < 0.5:
+                    # Skewed towards the first slots: a few conversations run long
+                    slot = int(len(conversations) * self.rng.random() ** 3)
+                    post.parent_post_id, depth = conversations[slot]
+                    if depth + 1 < options['max_depth']:
+                        conversations[slot] = [post_id, depth + 1]
+                    else:
+                        conversations[slot] = conversations[-1]
+                        conversations.pop()
+                else:
+                    post.parent_post_id = target
+                    if len(conversations) < CONVERSATIONS:
+                        conversations.append([post_id, 1])
+                    else:
+                        conversations[self.rng.randrange(CONVERSATIONS)] = [post_id, 1]
+                totals['replies'] += 1
+            else:
+                post.content = self.sentence(4, 40)
+                latest[author] = last_top = post_id
+                totals['top-level posts'] += 1
+            posts.append(post)
+
+            # Replies and reposts draw fewer likes than top-level posts
+            mean = options['likes_per_post'] * (1 if post.parent_post_id is None and post.repost_of_id is None else 0.3)
+            likers = set(self.rng.choices(users, cum_weights=self.activity, k=self.pareto(mean, 1.3, like_cap)))
+            for liker in likers:
+                liked_at = min(self.now, created_at + timedelta(hours=48 * self.rng.random()))
+                likes.append(Like(id=like_id, user_id=liker, post_id=post_id, created_at=liked_at))
+                like_id += 1
+            totals['likes'] += len(likers)
+            post_id += 1
+
+            if len(posts) >= options['batch_size']:
+                self.write_posts(posts, likes)
+        self.write_posts(posts, likes)
+        self.stdout.write('  ' + ', '.join(f'{total} {name}' for name, total in totals.items()))
+        self.stdout.write(f'  posts {first_id}-{post_id - 1}')
+
+    def write_posts(self, posts, likes):
+        if not posts:
+            return
+        first_id, last_id = posts[0].id, posts[-1].id
+        with transaction.atomic():
+            self.insert(Post, posts)
+            self.insert(Like, likes)
+            search.index_range(first_id, last_id)
+
+    def sentence(self, shortest, longest):
+        if not hasattr(self, 'vocabulary'):
+            words = sorted(set(self.fake.get_words_list()))
+            self.rng.shuffle(words)
+            self.vocabulary = words
+            self.word_weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+        words = self.rng.choices(self.vocabulary, cum_weights=self.word_weights, k=self.rng.randint(shortest, longest))
+        return ' '.join(words).capitalize()[:Post._meta.get_field('content').max_length - 1] + '.'
+
+    def build_timelines(self, users):
+        sample = users[:self.options['timelines']]
+        for user in User.objects.filter(id__in=sample):
+            timeline.rebuild(user)
+        self.stdout.write(f'  {len(sample)} timelines (user ids {sample[0]}-{sample[-1]}), {TimelineEntry.objects.count()} entries')
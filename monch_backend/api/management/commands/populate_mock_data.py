@@ -5,7 +5,7 @@ from api.models import Like, Follow, Post
 import random
 
 class Command(BaseCommand):
-    help = 'Populate the database with mock data'
+    help = 'Populate the database with a little mock data (see generate_data for large datasets)'
 
     def handle(self, *args, **kwargs):
         
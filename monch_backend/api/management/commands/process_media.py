@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import time
+import django
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from django.core.management.base import BaseCommand
+from django.db import connections
+from api import media
+
+class Command(BaseCommand):
+    help = 'Process pending post media (decode, orient, resize, re-encode) in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows claimed at a time (default: 2 per worker)')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--retry-failed', action='store_true', help='Queue failed media again before starting')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        batch_size = options['batch_size'] or workers * 2
+
+        if options['retry_failed']:
+            self.stdout.write(f'Requeued {media.retry_failed()} failed media')
+
+        pool = self.start_pool(workers)
+        try:
+            while True:
+                media_ids = media.claim(batch_size)
+                if not media_ids:
+                    if options['once']:
+                        break
+                    # Don't hold a connection open while idle
+                    connections.close_all()
+                    time.sleep(options['interval'])
+                    continue
+
+                futures = {pool.submit(media.process, media_id): media_id for media_id in media_ids}
+                broken = False
+                for future in as_completed(futures):
+                    media_id = futures[future]
+                    try:
+                        future.result()
+                        self.stdout.write(f'Processed media {media_id}')
+                    except BrokenProcessPool as error:
+                        broken = True
+                        media.fail(media_id, error)
+                    except Exception as error:
+                        media.fail(media_id, error)
+                        self.stderr.write(f'Media {media_id} failed: {error!r}')
+                if broken:
+                    # A worker died (e.g. out of memory on a huge image); its
+                    # batch counts as a failed attempt and the pool is replaced
+                    self.stderr.write('Worker pool broke, restarting')
+                    pool.shutdown(wait=False)
+                    pool = self.start_pool(workers)
+        finally:
+            pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS('Media queue empty'))
+
+    def start_pool(self, workers):
+        # Spawned rather than forked so workers never share the parent's DB
+        # connections; each one sets Django up before importing any models
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
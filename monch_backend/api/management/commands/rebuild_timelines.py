@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from api import timeline
+
+class Command(BaseCommand):
+    help = 'Rebuild materialized home timelines from Follow/Post, or just trim them to TIMELINE_MAX_LENGTH'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only rebuild the timeline of this username')
+        parser.add_argument('--prune-only', action='store_true', help='Trim existing timelines instead of rebuilding them')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username=options['user'].lower())
+            if not users.exists():
+                raise CommandError(f"User '{options['user']}' not found")
+
+        batch_size = options['batch_size']
+        user_ids = list(users.values_list('id', flat=True))
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            if options['prune_only']:
+                timeline.prune(batch)
+            else:
+                for user in User.objects.filter(id__in=batch):
+                    timeline.rebuild(user)
+            self.stdout.write(f'Processed {min(start + batch_size, len(user_ids))}/{len(user_ids)} users')
+
+        self.stdout.write(self.style.SUCCESS('Timelines up to date'))
@@ -0,0 +1,52 @@
+from functools import reduce
+from operator import or_
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max, Q
+from api.models import User, Post, Follow, Like
+from api.querysets import count_subquery
+
+# counter column -> (model whose rows are counted, its foreign key to the counted row)
+COUNTERS = {
+    Post: {
+        'likes_count': (Like, 'post'),
+        'replies_count': (Post, 'parent_post'),
+        'reposts_count': (Post, 'repost_of'),
+    },
+    User: {
+        'follower_count': (Follow, 'following'),
+        'following_count': (Follow, 'follower'),
+    },
+}
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized like/reply/repost/follow counters that drifted from the real row counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows checked per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted rows')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        for model, counters in COUNTERS.items():
+            expressions = {field: count_subquery(source, fk) for field, (source, fk) in counters.items()}
+            drifted = reduce(or_, (~Q(**{field: F(f'actual_{field}')}) for field in counters))
+            max_pk = model.objects.aggregate(max_pk=Max('pk'))['max_pk'] or 0
+            fixed = 0
+
+            # Walk primary key ranges so every query touches at most chunk_size rows
+            for start in range(0, max_pk + 1, chunk_size):
+                chunk = model.objects.filter(pk__gte=start, pk__lt=start + chunk_size)
+                ids = list(
+                    chunk.annotate(**{f'actual_{field}': expression for field, expression in expressions.items()})
+                    .filter(drifted)
+                    .values_list('pk', flat=True)
+                )
+                if ids and not options['dry_run']:
+                    model.objects.filter(pk__in=ids).update(**expressions)
+                fixed += len(ids)
+
+            verb = 'drifted' if options['dry_run'] else 'fixed'
+            self.stdout.write(f'{model.__name__}: {fixed} rows {verb}')
+
+        self.stdout.write(self.style.SUCCESS('Counters reconciled'))
@@ -0,0 +1,343 @@
+import hashlib
+import os
+from datetime import timedelta
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+from .models import User, PostMedia, StoredFile
+from .response_cache import bump
+from .authentication import forget_users
+
+# Post media processing. Uploads are stored raw and the post is returned
+# right away with its media 'pending'; the process_media command claims
+# pending rows and decodes / orients / resizes / re-encodes them in a pool of
+# worker processes, then swaps the final file in and marks them 'ready'.
+# Failures are retried with exponential backoff up to MEDIA_MAX_ATTEMPTS,
+# after which the row is 'failed' and keeps serving the raw upload.
+#
+# Every image is decoded once and written at each of a set of sizes, in its
+# original format at the largest size plus each of IMAGE_RENDITION_FORMATS
+# (AVIF / WebP) at every size; serializers expose those as srcset strings.
+#
+# Processed files are named by the sha256 of their content and shared through
+# StoredFile reference counts: an upload whose raw bytes were seen before is
+# linked to the earlier result without touching Pillow, and files are only
+# deleted when the last PostMedia row / avatar pointing at them goes.
+
+RETRY_DELAY = 10  # seconds, doubled on every attempt
+
+# Pillow format names, file extensions, encoder options and MIME types of the
+# extra rendition formats (IMAGE_RENDITION_FORMATS)
+RENDITION_FORMATS = {
+    'avif': ('AVIF', '.avif', {'quality': 50, 'speed': 8}, 'image/avif'),
+    'webp': ('WEBP', '.webp', {'quality': 75, 'method': 4}, 'image/webp'),
+}
+
+def rendition_formats():
+    """IMAGE_RENDITION_FORMATS this Pillow build can encode."""
+    return [name for name in settings.IMAGE_RENDITION_FORMATS if name in RENDITION_FORMATS and features.check(name)]
+
+def render(data, sizes):
+    """
+    Decode raw image bytes once and return (content, extension, media_type,
+    renditions). The content is the image fitted in the largest of `sizes`
+    (longest side, in pixels) in its original format; renditions maps each
+    rendition format to [(width, content)] for every size. Animated GIFs are
+    kept as they are, without renditions.
+    """
+    img = Image.open(BytesIO(data))
+    img_format = img.format
+
+    if img_format == "GIF":
+        return data, ".gif", "gif", {}
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+
+    formats = rendition_formats()
+    renditions = {name: [] for name in formats}
+    content = ext = width = None
+    # Largest first, each size resampled from the one before it
+    for size in sorted(set(sizes), reverse=True):
+        img.thumbnail((size, size), Image.LANCZOS)
+        if img.width == width:
+            # Source smaller than this size too (thumbnail never upscales)
+            continue
+        width = img.width
+        if content is None:
+            output = BytesIO()
+            if img_format == "PNG":
+                img.save(output, format='PNG', optimize=True)
+                ext = ".png"
+            else:
+                img.save(output, format='JPEG', quality=75)
+                ext = ".jpg"
+            content = output.getvalue()
+        for name in formats:
+            pil_format, _, options, _ = RENDITION_FORMATS[name]
+            output = BytesIO()
+            img.save(output, format=pil_format, **options)
+            renditions[name].append((img.width, output.getvalue()))
+    return content, ext, "image", renditions
+
+def file_digest(file):
+    """sha256 hex digest of an uploaded or stored file."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+def store(storage, name, content):
+    # Content-addressed: a file already stored under this name has these bytes
+    if not storage.exists(name):
+        saved = storage.save(name, ContentFile(content))
+        if saved != name:
+            # Another worker stored the same content first
+            storage.delete(saved)
+    return name
+
+def content_name(field, instance, content, ext):
+    return field.generate_filename(instance, f"{hashlib.sha256(content).hexdigest()}{ext}")
+
+def save_renditions(storage, name, renditions):
+    """
+    Store rendered renditions next to the file `name` and return the
+    {format: {width: storage name}} map kept on the model.
+    """
+    stem = os.path.splitext(name)[0]
+    saved = {}
+    for format_name, sizes in renditions.items():
+        ext = RENDITION_FORMATS[format_name][1]
+        saved[format_name] = {
+            str(width): store(storage, f"{stem}_{width}{ext}", content)
+            for width, content in sizes
+        }
+    return saved
+
+def bump_media_posts(rows):
+    # Queryset updates skip the signals that invalidate cached responses
+    bump(*{f'post:{post_id}' for post_id in rows.values_list('post_id', flat=True)})
+
+def rendition_names(renditions):
+    return [name for sizes in (renditions or {}).values() for name in sizes.values()]
+
+def srcset(storage, renditions, request=None):
+    """
+    {MIME type: srcset string} for a stored renditions map, preferred formats
+    first. URLs are made absolute with `request` like DRF's file fields.
+    """
+    def url(path):
+        url = storage.url(path)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    result = {}
+    for name in RENDITION_FORMATS:
+        sizes = (renditions or {}).get(name)
+        if sizes:
+            result[RENDITION_FORMATS[name][3]] = ', '.join(
+                f"{url(path)} {width}w" for width, path in sorted(sizes.items(), key=lambda item: int(item[0]))
+            )
+    return result
+
+def add_reference(name, count=1, **defaults):
+    """Count `count` more references to the stored file `name`."""
+    if not name or not count:
+        return
+    with transaction.atomic():
+        stored, _ = StoredFile.objects.select_for_update().get_or_create(name=name, defaults=defaults)
+        StoredFile.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') + count)
+
+def release(name, count=1):
+    """
+    Drop `count` references to the stored file `name`, deleting it and its
+    renditions from storage (once the transaction commits) when none are left.
+    Files without a StoredFile row are left alone.
+    """
+    if not name or not count:
+        return
+    with transaction.atomic():
+        stored = StoredFile.objects.select_for_update().filter(name=name).first()
+        if stored is None:
+            return
+        if stored.ref_count > count:
+            StoredFile.objects.filter(pk=stored.pk).update(ref_count=F('ref_count') - count)
+            return
+        stored.delete()
+        names = [name, *rendition_names(stored.renditions)]
+        transaction.on_commit(lambda: _delete_files(names))
+
+def _delete_files(names):
+    storage = default_storage
+    for name in names:
+        if storage.exists(name):
+            storage.delete(name)
+
+def processed_file(field, raw_digest):
+    """
+    Locked StoredFile previously produced from identical raw bytes for
+    `field`, or None. Call inside a transaction and reference it before
+    committing.
+    """
+    return StoredFile.objects.select_for_update().filter(
+        raw_digest=raw_digest, name__startswith=field.upload_to, ref_count__gt=0,
+    ).first()
+
+def attach_upload(post, upload):
+    """
+    New PostMedia for an uploaded file. A file whose raw bytes were processed
+    before is linked to the existing result right away (status 'ready'),
+    anything else is stored raw and left to the worker.
+    """
+    raw_digest = file_digest(upload)
+    with transaction.atomic():
+        stored = processed_file(PostMedia.media_file.field, raw_digest)
+        if stored is not None:
+            return PostMedia.objects.create(
+                post=post,
+                media_file=stored.name,
+                media_type="gif" if stored.name.endswith(".gif") else "image",
+                renditions=stored.renditions,
+                status=PostMedia.READY,
+            )
+    return PostMedia.objects.create(post=post, media_file=upload)
+
+def set_avatar(user, upload):
+    """Process an uploaded avatar (unless identical bytes were before) and save it on `user`."""
+    field = User.avatar.field
+    storage = user.avatar.storage
+    raw_digest = file_digest(upload)
+    previous = user.avatar.name
+
+    with transaction.atomic():
+        stored = processed_file(field, raw_digest)
+        if stored is not None:
+            name, renditions = stored.name, stored.renditions
+        else:
+            content, ext, _, rendered = render(upload.read(), settings.AVATAR_SIZES)
+            name = store(storage, content_name(field, user, content, ext), content)
+            renditions = save_renditions(storage, name, rendered)
+
+        if name != previous:
+            add_reference(name, raw_digest=raw_digest, renditions=renditions)
+            user.avatar.name = name
+            user.avatar_renditions = renditions
+            user.save(update_fields=['avatar', 'avatar_renditions'])
+            release(previous)
+
+def process(media_id):
+    """Process one claimed PostMedia row. Runs in a worker process."""
+    media = PostMedia.objects.get(pk=media_id)
+    if media.status == PostMedia.READY:
+        # Finished by another worker that claimed it again after MEDIA_CLAIM_TIMEOUT
+        return
+    raw_name = media.media_file.name
+    with media.media_file.open('rb') as raw:
+        data = raw.read()
+    content, ext, media_type, rendered = render(data, settings.POST_MEDIA_SIZES)
+
+    storage = media.media_file.storage
+    name = content_name(media.media_file.field, media, content, ext)
+    with transaction.atomic():
+        stored = StoredFile.objects.select_for_update().filter(name=name).first()
+        if stored is not None:
+            # Same image as an earlier upload: share its files
+            renditions = stored.renditions
+        else:
+            name = store(storage, name, content)
+            renditions = save_renditions(storage, name, rendered)
+
+        # Point the row at the processed file, unless another worker already
+        # did or the post was deleted meanwhile
+        row = PostMedia.objects.filter(pk=media.pk, media_file=raw_name)
+        bump_media_posts(row)
+        moved = row.update(
+            media_file=name, renditions=renditions,
+            media_type=media_type, status=PostMedia.READY, error='', claimed_at=None,
+        )
+        if moved:
+            add_reference(name, moved, raw_digest=hashlib.sha256(data).hexdigest(), renditions=renditions)
+            release(raw_name, moved)
+        elif stored is None:
+            # The row went away while processing
+            transaction.on_commit(lambda: _delete_files([name, *rendition_names(renditions)]))
+
+def build_media_renditions(media_id):
+    """Backfill renditions of an already processed PostMedia from its stored file."""
+    media = PostMedia.objects.get(pk=media_id)
+    name = media.media_file.name
+    with media.media_file.open('rb') as stored:
+        _, _, _, rendered = render(stored.read(), settings.POST_MEDIA_SIZES)
+    _delete_files(rendition_names(media.renditions))
+    renditions = save_renditions(media.media_file.storage, name, rendered)
+    PostMedia.objects.filter(media_file=name).update(renditions=renditions)
+    bump_media_posts(PostMedia.objects.filter(media_file=name))
+    StoredFile.objects.filter(name=name).update(renditions=renditions)
+
+def build_avatar_renditions(user_id):
+    """Backfill renditions of a user's stored avatar."""
+    user = User.objects.get(pk=user_id)
+    name = user.avatar.name
+    with user.avatar.open('rb') as stored:
+        _, _, _, rendered = render(stored.read(), settings.AVATAR_SIZES)
+    _delete_files(rendition_names(user.avatar_renditions))
+    renditions = save_renditions(user.avatar.storage, name, rendered)
+    User.objects.filter(avatar=name).update(avatar_renditions=renditions)
+    user_ids = list(User.objects.filter(avatar=name).values_list('pk', flat=True))
+    bump(*(f'user:{pk}' for pk in user_ids))
+    forget_users(*user_ids)
+    StoredFile.objects.filter(name=name).update(renditions=renditions)
+
+def claim(limit):
+    """
+    Mark up to `limit` due rows as processing and return their ids. Rows
+    whose claim is older than MEDIA_CLAIM_TIMEOUT (crashed worker) are due
+    again.
+    """
+    current = now()
+    stale = current - timedelta(seconds=settings.MEDIA_CLAIM_TIMEOUT)
+    due = PostMedia.objects.filter(
+        Q(status=PostMedia.PENDING, available_at__lte=current)
+        | Q(status=PostMedia.PROCESSING, claimed_at__lt=stale)
+    ).order_by('available_at', 'id')
+
+    claimed = []
+    for media_id, status, claimed_at in due.values_list('id', 'status', 'claimed_at')[:limit]:
+        # Conditional update so concurrent workers never claim the same row
+        if PostMedia.objects.filter(pk=media_id, status=status, claimed_at=claimed_at).update(
+            status=PostMedia.PROCESSING, claimed_at=current,
+        ):
+            claimed.append(media_id)
+    return claimed
+
+def fail(media_id, error):
+    """Record a failed attempt: retry later, or give up on undecodable files and after MEDIA_MAX_ATTEMPTS."""
+    media = PostMedia.objects.filter(pk=media_id).first()
+    if media is None or media.status == PostMedia.READY:
+        return
+    attempts = media.attempts + 1
+    final = isinstance(error, UnidentifiedImageError) or attempts >= settings.MEDIA_MAX_ATTEMPTS
+    rows = PostMedia.objects.filter(pk=media_id).exclude(status=PostMedia.READY)
+    bump_media_posts(rows)
+    rows.update(
+        status=PostMedia.FAILED if final else PostMedia.PENDING,
+        attempts=attempts,
+        error='Unsupported image file' if isinstance(error, UnidentifiedImageError) else (str(error) or type(error).__name__)[:255],
+        available_at=now() + timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1)),
+        claimed_at=None,
+    )
+
+def retry_failed(queryset=None):
+    """Queue failed rows again with a fresh attempt budget."""
+    queryset = PostMedia.objects.all() if queryset is None else queryset
+    bump_media_posts(queryset.filter(status=PostMedia.FAILED))
+    return queryset.filter(status=PostMedia.FAILED).update(
+        status=PostMedia.PENDING, attempts=0, available_at=now(), claimed_at=None,
+    )
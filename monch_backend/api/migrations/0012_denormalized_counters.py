@@ -0,0 +1,69 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:52
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model, field):
+    rows = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def populate_counters(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    Post = apps.get_model('api', 'Post')
+    Follow = apps.get_model('api', 'Follow')
+    Like = apps.get_model('api', 'Like')
+
+    Post.objects.update(
+        likes_count=count_subquery(Like, 'post'),
+        replies_count=count_subquery(Post, 'parent_post'),
+        reposts_count=count_subquery(Post, 'repost_of'),
+    )
+    User.objects.update(
+        follower_count=count_subquery(Follow, 'following'),
+        following_count=count_subquery(Follow, 'follower'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='replies_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reposts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:54
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE api_post SET search_vector = "
+            "setweight(to_tsvector('english', coalesce(api_post.content, '')), 'A') || "
+            "setweight(to_tsvector('english', api_user.username), 'B') "
+            "FROM api_user WHERE api_user.id = api_post.user_id"
+        )
+        schema_editor.execute(
+            "CREATE INDEX api_post_search_vector_idx ON api_post USING gin (search_vector)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE api_post_fts USING fts5(content, username, tokenize='porter unicode61')"
+        )
+        schema_editor.execute(
+            "INSERT INTO api_post_fts (rowid, content, username) "
+            "SELECT api_post.id, coalesce(api_post.content, ''), api_user.username "
+            "FROM api_post JOIN api_user ON api_user.id = api_post.user_id"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS api_post_search_vector_idx")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS api_post_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.23 on 2026-10-18 18:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_existing_ready(apps, schema_editor):
+    # Media uploaded so far was processed inside the request
+    PostMedia = apps.get_model('api', 'PostMedia')
+    PostMedia.objects.update(status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postmedia',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='available_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='postmedia',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(mark_existing_ready, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='postmedia',
+            index=models.Index(fields=['status', 'available_at'], name='postmedia_queue_idx'),
+        ),
+    ]
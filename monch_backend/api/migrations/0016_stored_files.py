@@ -0,0 +1,58 @@
+# Generated by Django 4.2.23 on 2026-10-18 19:03
+
+import api.models
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_references(apps, schema_editor):
+    # Every existing row was uploaded and encoded on its own, reposts included,
+    # so each one is a reference to its file; counting rows rather than names
+    # keeps the total right for anything that does share a name
+    StoredFile = apps.get_model('api', 'StoredFile')
+    PostMedia = apps.get_model('api', 'PostMedia')
+    User = apps.get_model('api', 'User')
+
+    counts = {}
+    renditions = {}
+    media = PostMedia.objects.exclude(media_file='').exclude(media_file__isnull=True)
+    for name, total in media.values_list('media_file').annotate(total=Count('id')).order_by():
+        counts[name] = counts.get(name, 0) + total
+    for name, sizes in media.exclude(renditions={}).values_list('media_file', 'renditions').iterator():
+        renditions[name] = sizes
+    avatars = User.objects.exclude(avatar='').exclude(avatar__isnull=True)
+    for name, total in avatars.values_list('avatar').annotate(total=Count('id')).order_by():
+        counts[name] = counts.get(name, 0) + total
+    for name, sizes in avatars.exclude(avatar_renditions={}).values_list('avatar', 'avatar_renditions').iterator():
+        renditions[name] = sizes
+
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name, ref_count=total, renditions=renditions.get(name, {})) for name, total in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('raw_digest', models.CharField(blank=True, db_index=True, default='', max_length=64)),
+                ('renditions', models.JSONField(blank=True, default=dict)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='postmedia',
+            name='media_file',
+            field=models.ImageField(blank=True, db_index=True, null=True, upload_to='posts/media/', validators=[api.models.validate_file_size]),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.23 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class AddIndex(migrations.AddIndex):
+    # CREATE INDEX CONCURRENTLY on PostgreSQL, so the tables stay writable
+    # while the indexes build; a plain CREATE INDEX elsewhere
+    def _options(self, schema_editor):
+        return {'concurrently': True} if schema_editor.connection.vendor == 'postgresql' else {}
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, **self._options(schema_editor))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, **self._options(schema_editor))
+
+
+class Migration(migrations.Migration):
+    # Concurrent index builds can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0017_user_token_version'),
+    ]
+
+    operations = [
+        AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['following', '-created_at', '-id'], name='follow_followers_idx'),
+        ),
+        AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['follower', '-created_at', '-id'], name='follow_following_idx'),
+        ),
+        AddIndex(
+            model_name='like',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='like_user_recent_idx'),
+        ),
+        AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent_post__isnull', True)), fields=['-created_at', '-id'], name='post_recent_idx'),
+        ),
+        AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent_post__isnull', True)), fields=['user', '-created_at', '-id'], name='post_author_recent_idx'),
+        ),
+        AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('parent_post__isnull', False)), fields=['user', '-created_at', '-id'], name='post_author_replies_idx'),
+        ),
+        AddIndex(
+            model_name='post',
+            index=models.Index(fields=['parent_post', 'created_at', 'id'], name='post_thread_idx'),
+        ),
+        AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('repost_of__isnull', False)), fields=['repost_of', 'user'], name='post_repost_user_idx'),
+        ),
+    ]
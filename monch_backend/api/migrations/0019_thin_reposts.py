@@ -0,0 +1,105 @@
+# Generated by Django 4.2.23 on 2026-10-18 19:59
+
+from collections import Counter, defaultdict
+from django.core.files.storage import default_storage
+from django.db import migrations, models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+import django.db.models.deletion
+
+# Reposts used to copy the original's content and media rows. They become
+# pointer rows: a repost of a repost is pointed at its original, and each
+# repost's copied content, search text and media rows are dropped, releasing
+# their StoredFile references. Done in chunks of CHUNK_SIZE posts, each in its
+# own transaction, so the tables are never locked for long.
+
+CHUNK_SIZE = 1000
+
+
+def chunks(queryset):
+    last = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:CHUNK_SIZE])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def point_at_originals(Post):
+    chained = Post.objects.filter(repost_of__repost_of__isnull=False)
+    # Each pass shortens every chain by one
+    while chained.exists():
+        for ids in chunks(chained):
+            with transaction.atomic():
+                moved = defaultdict(list)
+                for pk, old, new in Post.objects.filter(pk__in=ids).values_list('pk', 'repost_of_id', 'repost_of__repost_of_id'):
+                    moved[old, new].append(pk)
+                for (old, new), pks in moved.items():
+                    Post.objects.filter(pk__in=pks).update(repost_of_id=new)
+                    Post.objects.filter(pk=old).update(reposts_count=Greatest(F('reposts_count') - len(pks), 0))
+                    Post.objects.filter(pk=new).update(reposts_count=F('reposts_count') + len(pks))
+
+
+def release_files(StoredFile, names):
+    for name, count in names.items():
+        StoredFile.objects.filter(name=name).update(ref_count=Greatest(F('ref_count') - count, 0))
+    unused = StoredFile.objects.filter(name__in=list(names), ref_count=0)
+    files = []
+    for stored in unused:
+        files += [stored.name, *(path for sizes in stored.renditions.values() for path in sizes.values())]
+    unused.delete()
+    transaction.on_commit(lambda: delete_files(files))
+
+
+def delete_files(names):
+    for name in names:
+        if default_storage.exists(name):
+            default_storage.delete(name)
+
+
+def clear_search_text(connection, ids):
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"UPDATE api_post SET search_vector = setweight(to_tsvector('english', api_user.username), 'B') "
+                f"FROM api_user WHERE api_user.id = api_post.user_id AND api_post.id IN ({placeholders})",
+                ids,
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f"UPDATE api_post_fts SET content = '' WHERE rowid IN ({placeholders})", ids)
+
+
+def thin_reposts(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    PostMedia = apps.get_model('api', 'PostMedia')
+    StoredFile = apps.get_model('api', 'StoredFile')
+
+    point_at_originals(Post)
+    for ids in chunks(Post.objects.filter(repost_of__isnull=False)):
+        with transaction.atomic():
+            media = PostMedia.objects.filter(post_id__in=ids)
+            names = Counter(name for name in media.values_list('media_file', flat=True) if name)
+            media.delete()
+            release_files(StoredFile, names)
+            Post.objects.filter(pk__in=ids).update(content=None)
+            clear_search_text(schema_editor.connection, ids)
+
+
+class Migration(migrations.Migration):
+    # Every chunk commits on its own
+    atomic = False
+
+    dependencies = [
+        ('api', '0018_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='repost_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reposts', to='api.post'),
+        ),
+        migrations.RunPython(thin_reposts, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.utils.timezone import now
-from PIL import Image, UnidentifiedImageError, ImageOps
-from io import BytesIO
-from django.core.files.base import ContentFile
 import uuid
 import os
 
@@ -13,6 +11,15 @@ def validate_file_size(file):
     if file.size > max_size_mb * 1024 * 1024:
         raise ValidationError(f"Max file size is {max_size_mb} MB")
 
+def save_without(instance, fields, kwargs):
+    """Make a full save() of an existing row leave `fields` as they are in the database."""
+    if instance._state.adding or kwargs.get('force_insert') or kwargs.get('update_fields') is not None:
+        return
+    kwargs['update_fields'] = [
+        field.name for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in fields
+    ]
+
 # Create models using Django ORM. Each model class maps to a table in db.
 
 class User(AbstractUser):
@@ -20,31 +27,94 @@ class User(AbstractUser):
     display_name = models.CharField(max_length=30)
     bio = models.CharField(max_length=150, blank=True, null=True)
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    # {format: {width: storage name}} of the avatar's resized copies (api/media.py)
+    avatar_renditions = models.JSONField(default=dict, blank=True)
+    # Denormalized counters, kept in sync by api/signals.py (see reconcile_counters)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Carried by access tokens; bumped when a new password is saved so older
+    # tokens stop working (api/authentication.py)
+    token_version = models.PositiveIntegerField(default=0)
+
+    # Only moved by UPDATEs (api/signals.py), never written back from a
+    # possibly stale instance by a full save()
+    SAVED_SEPARATELY = ('follower_count', 'following_count', 'token_version')
 
     def save(self, *args, **kwargs):
         if self.username:
             self.username = self.username.lower()
+        save_without(self, self.SAVED_SEPARATELY, kwargs)
+        # _password is set by set_password() until the next save. check_password()
+        # clears it before saving a rehashed password, which keeps the version.
+        if self._password is not None and not self._state.adding:
+            self.token_version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'token_version'}
         super().save(*args, **kwargs)
-    
-    def delete(self, *args, **kwargs):
-        storage = self.avatar.storage
-        if self.avatar.name and storage.exists(self.avatar.name):
-            storage.delete(self.avatar.name)
-        super().delete(*args, **kwargs)
+        self._saved_username = self.username
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # What the row holds, so a save can tell a rename (api/signals.py reindexes their posts)
+        user._saved_username = user.__dict__.get('username')
+        return user
 
 class Follow(models.Model):
     follower = models.ForeignKey(User, related_name="following", on_delete=models.CASCADE)
     following = models.ForeignKey(User, related_name='followers', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('follower', 'following')
+        indexes = [
+            # Followers / following lists, newest first (also every following_id lookup)
+            models.Index(fields=['following', '-created_at', '-id'], name='follow_followers_idx'),
+            models.Index(fields=['follower', '-created_at', '-id'], name='follow_following_idx'),
+        ]
 
 class Post(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     content = models.CharField(max_length=500, blank=True, null=True)
     parent_post = models.ForeignKey('self', null=True, blank=True, related_name='replies', on_delete=models.CASCADE)
-    repost_of = models.ForeignKey('self', null=True, blank=True, related_name='reposts', on_delete=models.SET_NULL) 
+    # A repost is a pointer row: no content or media of its own, it shows the
+    # original's (Post.original), and goes when the original is deleted
+    repost_of = models.ForeignKey('self', null=True, blank=True, related_name='reposts', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized counters, kept in sync by api/signals.py (see reconcile_counters)
+    likes_count = models.PositiveIntegerField(default=0)
+    replies_count = models.PositiveIntegerField(default=0)
+    reposts_count = models.PositiveIntegerField(default=0)
+    # Full-text document on PostgreSQL (GIN indexed); SQLite uses an FTS5 table instead. See api/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        # One index per hot query shape; api/tests.py checks their plans
+        indexes = [
+            # Top-level posts, newest first: the global list, and per author
+            # for profiles and the home timeline's fan-out / merge
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(parent_post__isnull=True), name='post_recent_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], condition=models.Q(parent_post__isnull=True), name='post_author_recent_idx'),
+            # A profile's replies tab
+            models.Index(fields=['user', '-created_at', '-id'], condition=models.Q(parent_post__isnull=False), name='post_author_replies_idx'),
+            # Reply trees, oldest first under each parent
+            models.Index(fields=['parent_post', 'created_at', 'id'], name='post_thread_idx'),
+            # "Did this user repost it": viewer state, toggle_repost, repost counts
+            models.Index(fields=['repost_of', 'user'], condition=models.Q(repost_of__isnull=False), name='post_repost_user_idx'),
+        ]
+
+    # Only moved by UPDATEs (api/signals.py), never written back from a
+    # possibly stale instance by a full save()
+    SAVED_SEPARATELY = ('likes_count', 'replies_count', 'reposts_count')
+
+    def save(self, *args, **kwargs):
+        save_without(self, self.SAVED_SEPARATELY, kwargs)
+        super().save(*args, **kwargs)
+
+    @property
+    def original(self):
+        """The post whose content and media this one shows: the reposted post for a repost."""
+        return self.repost_of if self.repost_of_id is not None else self
 
 class PostMedia(models.Model):
     post = models.ForeignKey(Post, related_name='media', on_delete=models.CASCADE)
@@ -52,60 +122,46 @@ class PostMedia(models.Model):
         upload_to='posts/media/', 
         blank=True, 
         null=True,
+        db_index=True,
         validators=[validate_file_size]
     )
     media_type = models.CharField(max_length=20, choices=[('image', 'Image'), ('gif', 'GIF')], default='image')
+    # {format: {width: storage name}} of the resized copies (api/media.py)
+    renditions = models.JSONField(default=dict, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
-    def save(self, *args, **kwargs):
-        if self.media_file:
-            try:
-                img = Image.open(self.media_file)
-
-                img = ImageOps.exif_transpose(img)
+    # Uploads are stored as-is and finished by the process_media worker (api/media.py)
+    PENDING, PROCESSING, READY, FAILED = 'pending', 'processing', 'ready', 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (PROCESSING, 'Processing'), (READY, 'Ready'), (FAILED, 'Failed')]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.CharField(max_length=255, blank=True, default='')
+    available_at = models.DateTimeField(default=now)
+    claimed_at = models.DateTimeField(blank=True, null=True)
 
-                img_format = img.format
-
-                if img_format == "GIF":
-                    self.media_type = "gif"
-                    ext = ".gif"
-                    self.media_file.seek(0)
-                    content = self.media_file.read()
-                else:
-                    self.media_type = "image"
-                    max_size = (1080, 1080)
-                    img.thumbnail(max_size, Image.LANCZOS)
-
-                    if img.mode in ("RGBA", "P"):
-                        img = img.convert("RGB")
-
-                    output = BytesIO()
-                    if img_format == "PNG":
-                        img.save(output, format='PNG', optimize=True)
-                        ext = ".png"
-                    else:
-                        img.save(output, format='JPEG', quality=75)
-                        ext = ".jpg"
-
-                    output.seek(0)
-                    content = output.read()
-
-                # Always assign a UUID filename
-                unique_filename = f"{uuid.uuid4().hex}{ext}"
-
-                self.media_file = ContentFile(content, name=unique_filename)
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'], name='postmedia_queue_idx')]
 
-            except UnidentifiedImageError:
-                pass
+    def save(self, *args, **kwargs):
+        if self.media_file and not self.media_file._committed:
+            # Raw upload: keep the bytes, assign a UUID filename
+            ext = os.path.splitext(self.media_file.name)[1].lower()
+            self.media_type = "gif" if ext == ".gif" else "image"
+            self.media_file.name = f"raw/{uuid.uuid4().hex}{ext}"
 
         super().save(*args, **kwargs)
 
-
-    def delete(self, *args, **kwargs):
-        storage = self.media_file.storage
-        if self.media_file.name and storage.exists(self.media_file.name):
-            storage.delete(self.media_file.name)
-        super().delete(*args, **kwargs)
+class StoredFile(models.Model):
+    # A file in default storage shared by every PostMedia row / avatar that
+    # points at it. Processed images are named by the hash of their content,
+    # so identical images are stored once; the file and its renditions are
+    # deleted when the last reference goes (api/media.py).
+    name = models.CharField(max_length=255, unique=True)
+    # sha256 of the raw upload this file was produced from, to skip
+    # processing when the same bytes are uploaded again
+    raw_digest = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    renditions = models.JSONField(default=dict, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
 
 class Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='likes')
@@ -113,4 +169,21 @@ class Like(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('user', 'post')
\ No newline at end of file
+        unique_together = ('user', 'post')
+        indexes = [
+            # A user's liked posts, most recently liked first
+            models.Index(fields=['user', '-created_at', '-id'], name='like_user_recent_idx'),
+        ]
+
+class TimelineEntry(models.Model):
+    # Materialized home feed row: `post` was pushed to `user`'s following feed.
+    # created_at copies post.created_at so the feed is read straight off the index.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_recent_idx'),
+        ]
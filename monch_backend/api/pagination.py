@@ -0,0 +1,155 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models import BigIntegerField, DateTimeField, FloatField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Opaque cursors are urlsafe base64 encoded JSON objects.
+
+def encode_cursor(position):
+    data = json.dumps(position, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError, binascii.Error):
+        raise NotFound('Invalid cursor.')
+    if not isinstance(position, dict):
+        raise NotFound('Invalid cursor.')
+    return position
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering, (created_at, id) by default.
+    Each page is a single range scan: no COUNT(*) and no OFFSET, so deep
+    pages cost the same as the first one. ?limit= sets the page size.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 10
+    max_page_size = 50
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    # Fields reading the ordering values of a cursor back from JSON; anything
+    # not listed is an id (SQLite doesn't bound integers, so the range is checked here)
+    id_field = BigIntegerField(validators=[MinValueValidator(-2 ** 63), MaxValueValidator(2 ** 63 - 1)])
+    cursor_fields = {
+        'created_at': DateTimeField(),
+        'date_joined': DateTimeField(),
+        'liked_at': DateTimeField(),
+        'followed_at': DateTimeField(),
+        'rank': FloatField(),
+    }
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+
+    def get_page_size(self, request):
+        try:
+            return max(1, min(int(request.query_params[self.limit_query_param]), self.max_page_size))
+        except (KeyError, TypeError, ValueError):
+            return self.page_size
+
+    def get_position(self, request):
+        """Ordering values of the row the requested page starts after, or None."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        values = decode_cursor(cursor).get('after')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor.')
+        position = []
+        for (name, _), value in zip(self._fields(), values):
+            field = self.cursor_fields.get(name, self.id_field)
+            try:
+                # Also rejects nulls
+                position.append(field.clean(value, None))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound('Invalid cursor.')
+        return position
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self._page(list(self._page_queryset(queryset, request)), request)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset for async views."""
+        return self._page([obj async for obj in self._page_queryset(queryset, request)], request)
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _page_queryset(self, queryset, request):
+        position = self.get_position(request)
+        if position is not None:
+            queryset = queryset.filter(self._after(self._fields(), position))
+        return queryset.order_by(*self.ordering)[:self.get_page_size(request) + 1]
+
+    def _page(self, rows, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.next_position = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_position = [self._value(rows[-1], name) for name, _ in self._fields()]
+        return rows
+
+    def paginate_list(self, rows, request, position):
+        """
+        Same as paginate_queryset for rows fetched outside the ORM: `rows` are
+        already filtered by get_position() and ordered, at most page size + 1
+        long, and position(row) returns a row's ordering values.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.next_position = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_position = list(position(rows[-1]))
+        return rows
+
+    def _after(self, fields, values):
+        # (a, b) after (x, y)  ->  a > x OR (a = x AND b > y), with < for descending fields
+        condition = Q()
+        for index, (name, descending) in enumerate(fields):
+            lookup = Q(**{f'{name}__lt' if descending else f'{name}__gt': values[index]})
+            for (previous, _), value in zip(fields[:index], values):
+                lookup &= Q(**{previous: value})
+            condition |= lookup
+        return condition
+
+    def _value(self, obj, name):
+        value = getattr(obj, name)
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor({'after': self.next_position}))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('-date_joined', '-id')
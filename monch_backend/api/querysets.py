@@ -0,0 +1,50 @@
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from .models import User, Post
+
+# Shared querysets for anything rendered through PostSerializer / UserSerializer.
+# Counts are denormalized columns and related rows are prefetched, so
+# serializing a page costs a fixed number of queries instead of several per post.
+
+def count_subquery(model, field):
+    # COUNT(*) of `model` rows pointing at the outer row; the source of truth
+    # for the counter columns (used by reconcile_counters)
+    rows = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+def user_queryset(include_posts=False):
+    users = User.objects.all()
+    if include_posts:
+        users = users.prefetch_related(Prefetch('posts', queryset=Post.objects.only('id', 'user_id')))
+    return users
+
+def repost_of_queryset():
+    # Reposts show the original's content and media (Post.original)
+    return Post.objects.prefetch_related('media')
+
+def parent_post_queryset():
+    return Post.objects.prefetch_related(
+        'media',
+        Prefetch('repost_of', queryset=repost_of_queryset()),
+    )
+
+def post_queryset(queryset=None):
+    """
+    Prefetched posts for PostSerializer. Reply trees are attached separately
+    by api.threads.load_threads, the viewer's liked / reposted flags by
+    api.viewer_state and authors by api.user_map.
+    """
+    if queryset is None:
+        queryset = Post.objects.all()
+
+    return queryset.prefetch_related(
+        'media',
+        Prefetch('parent_post', queryset=parent_post_queryset()),
+        Prefetch('repost_of', queryset=repost_of_queryset()),
+    )
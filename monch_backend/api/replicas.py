@@ -0,0 +1,191 @@
+import logging
+import random
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+from django.db.backends.signals import connection_created
+from rest_framework.permissions import SAFE_METHODS
+
+# Read replicas. ReplicaRouter sends the reads of GET/HEAD/OPTIONS requests
+# served by DRF views to one of the REPLICA_DATABASES (DATABASE_REPLICA_URLS);
+# everything else - writes, unsafe requests, admin, management commands and
+# workers - uses the primary.
+#
+# Read-your-writes: a user who made an unsafe request is pinned to the primary
+# for REPLICA_PIN_SECONDS (a key in the shared cache, so every process sees
+# it). The user is only known once CachedJWTAuthentication has run, so reads
+# before that (the token's user, on a cache miss) go to the primary too.
+# Within a request, reads after a write or inside a transaction also stay on
+# the primary, and all reads of one request use the same replica.
+#
+# Each process checks a replica at most every REPLICA_HEALTH_CHECK_INTERVAL
+# seconds, when a read needs one: it must answer, and on PostgreSQL be at most
+# REPLICA_MAX_LAG seconds behind. A replica whose query fails is marked down
+# until the next check. With no healthy replica, reads use the primary.
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('replica_routing', default=None)
+_health = {}  # alias -> (healthy, monotonic time of the check)
+
+# Seconds of replay lag; 0 when everything received has been replayed, which
+# is also the case on an idle primary whose last commit is old
+LAG_SQL = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+def _pin_key(user_id):
+    return f'db:pin:{user_id}'
+
+
+class Routing:
+    __slots__ = ('allowed', 'identified', 'user_id', 'pinned', 'wrote', 'replica')
+
+    def __init__(self):
+        self.allowed = False
+        self.identified = False
+        self.user_id = None
+        self.pinned = None
+        self.wrote = False
+        self.replica = None
+
+    def read_alias(self):
+        if not self.allowed or not self.identified or self.wrote:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if self.pinned is None:
+            self.pinned = self.user_id is not None and cache.get(_pin_key(self.user_id)) is not None
+        if self.pinned:
+            return DEFAULT_DB_ALIAS
+        if self.replica is None:
+            self.replica = random.choice(healthy_replicas() or [DEFAULT_DB_ALIAS])
+        return self.replica
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        return DEFAULT_DB_ALIAS if routing is None else routing.read_alias()
+
+    def db_for_write(self, model, **hints):
+        routing = _current.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
+
+
+def identify(user_id):
+    """Called by the authentication class: who the current request is (None: anonymous)."""
+    routing = _current.get()
+    if routing is not None:
+        routing.identified = True
+        routing.user_id = user_id
+
+def pin(user_id):
+    """Send `user_id`'s reads to the primary for the next REPLICA_PIN_SECONDS."""
+    cache.set(_pin_key(user_id), 1, settings.REPLICA_PIN_SECONDS)
+
+def healthy_replicas():
+    now = time.monotonic()
+    healthy = []
+    for alias in settings.REPLICA_DATABASES:
+        entry = _health.get(alias)
+        if entry is None or now - entry[1] >= settings.REPLICA_HEALTH_CHECK_INTERVAL:
+            entry = _health[alias] = (check(alias), now)
+        if entry[0]:
+            healthy.append(alias)
+    return healthy
+
+def check(alias):
+    connection = connections[alias]
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+                if lag is not None and lag > settings.REPLICA_MAX_LAG:
+                    logger.warning('Replica %s is %.1fs behind, reading from the primary', alias, lag)
+                    return False
+            else:
+                cursor.execute('SELECT 1')
+        return True
+    except DatabaseError:
+        logger.warning('Replica %s is unreachable, reading from the primary', alias, exc_info=True)
+        connection.close()
+        return False
+
+def _mark_down_on_error(alias):
+    def execute_wrapper(execute, sql, params, many, context):
+        try:
+            return execute(sql, params, many, context)
+        except (OperationalError, InterfaceError):
+            _health[alias] = (False, time.monotonic())
+            raise
+    return execute_wrapper
+
+def _watch_connection(connection, **kwargs):
+    if connection.alias in settings.REPLICA_DATABASES and not getattr(connection, 'replica_watched', False):
+        connection.execute_wrappers.append(_mark_down_on_error(connection.alias))
+        connection.replica_watched = True
+
+def install():
+    """Mark replicas down as soon as one of their queries fails."""
+    connection_created.connect(_watch_connection, dispatch_uid='api.replicas')
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+        routing = Routing()
+        token = _current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, routing)
+
+    async def __acall__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return await self.get_response(request)
+        routing = Routing()
+        token = _current.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, routing)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = _current.get()
+        if routing is not None:
+            # DRF's as_view() (and async_views) set .cls; Django's views set .view_class
+            routing.allowed = request.method in SAFE_METHODS and hasattr(view_func, 'cls')
+
+    def finish(self, request, response, routing):
+        if request.method not in SAFE_METHODS and routing.user_id is not None:
+            pin(routing.user_id)
+        return response
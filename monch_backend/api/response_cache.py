@@ -0,0 +1,148 @@
+import hashlib
+import random
+import time
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+# Response cache for anonymous reads. A cached entry stores the response data
+# together with the version of everything it was rendered from:
+#   post:<id>    the post itself (content, counters, media)
+#   thread:<id>  the set of replies under the post
+#   user:<id>    a profile (names, avatar, counters, post ids)
+#   feed         the set of top-level posts
+#   viewer:<id>  a user's likes not yet written (api/like_buffer.py); only
+#                the ETags of that user's own responses depend on it
+# Signals bump those versions when anything changes (api/signals.py), and an
+# entry is only served fresh while all of them still match.
+#
+# Stale entries (changed or older than RESPONSE_CACHE_TIMEOUT) are served for
+# up to RESPONSE_CACHE_STALE more seconds while a single request, holding
+# a lock, rebuilds them; on a cold miss the other requests wait for that one
+# instead of all hitting the database. Stale-while-revalidate and stampede
+# protection work across processes only with a shared cache backend.
+
+KEY_PREFIX = 'response'
+STATS = ('hit', 'stale', 'wait', 'miss', 'bypass')
+WAIT_INTERVAL = 0.05
+
+def version_key(dependency):
+    return f'{KEY_PREFIX}:version:{dependency}'
+
+def url_key(prefix, request, *parts):
+    """Cache key for the request's URL; hashed to stay short with long query strings."""
+    url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+    return ':'.join([prefix, *map(str, parts), url])
+
+def bump(*dependencies):
+    """Invalidate every cached response rendered from `dependencies`."""
+    for dependency in dependencies:
+        key = version_key(dependency)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Not cached (yet, or evicted): a random start value can't match
+            # a version recorded before the eviction
+            cache.set(key, random.getrandbits(62), None)
+
+def current_versions(dependencies):
+    """Current version of each dependency, starting a version for new ones."""
+    keys = {version_key(dependency): dependency for dependency in dependencies}
+    found = cache.get_many(list(keys))
+    versions = {keys[key]: value for key, value in found.items()}
+    for dependency in set(dependencies) - set(versions):
+        value = random.getrandbits(62)
+        cache.add(version_key(dependency), value, None)
+        versions[dependency] = cache.get(version_key(dependency), value)
+    return versions
+
+def _is_current(entry):
+    versions = cache.get_many([version_key(dependency) for dependency in entry['versions']])
+    return all(versions.get(version_key(dependency)) == version for dependency, version in entry['versions'].items())
+
+def dependencies(data):
+    """post:/thread:/user: dependencies of serialized posts and users found anywhere in `data`."""
+    found = set()
+
+    def walk(value):
+        if isinstance(value, list):
+            for item in value:
+                walk(item)
+        elif isinstance(value, dict):
+            if 'id' in value and 'username' in value:
+                found.add(f"user:{value['id']}")
+            elif 'id' in value and 'user' in value:
+                found.add(f"post:{value['id']}")
+                if 'replies' in value:
+                    found.add(f"thread:{value['id']}")
+            for item in value.values():
+                walk(item)
+
+    walk(data)
+    return found
+
+def _record(stat):
+    key = f'{KEY_PREFIX}:stats:{stat}'
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+def stats():
+    counts = cache.get_many([f'{KEY_PREFIX}:stats:{stat}' for stat in STATS])
+    result = {stat: counts.get(f'{KEY_PREFIX}:stats:{stat}', 0) for stat in STATS}
+    served = result['hit'] + result['stale'] + result['wait']
+    lookups = served + result['miss']
+    result['hit_ratio'] = round(served / lookups, 4) if lookups else None
+    return result
+
+def _respond(entry, stat):
+    _record(stat)
+    return Response(entry['data'], status=entry['status'], headers={'X-Cache': stat.upper()})
+
+def cached_response(request, render, extra_dependencies=()):
+    """
+    Response for a GET by an anonymous user, from the cache when possible;
+    `render()` builds it otherwise. Other requests are rendered directly.
+    """
+    if request.method != 'GET' or request.user.is_authenticated:
+        return render()
+
+    key = url_key(KEY_PREFIX, request)
+    lock_key = f'{key}:lock'
+    entry = cache.get(key)
+
+    if entry is not None:
+        age = time.time() - entry['stored_at']
+        if age < settings.RESPONSE_CACHE_TIMEOUT and _is_current(entry):
+            return _respond(entry, 'hit')
+        if not cache.add(lock_key, 1, settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+            # Someone else is already rebuilding it
+            return _respond(entry, 'stale')
+    elif not cache.add(lock_key, 1, settings.RESPONSE_CACHE_LOCK_TIMEOUT):
+        deadline = time.monotonic() + settings.RESPONSE_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline and cache.get(lock_key) is not None:
+            time.sleep(WAIT_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return _respond(entry, 'wait')
+        # The rebuilding request failed or timed out: render it ourselves
+
+    try:
+        response = render()
+        if response.status_code != 200:
+            _record('bypass')
+            return response
+        versions = current_versions({*extra_dependencies, *dependencies(response.data)})
+        cache.set(key, {
+            'data': response.data,
+            'status': response.status_code,
+            'versions': versions,
+            'stored_at': time.time(),
+        }, settings.RESPONSE_CACHE_TIMEOUT + settings.RESPONSE_CACHE_STALE)
+    finally:
+        cache.delete(lock_key)
+    _record('miss')
+    response['X-Cache'] = 'MISS'
+    return response
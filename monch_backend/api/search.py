@@ -0,0 +1,137 @@
+import html
+import re
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db import connection, connections, router
+from django.db.models import F, FloatField, Q, Value
+from .models import Post
+
+# Post search. PostgreSQL keeps a weighted tsvector per post in
+# Post.search_vector (GIN indexed); SQLite keeps the same text in the FTS5
+# table api_post_fts (rowid = post id). Both are maintained from signals on
+# post save/delete and user renames. Every word of the query is prefix-matched so results
+# update per keystroke, best match first; other backends fall back to icontains.
+#
+# Snippets are HTML: the database marks hits with private-use characters, the
+# text is escaped and the marks become <mark></mark> (highlight()).
+
+FTS_TABLE = 'api_post_fts'
+SEARCH_CONFIG = 'english'
+START_SEL, STOP_SEL = '\ue000', '\ue001'
+MAX_TERMS = 8
+
+def search_terms(text):
+    return re.findall(r'\w+', (text or '').lower())[:MAX_TERMS]
+
+def _index(condition, params):
+    """(Re)index the posts `p` matching the SQL `condition`, reading content and username in the same statement."""
+    table = connection.ops.quote_name(Post._meta.db_table)
+    # Reposts are pointer rows without text of their own: the original is found instead
+    indexed = f'({condition}) AND p.repost_of_id IS NULL'
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"UPDATE {table} AS p SET search_vector = "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(p.content, '')), 'A') || "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', u.username), 'B') "
+                f"FROM api_user u WHERE u.id = p.user_id AND {indexed}",
+                params,
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT p.id FROM {table} p WHERE {condition})', params)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, content, username) "
+                f"SELECT p.id, coalesce(p.content, ''), u.username FROM {table} p "
+                f"JOIN api_user u ON u.id = p.user_id WHERE {indexed}",
+                params,
+            )
+
+def index_post(post):
+    _index('p.id = %s', [post.pk])
+
+def index_range(first_id, last_id):
+    """Index every post with an id in [first_id, last_id] in one statement, for bulk loads."""
+    _index('p.id BETWEEN %s AND %s', [first_id, last_id])
+
+def index_author(user_id):
+    """Reindex every post of a user, after a rename."""
+    _index('p.user_id = %s', [user_id])
+
+def unindex_post(post_id):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+def highlight(snippet):
+    """HTML-escape a snippet, turning its START_SEL/STOP_SEL marks into <mark></mark>."""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>')
+
+def search_posts(text, limit, after=None):
+    """
+    Top-level posts (reposts left out) matching `text` as (post id, score, snippet) rows,
+    highest score first, at most `limit` of them, strictly after the
+    (score, id) position `after` if given. Snippets are escaped HTML.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+    if connection.vendor == 'postgresql':
+        rows = _search_postgres(terms, limit, after)
+    elif connection.vendor == 'sqlite':
+        rows = _search_sqlite(terms, limit, after)
+    else:
+        rows = _search_icontains(terms, limit, after)
+    return [(post_id, score, highlight(snippet)) for post_id, score, snippet in rows]
+
+def _after(rows, after):
+    if after is None:
+        return rows
+    score, post_id = after
+    return rows.filter(Q(score__lt=score) | Q(score=score, id__lt=post_id))
+
+def _search_postgres(terms, limit, after):
+    query = SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config=SEARCH_CONFIG)
+    rows = Post.objects.filter(search_vector=query, parent_post__isnull=True, repost_of__isnull=True).annotate(
+        score=SearchRank(F('search_vector'), query),
+        snippet=SearchHeadline(
+            'content', query, config=SEARCH_CONFIG,
+            start_sel=START_SEL, stop_sel=STOP_SEL, max_words=30, min_words=10,
+        ),
+    )
+    return list(_after(rows, after).order_by('-score', '-id').values_list('id', 'score', 'snippet')[:limit])
+
+def _search_sqlite(terms, limit, after):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    table = connection.ops.quote_name(Post._meta.db_table)
+    params = [START_SEL, STOP_SEL, match]
+    position = ''
+    if after is not None:
+        position = 'WHERE score < %s OR (score = %s AND id < %s)'
+        params += [after[0], after[0], after[1]]
+    sql = f"""
+        SELECT id, score, snippet FROM (
+            SELECT {FTS_TABLE}.rowid AS id,
+                   -bm25({FTS_TABLE}, 2.0, 1.0) AS score,
+                   snippet({FTS_TABLE}, 0, %s, %s, '…', 24) AS snippet
+            FROM {FTS_TABLE}
+            JOIN {table} p ON p.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND p.parent_post_id IS NULL AND p.repost_of_id IS NULL
+        )
+        {position}
+        ORDER BY score DESC, id DESC
+        LIMIT %s
+    """
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute(sql, params + [limit])
+        return cursor.fetchall()
+
+def _search_icontains(terms, limit, after):
+    condition = Q()
+    for term in terms:
+        condition &= Q(content__icontains=term) | Q(user__username__icontains=term)
+    rows = Post.objects.filter(condition, parent_post__isnull=True, repost_of__isnull=True).annotate(
+        score=Value(0.0, output_field=FloatField()),
+        snippet=F('content'),
+    )
+    return list(_after(rows, after).order_by('-score', '-id').values_list('id', 'score', 'snippet')[:limit])
@@ -1,31 +1,44 @@
 from rest_framework import serializers
 from rest_framework.response import Response
 from .models import User, Post, PostMedia, Follow, Like
+from .threads import load_threads, thread_options
+from .media import set_avatar, srcset
+from .viewer_state import viewer_state
+from .user_map import user_map
+
+def includes_posts(request):
+    # The author's post ids are only listed with ?include=posts
+    return request is not None and 'posts' in request.query_params.get('include', '').split(',')
 
 class UserSerializer(serializers.ModelSerializer):
+    # Full profile; posts embed UserSummarySerializer instead
     posts = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
-    follower_count = serializers.SerializerMethodField()
-    following_count = serializers.SerializerMethodField()
+    follower_count = serializers.IntegerField(read_only=True)
+    following_count = serializers.IntegerField(read_only=True)
+    avatar_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'display_name', 'bio', 'avatar', 'posts', 'follower_count', 'following_count']
+        fields = ['id', 'username', 'display_name', 'bio', 'avatar', 'avatar_srcset', 'posts', 'follower_count', 'following_count']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not includes_posts(self.context.get('request')):
+            fields.pop('posts')
+        return fields
+
+    def get_avatar_srcset(self, obj):
+        return srcset(obj.avatar.storage, obj.avatar_renditions, self.context.get('request'))
     
     def update(self, instance, validated_data):
         avatar = validated_data.pop('avatar', None)
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        if avatar is not None:
-            instance.avatar = avatar
         instance.save()
+        if avatar is not None:
+            set_avatar(instance, avatar)
         return instance
 
-    def get_follower_count(self, obj):
-        return obj.followers.count()
-
-    def get_following_count(self, obj):
-        return obj.following.count()
-    
     def get_is_following(self, obj):
         request = self.context.get('request', None)
         if request and request.user.is_authenticated:
@@ -37,26 +50,84 @@ class UserSerializer(serializers.ModelSerializer):
         serializer = self.get_serializer(instance, context={'request': request})
         return Response(serializer.data)
 
-class RepostOfSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+class UserSummarySerializer(serializers.ModelSerializer):
+    # Compact author embedded in posts, follows and likes
+    avatar_srcset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'display_name', 'avatar', 'avatar_srcset']
+        read_only_fields = fields
+
+    def get_avatar_srcset(self, obj):
+        return srcset(obj.avatar.storage, obj.avatar_renditions, self.context.get('request'))
+
+class AuthorMixin:
+    # Authors come from the request's api.user_map.UserMap and are serialized
+    # once per request, however many posts they appear on.
+
+    def get_user(self, obj):
+        authors = user_map(self.context['request'])
+        if obj.user_id not in authors.summaries:
+            authors.summaries[obj.user_id] = UserSummarySerializer(authors.get(obj.user_id), context=self.context).data
+        return authors.summaries[obj.user_id]
+
+class RepostOfSerializer(AuthorMixin, serializers.ModelSerializer):
+    user = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = ['id', 'content', 'user']
     
 class PostMediaSerializer(serializers.ModelSerializer):
+    # {MIME type: srcset} of the resized AVIF / WebP copies
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = PostMedia
-        fields = ['id', 'media_file', 'media_type', 'uploaded_at']
-        read_only_fields = ['id', 'uploaded_at']
+        fields = ['id', 'media_file', 'media_type', 'status', 'srcset', 'uploaded_at']
+        read_only_fields = ['id', 'status', 'uploaded_at']
+
+    def get_srcset(self, obj):
+        return srcset(obj.media_file.storage, obj.renditions, self.context.get('request'))
+
+class OriginalContentField(serializers.CharField):
+    # A repost's text is the original's (Post.original)
+    def get_attribute(self, instance):
+        return super().get_attribute(instance.original)
+
+class OriginalMediaMixin:
+    # A repost's media are the original's, prefetched with it by
+    # api.querysets.repost_of_queryset
+    def get_media(self, obj):
+        return PostMediaSerializer(obj.original.media.all(), many=True, context=self.context).data
+
+class PostStatsMixin:
+    # Viewer flags come from the request's api.viewer_state.ViewerState, loaded
+    # for the whole page by PostListSerializer / PostSerializer.
+
+    def get_likes(self, obj):
+        return max(0, obj.likes_count + viewer_state(self.context['request']).likes_delta(obj))
+
+    def get_liked_by_user(self, obj):
+        return viewer_state(self.context['request']).liked(obj)
+
+    def get_reposted_by_user(self, obj):
+        return self.get_user_repost_id(obj) is not None
+
+    def get_user_repost_id(self, obj):
+        return viewer_state(self.context['request']).repost_id(obj)
+
 
-class ParentPostSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
-    media = PostMediaSerializer(many=True, read_only=True)
-    likes = serializers.IntegerField(source='likes.count', read_only=True)
+class ParentPostSerializer(AuthorMixin, PostStatsMixin, OriginalMediaMixin, serializers.ModelSerializer):
+    user = serializers.SerializerMethodField()
+    content = OriginalContentField(read_only=True)
+    media = serializers.SerializerMethodField()
+    likes = serializers.SerializerMethodField()
     liked_by_user = serializers.SerializerMethodField()
     reposted_by_user = serializers.SerializerMethodField()
-    replies_count = serializers.SerializerMethodField()
+    replies_count = serializers.IntegerField(read_only=True)
+    reposts_count = serializers.IntegerField(read_only=True)
     repost_of_detail = RepostOfSerializer(source='repost_of', read_only=True)
 
     class Meta:
@@ -71,28 +142,34 @@ class ParentPostSerializer(serializers.ModelSerializer):
             'liked_by_user',
             'reposted_by_user',
             'replies_count',
+            'reposts_count',
             'repost_of_detail',
         ]
 
-    def get_liked_by_user(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return obj.likes.filter(user=user).exists()
 
-    def get_reposted_by_user(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return Post.objects.filter(repost_of=obj, user=user).exists()
+def prepare_posts(posts, request):
+    """
+    Load everything serializing `posts` needs in a few batched queries: reply
+    trees, the viewer's likes / reposts and the authors. Each part skips what
+    is already loaded, and serialization itself runs no queries.
+    """
+    load_threads(posts, *thread_options(request))
+    viewer_state(request).load_posts(posts)
+    user_map(request).load_posts(posts)
 
-    def get_replies_count(self, obj):
-        return obj.replies.count()
+class PostListSerializer(serializers.ListSerializer):
+    # Loads the reply trees of every post in the list with one thread query,
+    # then the viewer's likes / reposts and the authors of everything on the page.
+    def to_representation(self, data):
+        posts = list(data.all() if hasattr(data, 'all') else data)
+        prepare_posts(posts, self.context['request'])
+        return super().to_representation(posts)
 
-    
-class PostSerializer(serializers.ModelSerializer):
-    likes = serializers.IntegerField(source='likes.count', read_only=True)
-    user = UserSerializer(read_only=True)
+
+class PostSerializer(AuthorMixin, PostStatsMixin, OriginalMediaMixin, serializers.ModelSerializer):
+    likes = serializers.SerializerMethodField()
+    user = serializers.SerializerMethodField()
+    content = OriginalContentField(max_length=500, allow_null=True, allow_blank=True, required=False)
     user_repost_id = serializers.SerializerMethodField()
 
     parent_post = serializers.PrimaryKeyRelatedField(
@@ -112,45 +189,33 @@ class PostSerializer(serializers.ModelSerializer):
     )
     repost_of_detail = RepostOfSerializer(source='repost_of', read_only=True)  # nested read-only output
     replies = serializers.SerializerMethodField()
+    replies_cursor = serializers.SerializerMethodField()
     liked_by_user = serializers.SerializerMethodField()
     reposted_by_user = serializers.SerializerMethodField()
-    replies_count = serializers.SerializerMethodField()
-    media = PostMediaSerializer(many=True, required=False)
+    replies_count = serializers.IntegerField(read_only=True)
+    reposts_count = serializers.IntegerField(read_only=True)
+    media = serializers.SerializerMethodField()
     user_repost_id = serializers.SerializerMethodField()
     
     class Meta:
         model = Post
-        fields = ['id', 'user', 'content', 'created_at', 'parent_post', 'parent_post_detail', 'repost_of', 'repost_of_detail', 'replies', 'likes', 'liked_by_user', 'reposted_by_user', 'replies_count', 'media', 'user_repost_id']
+        list_serializer_class = PostListSerializer
+        fields = ['id', 'user', 'content', 'created_at', 'parent_post', 'parent_post_detail', 'repost_of', 'repost_of_detail', 'replies', 'replies_cursor', 'likes', 'liked_by_user', 'reposted_by_user', 'replies_count', 'reposts_count', 'media', 'user_repost_id']
 
-    def get_likes(self, obj):
-        return obj.likes.count()
-    
-    def get_liked_by_user(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return obj.likes.filter(user=user).exists()
-    
-    def get_reposted_by_user(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return Post.objects.filter(repost_of=obj, user=user).exists()
+    def to_representation(self, instance):
+        if self.parent is None:
+            # A single post: same batching as PostListSerializer
+            prepare_posts([instance], self.context['request'])
+        return super().to_representation(instance)
 
     def get_replies(self, obj):
-        replies = obj.replies.all().order_by('created_at')
-        return PostSerializer(replies, many=True, context=self.context).data
-    
-    def get_replies_count(self, obj):
-        return obj.replies.count()
-    
-    def get_user_repost_id(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return None
+        if not hasattr(obj, 'thread_replies'):
+            request = self.context['request']
+            load_threads([obj], *thread_options(request))
+        return PostSerializer(obj.thread_replies, many=True, context=self.context).data
 
-        repost = Post.objects.filter(repost_of=obj, user=user).first()
-        return repost.id if repost else None
+    def get_replies_cursor(self, obj):
+        return getattr(obj, 'replies_cursor', None)
 
     def validate(self, data):
         request = self.context.get('request')
@@ -163,8 +228,8 @@ class PostSerializer(serializers.ModelSerializer):
     
 
 class FollowSerializer(serializers.ModelSerializer):
-    follower = UserSerializer(read_only=True)
-    following = UserSerializer(read_only=True)
+    follower = UserSummarySerializer(read_only=True)
+    following = UserSummarySerializer(read_only=True)
 
     class Meta:
         model = Follow
@@ -176,9 +241,34 @@ class FollowSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
     
 class LikeSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserSummarySerializer(read_only=True)
     post = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = Like
         fields = ['id', 'user', 'post']
+
+
+class SearchResultSerializer(PostSerializer):
+    rank = serializers.FloatField(source='search_rank', read_only=True)
+    # Matched text as escaped HTML, with the hits wrapped in <mark></mark>
+    snippet = serializers.CharField(source='search_snippet', read_only=True)
+
+    class Meta(PostSerializer.Meta):
+        fields = PostSerializer.Meta.fields + ['rank', 'snippet']
+
+class SuggestionSerializer(UserSummarySerializer):
+    # How many of the people the viewer follows follow this user, and a few of them
+    followed_by_count = serializers.SerializerMethodField()
+    followed_by = serializers.SerializerMethodField()
+
+    class Meta(UserSummarySerializer.Meta):
+        fields = UserSummarySerializer.Meta.fields + ['followed_by_count', 'followed_by']
+        read_only_fields = fields
+
+    def get_followed_by_count(self, obj):
+        return len(obj.suggested_via)
+
+    def get_followed_by(self, obj):
+        users = self.context['suggested_via_users']
+        return [users[pk] for pk in obj.suggested_via[:3] if pk in users]
@@ -1,9 +1,141 @@
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
+from .models import User, Post, PostMedia, Follow, Like
+from . import timeline, search, media, response_cache, follow_graph, authentication
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
-        Token.objects.create(user=instance)
\ No newline at end of file
+        Token.objects.create(user=instance)
+
+@receiver(post_save, sender=Post)
+def push_to_timelines(sender, instance=None, created=False, **kwargs):
+    if created:
+        # After commit, so writing thousands of entries for a popular author
+        # doesn't hold the post's transaction open
+        transaction.on_commit(lambda: timeline.fan_out_post(instance))
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance=None, created=False, **kwargs):
+    if created:
+        timeline.backfill(instance.follower_id, [instance.following_id])
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance=None, **kwargs):
+    timeline.remove_authors(instance.follower_id, [instance.following_id])
+
+@receiver(post_save, sender=Follow)
+def record_follow(sender, instance=None, created=False, **kwargs):
+    if created:
+        follow_graph.record(follow_graph.FOLLOW, instance.follower_id, [instance.following_id])
+
+@receiver(post_delete, sender=Follow)
+def record_unfollow(sender, instance=None, **kwargs):
+    follow_graph.record(follow_graph.UNFOLLOW, instance.follower_id, [instance.following_id])
+
+# Denormalized counters. Each change is a single UPDATE ... SET n = n +/- 1, so
+# concurrent writers never lose increments; drift is fixed by reconcile_counters.
+
+def bump(model, pk, **deltas):
+    if pk is not None:
+        model.objects.filter(pk=pk).update(**{field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()})
+
+@receiver(post_save, sender=Like)
+def count_like(sender, instance=None, created=False, **kwargs):
+    if created:
+        bump(Post, instance.post_id, likes_count=1)
+
+@receiver(post_delete, sender=Like)
+def uncount_like(sender, instance=None, **kwargs):
+    bump(Post, instance.post_id, likes_count=-1)
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance=None, created=False, **kwargs):
+    if created:
+        bump(User, instance.follower_id, following_count=1)
+        bump(User, instance.following_id, follower_count=1)
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance=None, **kwargs):
+    bump(User, instance.follower_id, following_count=-1)
+    bump(User, instance.following_id, follower_count=-1)
+
+@receiver(post_save, sender=Post)
+def count_reply_or_repost(sender, instance=None, created=False, **kwargs):
+    if created:
+        bump(Post, instance.parent_post_id, replies_count=1)
+        bump(Post, instance.repost_of_id, reposts_count=1)
+
+@receiver(post_delete, sender=Post)
+def uncount_reply_or_repost(sender, instance=None, **kwargs):
+    bump(Post, instance.parent_post_id, replies_count=-1)
+    bump(Post, instance.repost_of_id, reposts_count=-1)
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance=None, **kwargs):
+    search.index_post(instance)
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance=None, **kwargs):
+    search.unindex_post(instance.pk)
+
+@receiver(post_save, sender=User)
+def reindex_renamed_user(sender, instance=None, created=False, **kwargs):
+    # Runs before User.save records the new name
+    saved = getattr(instance, '_saved_username', None)
+    if not created and saved is not None and saved != instance.username:
+        search.index_author(instance.pk)
+
+@receiver(post_save, sender=PostMedia)
+def reference_media_file(sender, instance=None, created=False, **kwargs):
+    if created:
+        media.add_reference(instance.media_file.name)
+
+@receiver(post_delete, sender=PostMedia)
+def release_media_file(sender, instance=None, **kwargs):
+    media.release(instance.media_file.name)
+
+@receiver(post_delete, sender=User)
+def release_avatar(sender, instance=None, **kwargs):
+    media.release(instance.avatar.name)
+
+# Response cache versions (api/response_cache.py)
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance=None, created=False, **kwargs):
+    dependencies = [f'post:{instance.pk}', f'user:{instance.user_id}']
+    if instance.parent_post_id:
+        dependencies += [f'post:{instance.parent_post_id}', f'thread:{instance.parent_post_id}']
+    elif created or kwargs['signal'] is post_delete:
+        dependencies.append('feed')
+    if instance.repost_of_id:
+        dependencies.append(f'post:{instance.repost_of_id}')
+    response_cache.bump(*dependencies)
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=PostMedia)
+@receiver(post_delete, sender=PostMedia)
+def invalidate_liked_or_media_post(sender, instance=None, **kwargs):
+    response_cache.bump(f'post:{instance.post_id}')
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow(sender, instance=None, **kwargs):
+    response_cache.bump(f'user:{instance.follower_id}', f'user:{instance.following_id}')
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance=None, **kwargs):
+    response_cache.bump(f'user:{instance.pk}')
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_authenticated_user(sender, instance=None, **kwargs):
+    authentication.forget_users(instance.pk)
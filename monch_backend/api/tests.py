@@ -1,3 +1,1174 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import importlib
+import json
+import os
+import re
+import tempfile
+from contextlib import contextmanager, nullcontext
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.urls import clear_url_caches, resolve
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from . import checks, follow_graph, like_buffer, media, replicas
+from .authentication import tokens_for
+from .management.commands import bench_endpoints
+from .pagination import encode_cursor
+from .querysets import post_queryset
+from .serializers import PostSerializer
+from .models import Follow, Like, Post, PostMedia, StoredFile, TimelineEntry, User
 
-# Create your tests here.
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'plan checks are written for SQLite and PostgreSQL')
+class QueryPlanTests(TestCase):
+    """
+    Runs the feed, profile, thread, likes and follow endpoints on a seeded
+    database, EXPLAINs every query they send and fails if one reads a whole
+    table or sorts rows that an index (api/models.py) should return in order.
+    Sorting rows fetched by primary key is fine: there are at most a page of them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Timeline fan-out runs on commit
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.create_data()
+
+    @classmethod
+    def create_data(cls):
+        cls.users = [User.objects.create(username=f'user{i}', display_name=f'User {i}') for i in range(6)]
+        for follower in cls.users:
+            for following in cls.users:
+                if follower != following:
+                    Follow.objects.create(follower=follower, following=following)
+        author = cls.users[1]
+        for i in range(30):
+            post = Post.objects.create(user=cls.users[i % 6], content=f'post {i}')
+            for j in range(i % 4):
+                reply = Post.objects.create(user=cls.users[j], content=f'reply {j}', parent_post=post)
+                Post.objects.create(user=author, content='nested reply', parent_post=reply)
+            for user in cls.users[:i % 5]:
+                Like.objects.create(user=user, post=post)
+        # Enough replies to one post to cut the tree off and get a cursor
+        cls.thread = Post.objects.create(user=author, content='busy thread')
+        for i in range(15):
+            Post.objects.create(user=cls.users[i % 6], content=f'reply {i}', parent_post=cls.thread)
+        Post.objects.create(user=cls.users[0], content=cls.thread.content, repost_of=cls.thread)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    @contextmanager
+    def capture(self):
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            yield queries
+
+    def assertIndexed(self, *urls, pages=2):
+        """Fetch `urls` (and the pages after them) and check the plan of every query."""
+        for url in urls:
+            for _ in range(pages):
+                with self.capture() as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+                for sql, params in queries:
+                    plan, problems = explain(sql, params)
+                    if problems:
+                        self.fail(f'{url}: {", ".join(problems)}\n{sql}\n{plan}')
+                url = response.data.get('next') if isinstance(response.data, dict) else None
+                if not url:
+                    break
+
+    def test_home_feed(self):
+        self.assertIndexed('/api/posts/following/')
+
+    @override_settings(TIMELINE_FANOUT_FOLLOWER_LIMIT=0)
+    def test_home_feed_merged_authors(self):
+        # Every author counts as high fan-out: their posts are merged at read time
+        self.assertIndexed('/api/posts/following/')
+
+    def test_latest_posts(self):
+        self.assertIndexed('/api/posts/')
+
+    def test_profile(self):
+        self.assertIndexed('/api/users/user1/', '/api/users/user1/posts/', '/api/users/user1/replies/')
+
+    def test_thread(self):
+        self.assertIndexed(f'/api/posts/{self.thread.pk}/', f'/api/posts/{self.thread.pk}/replies/')
+        cursor = self.client.get(f'/api/posts/{self.thread.pk}/thread/').data['replies_cursor']
+        self.assertIsNotNone(cursor)
+        self.assertIndexed(f'/api/posts/{self.thread.pk}/thread/?cursor={cursor}')
+
+    def test_liked_posts(self):
+        self.assertIndexed('/api/likes/liked-posts/')
+
+    def test_follow_lists(self):
+        self.assertIndexed('/api/users/user1/followers/?limit=2', '/api/users/user1/following/?limit=2')
+
+
+
+@override_settings(THREAD_MAX_DEPTH=2, THREAD_FAN_OUT=2)
+class ThreadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='author', display_name='Author')
+        self.root = Post.objects.create(user=self.user, content='root')
+        self.replies = [Post.objects.create(user=self.user, content=f'reply {i}', parent_post=self.root) for i in range(5)]
+        self.nested = Post.objects.create(user=self.user, content='nested', parent_post=self.replies[0])
+        self.deep = Post.objects.create(user=self.user, content='deep', parent_post=self.nested)
+        self.client = APIClient()
+
+    def thread(self, post, cursor=None):
+        url = f'/api/posts/{post.pk}/thread/'
+        return self.client.get(url, {'cursor': cursor} if cursor else {})
+
+    def test_tree_is_cut_at_depth_and_fan_out(self):
+        data = self.thread(self.root).data
+        self.assertEqual([reply['content'] for reply in data['replies']], ['reply 0', 'reply 1'])
+        self.assertIsNotNone(data['replies_cursor'])
+        nested = data['replies'][0]['replies']
+        self.assertEqual([reply['content'] for reply in nested], ['nested'])
+        # Depth 2 reached: the deep reply is behind a cursor
+        self.assertEqual(nested[0]['replies'], [])
+        self.assertIsNotNone(nested[0]['replies_cursor'])
+
+    def test_cursor_continues_the_branch(self):
+        contents, cursor = [], self.thread(self.root).data['replies_cursor']
+        while cursor:
+            data = self.thread(self.root, cursor).data
+            contents += [reply['content'] for reply in data['replies']]
+            cursor = data['cursor']
+        self.assertEqual(contents, ['reply 2', 'reply 3', 'reply 4'])
+
+        nested_cursor = self.thread(self.root).data['replies'][0]['replies'][0]['replies_cursor']
+        data = self.thread(self.root, nested_cursor).data
+        self.assertEqual([reply['content'] for reply in data['replies']], ['deep'])
+
+    def test_cursor_of_another_thread_is_rejected(self):
+        other = Post.objects.create(user=self.user, content='other')
+        Post.objects.create(user=self.user, content='other reply', parent_post=other)
+        cursor = self.thread(self.root).data['replies_cursor']
+        self.assertEqual(self.thread(other, cursor).status_code, 404)
+        # Nor can a reply's URL page through its parent's replies
+        self.assertEqual(self.thread(self.replies[0], cursor).status_code, 404)
+        self.assertEqual(self.client.get('/api/posts/x/thread/', {'cursor': cursor}).status_code, 404)
+
+
+    def test_forged_cursors_are_not_found(self):
+        created_at = self.replies[1].created_at.isoformat()
+        for position in (
+            {'post': 10 ** 30},
+            {'post': 'x'},
+            {'post': None},
+            {'post': self.root.pk, 'created_at': created_at, 'id': 10 ** 30},
+            {'post': self.root.pk, 'created_at': 'yesterday', 'id': self.replies[1].pk},
+            {'post': self.root.pk, 'id': self.replies[1].pk},
+        ):
+            response = self.thread(self.root, encode_cursor(position))
+            self.assertEqual(response.status_code, 404, position)
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(username=f'user{i}', display_name=f'User {i}') for i in range(4)]
+        for follower in self.users[1:]:
+            Follow.objects.create(follower=follower, following=self.users[0])
+        self.posts = [Post.objects.create(user=self.users[i % 4], content=f'post {i}') for i in range(25)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def walk(self, url, **params):
+        ids, response = [], self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_pages_cover_every_row_once(self):
+        self.assertEqual(self.walk('/api/posts/', limit=7), [post.pk for post in reversed(self.posts)])
+        self.assertEqual(
+            self.walk('/api/users/user0/followers/', limit=2),
+            [user.pk for user in reversed(self.users[1:])],
+        )
+
+    def test_tampered_cursors_are_not_found(self):
+        cursors = [
+            'not base64!',
+            encode_cursor(['not', 'an', 'object']),
+            encode_cursor({'after': ['2024-01-01T00:00:00+00:00']}),
+            encode_cursor({'after': ['2024-01-01T00:00:00+00:00', 'abc']}),
+            encode_cursor({'after': ['yesterday', 1]}),
+            encode_cursor({'after': [{}, 1]}),
+            encode_cursor({'after': [None, 1]}),
+            encode_cursor({'after': ['2024-01-01T00:00:00+00:00', 10 ** 30]}),
+        ]
+        for url in ('/api/posts/', '/api/posts/following/', '/api/users/user0/followers/', '/api/likes/liked-posts/'):
+            for cursor in cursors:
+                response = self.client.get(url, {'cursor': cursor})
+                self.assertEqual(response.status_code, 404, (url, cursor))
+                self.assertEqual(response.data['detail'], 'Invalid cursor.')
+
+
+@override_settings(TIMELINE_MAX_LENGTH=3, TIMELINE_FANOUT_FOLLOWER_LIMIT=2)
+class HomeTimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create(username='reader', display_name='Reader')
+        self.author = User.objects.create(username='author', display_name='Author')
+        self.celebrity = User.objects.create(username='celebrity', display_name='Celebrity')
+        Follow.objects.create(follower=self.reader, following=self.author)
+        Follow.objects.create(follower=self.reader, following=self.celebrity)
+        # Over TIMELINE_FANOUT_FOLLOWER_LIMIT: merged at read time
+        User.objects.filter(pk=self.celebrity.pk).update(follower_count=3)
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def post(self, user, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Post.objects.create(user=user, content=content)
+
+    def feed(self):
+        return [post['content'] for post in self.client.get('/api/posts/following/', {'limit': 10}).data['results']]
+
+    def test_fan_out_is_trimmed_and_merged(self):
+        for i in range(5):
+            self.post(self.author, f'author {i}')
+        self.post(self.celebrity, 'celebrity')
+        # Only the newest TIMELINE_MAX_LENGTH pushed entries are kept
+        self.assertEqual(TimelineEntry.objects.filter(user=self.reader).count(), 3)
+        self.assertEqual(self.feed(), ['celebrity', 'author 4', 'author 3', 'author 2'])
+
+    def test_fan_out_waits_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Post.objects.create(user=self.author, content='pending')
+            self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+
+    def test_unfollow_removes_the_author(self):
+        self.post(self.author, 'author')
+        Follow.objects.get(follower=self.reader, following=self.author).delete()
+        self.assertEqual(self.feed(), [])
+
+class CounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', display_name='User')
+        self.fan = User.objects.create(username='fan', display_name='Fan')
+        self.post = Post.objects.create(user=self.user, content='post')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_signals_keep_counts(self):
+        Follow.objects.create(follower=self.fan, following=self.user)
+        like = Like.objects.create(user=self.fan, post=self.post)
+        Post.objects.create(user=self.fan, content='reply', parent_post=self.post)
+        Post.objects.create(user=self.fan, repost_of=self.post)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.replies_count, self.post.reposts_count), (1, 1, 1))
+        like.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertEqual(User.objects.get(pk=self.user.pk).follower_count, 1)
+        self.assertEqual(User.objects.get(pk=self.fan.pk).following_count, 1)
+
+    def test_counts_survive_a_stale_save(self):
+        stale_user, stale_post = User.objects.get(pk=self.user.pk), Post.objects.get(pk=self.post.pk)
+        Follow.objects.create(follower=self.fan, following=self.user)
+        Like.objects.create(user=self.fan, post=self.post)
+        stale_user.bio = 'edited'
+        stale_user.save()
+        stale_post.content = 'edited'
+        stale_post.save()
+        self.user.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual((self.user.bio, self.user.follower_count), ('edited', 1))
+        self.assertEqual((self.post.content, self.post.likes_count), ('edited', 1))
+
+    def test_profile_edit_keeps_counts(self):
+        Follow.objects.create(follower=self.fan, following=self.user)
+        response = self.client.patch(f'/api/users/{self.user.username}/', {'bio': 'hello'})
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.bio, self.user.follower_count), ('hello', 1))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', display_name='User')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, text):
+        response = self.client.get('/api/posts/search/', {'q': text})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_best_match_first_with_prefixes(self):
+        Post.objects.create(user=self.user, content='a note about pancakes')
+        best = Post.objects.create(user=self.user, content='pancakes pancakes pancakes')
+        Post.objects.create(user=self.user, content='waffles')
+        results = self.search('pancak')
+        self.assertEqual([row['id'] for row in results][:1], [best.pk])
+        self.assertEqual(len(results), 2)
+
+    def test_snippets_are_escaped(self):
+        Post.objects.create(user=self.user, content='<script>alert(1)</script> pancakes & <b>syrup</b>')
+        [result] = self.search('pancakes')
+        self.assertNotIn('<script>', result['snippet'])
+        self.assertNotIn('<b>', result['snippet'])
+        self.assertIn('&lt;script&gt;', result['snippet'])
+        self.assertIn('<mark>pancakes</mark>', result['snippet'])
+
+    def test_renamed_author_is_found_by_new_name(self):
+        post = Post.objects.create(user=self.user, content='hello')
+        user = User.objects.get(pk=self.user.pk)
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual([row['id'] for row in self.search('renamed')], [post.pk])
+        self.assertEqual(self.search('user'), [])
+
+    def test_reposts_are_not_indexed(self):
+        reposter = User.objects.create(username='reposter', display_name='Reposter')
+        post = Post.objects.create(user=self.user, content='pancakes')
+        Post.objects.create(user=reposter, repost_of=post)
+        self.assertEqual([row['id'] for row in self.search('pancakes')], [post.pk])
+        self.assertEqual(self.search('reposter'), [])
+
+    def test_index_rows_of_deleted_posts_are_skipped(self):
+        kept = Post.objects.create(user=self.user, content='pancakes')
+        gone = Post.objects.create(user=self.user, content='pancakes too')
+        # Removed without the post_delete signal that unindexes it
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_post WHERE id = %s', [gone.pk])
+        self.assertEqual([row['id'] for row in self.search('pancakes')], [kept.pk])
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Overriding STORAGES drops the default backend's OPTIONS on Django 4.2, hence MEDIA_ROOT
+        settings = override_settings(
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            MEDIA_ROOT=directory.name,
+            IMAGE_RENDITION_FORMATS=('webp',),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create(username='user', display_name='User')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def image(self, color, size=(64, 64)):
+        buffer = BytesIO()
+        Image.new('RGB', size, color).save(buffer, 'PNG')
+        return SimpleUploadedFile('image.png', buffer.getvalue(), content_type='image/png')
+
+    def post_image(self, color, size=(64, 64), upload=None):
+        upload = upload or self.image(color, size)
+        response = self.client.post('/api/posts/', {'content': 'image', 'media': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return PostMedia.objects.get(post_id=response.data['id'])
+
+    def delete(self, post_id):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f'/api/posts/{post_id}/').status_code, 204)
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.post_image('red')
+        raw = first.media_file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            media.process(first.pk)
+        first.refresh_from_db()
+        self.assertEqual(first.status, PostMedia.READY)
+        self.assertFalse(default_storage.exists(raw))
+
+        # Same bytes again: linked to the processed file without a worker
+        second = self.post_image('red')
+        self.assertEqual((second.status, second.media_file.name), (PostMedia.READY, first.media_file.name))
+        stored = StoredFile.objects.get(name=first.media_file.name)
+        self.assertEqual(stored.ref_count, 2)
+        files = [stored.name, *media.rendition_names(stored.renditions)]
+
+        self.delete(first.post_id)
+        self.assertEqual(StoredFile.objects.get(pk=stored.pk).ref_count, 1)
+        self.assertTrue(all(default_storage.exists(name) for name in files))
+        self.delete(second.post_id)
+        self.assertFalse(StoredFile.objects.filter(pk=stored.pk).exists())
+        self.assertFalse(any(default_storage.exists(name) for name in files))
+
+    def processed(self, row):
+        with self.captureOnCommitCallbacks(execute=True):
+            media.process(row.pk)
+        row.refresh_from_db()
+        return row
+
+    @override_settings(POST_MEDIA_SIZES=(16, 32, 128), IMAGE_RENDITION_FORMATS=('avif', 'webp'))
+    def test_renditions_at_every_size(self):
+        row = self.processed(self.post_image('red', size=(64, 48)))
+        # 128 would upscale: the largest copies keep the image's own width
+        self.assertEqual(
+            {name: sorted(map(int, sizes)) for name, sizes in row.renditions.items()},
+            {'avif': [16, 32, 64], 'webp': [16, 32, 64]},
+        )
+        for name, sizes in row.renditions.items():
+            for width, path in sizes.items():
+                with Image.open(default_storage.open(path)) as image:
+                    self.assertEqual((image.format, image.width), (name.upper(), int(width)))
+        with Image.open(row.media_file) as image:
+            self.assertEqual((image.format, image.size), ('PNG', (64, 48)))
+
+        srcset = self.client.get(f'/api/posts/{row.post_id}/').data['media'][0]['srcset']
+        self.assertEqual(list(srcset), ['image/avif', 'image/webp'])
+        entries = [entry.split(' ') for entry in srcset['image/webp'].split(', ')]
+        self.assertEqual([descriptor for _, descriptor in entries], ['16w', '32w', '64w'])
+        for url, descriptor in entries:
+            self.assertTrue(url.endswith(row.renditions['webp'][descriptor[:-1]]), url)
+
+    @override_settings(POST_MEDIA_SIZES=(16, 32))
+    def test_gifs_are_kept_as_they_are(self):
+        buffer = BytesIO()
+        frames = [Image.new('P', (40, 40), color) for color in (1, 2)]
+        frames[0].save(buffer, 'GIF', save_all=True, append_images=frames[1:])
+        upload = SimpleUploadedFile('anim.gif', buffer.getvalue(), content_type='image/gif')
+        row = self.processed(self.post_image(None, upload=upload))
+        self.assertEqual((row.status, row.media_type, row.renditions), (PostMedia.READY, 'gif', {}))
+        with row.media_file.open('rb') as stored:
+            self.assertEqual(stored.read(), buffer.getvalue())
+        self.assertEqual(self.client.get(f'/api/posts/{row.post_id}/').data['media'][0]['srcset'], {})
+
+    def test_replaced_avatar_is_released(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/users/user/', {'avatar': self.image('red')}, format='multipart')
+        first = User.objects.get(pk=self.user.pk).avatar.name
+        self.assertTrue(default_storage.exists(first))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/users/user/', {'avatar': self.image('blue')}, format='multipart')
+        second = User.objects.get(pk=self.user.pk).avatar.name
+        self.assertNotEqual(first, second)
+        self.assertFalse(default_storage.exists(first))
+        self.assertFalse(StoredFile.objects.filter(name=first).exists())
+        self.assertEqual(StoredFile.objects.get(name=second).ref_count, 1)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', display_name='Author')
+        self.post = Post.objects.create(user=self.author, content='post')
+        self.client = APIClient()
+
+    def get(self):
+        response = self.client.get(f'/api/posts/{self.post.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hits_until_a_dependency_changes(self):
+        self.assertEqual(self.get()['X-Cache'], 'MISS')
+        self.assertEqual(self.get()['X-Cache'], 'HIT')
+        Like.objects.create(user=self.author, post=self.post)
+        response = self.get()
+        self.assertEqual((response['X-Cache'], response.data['likes']), ('MISS', 1))
+        self.author.display_name = 'Renamed'
+        self.author.save()
+        response = self.get()
+        self.assertEqual((response['X-Cache'], response.data['user']['display_name']), ('MISS', 'Renamed'))
+
+    def test_authenticated_reads_bypass_it(self):
+        self.client.force_authenticate(self.author)
+        self.get()
+        self.assertNotIn('X-Cache', self.get())
+
+    @override_settings(WEB_CONCURRENCY=4)
+    def test_several_workers_need_a_shared_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            checks.require_shared_cache()
+        with override_settings(WEB_CONCURRENCY=1):
+            checks.require_shared_cache()
+
+    def test_buffered_likes_need_a_shared_cache(self):
+        # Even with one worker: its buffered likes would die with it
+        with override_settings(LIKE_WRITE_BEHIND=True), self.assertRaises(ImproperlyConfigured):
+            checks.require_shared_cache()
+        with override_settings(
+            LIKE_WRITE_BEHIND=True, CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        ), self.assertRaises(ImproperlyConfigured):
+            checks.require_shared_cache()
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', display_name='Author')
+        self.reader = User.objects.create(username='reader', display_name='Reader')
+        self.post = Post.objects.create(user=self.author, content='post')
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+        self.url = f'/api/posts/{self.post.pk}/'
+
+    def etag(self):
+        # The first render records the URL's dependencies, the second gets validators
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertIn('ETag', response)
+        return response['ETag']
+
+    def test_unchanged_is_not_modified(self):
+        etag = self.etag()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_change_gives_a_new_etag(self):
+        etag = self.etag()
+        Like.objects.create(user=self.author, post=self.post)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['likes'], 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etags_are_per_viewer(self):
+        etag = self.etag()
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', display_name='User')
+        self.others = [User.objects.create(username=f'other{i}', display_name=f'Other {i}') for i in range(3)]
+        self.posts = [Post.objects.create(user=other, content=f'post {i}') for i, other in enumerate(self.others)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def likes(self):
+        return [post.likes_count for post in Post.objects.filter(pk__in=[post.pk for post in self.posts]).order_by('pk')]
+
+    def test_bulk_like_and_unlike(self):
+        first, second, third = self.posts
+        Like.objects.create(user=self.user, post=first)
+        response = self.client.post('/api/likes/bulk/', {'post_ids': [first.pk, second.pk, 10 ** 6]}, format='json')
+        self.assertEqual(response.data, {'liked': [second.pk]})
+        self.assertEqual(self.likes(), [1, 1, 0])
+        response = self.client.delete('/api/likes/bulk/', {'post_ids': [first.pk, second.pk, third.pk]}, format='json')
+        self.assertEqual(response.data, {'unliked': [first.pk, second.pk]})
+        self.assertEqual(self.likes(), [0, 0, 0])
+        self.assertFalse(Like.objects.exists())
+
+    def test_bulk_follow_and_unfollow(self):
+        usernames = ['other0', 'other1', 'user', 'nobody']
+        response = self.client.post('/api/follows/bulk/', {'usernames': usernames}, format='json')
+        self.assertEqual(sorted(response.data['followed']), ['other0', 'other1'])
+        self.assertEqual(User.objects.get(pk=self.user.pk).following_count, 2)
+        self.assertEqual(User.objects.get(pk=self.others[0].pk).follower_count, 1)
+        response = self.client.get('/api/follows/state/', {'usernames': 'other0,other2,nobody'})
+        self.assertEqual(response.data, {'other0': True, 'other2': False})
+
+        response = self.client.delete('/api/follows/bulk/', {'usernames': usernames}, format='json')
+        self.assertEqual(response.data, {'unfollowed': ['other0', 'other1']})
+        self.assertEqual(User.objects.get(pk=self.user.pk).following_count, 0)
+        self.assertFalse(Follow.objects.exists())
+
+    def test_counts_follow_the_rows_written(self):
+        first, second, _ = self.posts
+        # Written by a concurrent request between our read and our write: bulk_create sends no signals
+        Like.objects.bulk_create([Like(user=self.user, post=first)])
+        response = self.client.post('/api/likes/bulk/', {'post_ids': [first.pk, second.pk]}, format='json')
+        self.assertEqual(response.data, {'liked': [second.pk]})
+        self.assertEqual(self.likes(), [0, 1, 0])
+        Like.objects.filter(user=self.user, post=second).delete()
+        response = self.client.delete('/api/likes/bulk/', {'post_ids': [first.pk, second.pk]}, format='json')
+        self.assertEqual(response.data, {'unliked': [first.pk]})
+        self.assertEqual(self.likes(), [0, 0, 0])
+
+        Follow.objects.bulk_create([Follow(follower=self.user, following=self.others[0])])
+        response = self.client.post('/api/follows/bulk/', {'usernames': ['other0', 'other1']}, format='json')
+        self.assertEqual(response.data, {'followed': ['other1']})
+        self.assertEqual(User.objects.get(pk=self.user.pk).following_count, 1)
+
+    def test_multi_get_keeps_the_requested_order(self):
+        ids = [self.posts[2].pk, 10 ** 6, self.posts[0].pk]
+        response = self.client.get('/api/posts/', {'ids': ','.join(map(str, ids))})
+        self.assertEqual([post['id'] for post in response.data['results']], [self.posts[2].pk, self.posts[0].pk])
+        response = self.client.get('/api/users/', {'usernames': 'other1,nobody,other0'})
+        self.assertEqual([user['username'] for user in response.data['results']], ['other1', 'other0'])
+
+    @override_settings(BATCH_MAX_SIZE=2)
+    def test_invalid_batches_are_rejected(self):
+        for data in ({'post_ids': [1, 2, 3]}, {'post_ids': ['a']}, {'post_ids': []}):
+            self.assertEqual(self.client.post('/api/likes/bulk/', data, format='json').status_code, 400, data)
+
+
+class FollowGraphTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(username=f'user{i}', display_name=f'User {i}') for i in range(4)]
+        user0, user1, user2, user3 = self.users
+        for follower, following in ((user0, user1), (user1, user0), (user0, user2), (user2, user3)):
+            Follow.objects.create(follower=follower, following=following)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.snapshot = os.path.join(directory.name, 'follow_graph.bin')
+        settings = override_settings(FOLLOW_GRAPH_SNAPSHOT=self.snapshot)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        follow_graph.load()
+        self.client = APIClient()
+        self.client.force_authenticate(user0)
+
+    def mutuals(self):
+        return [user['username'] for user in self.client.get('/api/users/user0/mutuals/').data['results']]
+
+    def test_changes_are_applied(self):
+        self.assertEqual(self.mutuals(), ['user1'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=self.users[2], following=self.users[0])
+        self.assertEqual(self.mutuals(), ['user1', 'user2'])
+        # Applied straight to this process's graph: a locmem cache isn't shared
+        self.assertEqual(follow_graph.follow_graph().sequence, 0)
+        suggestions = self.client.get('/api/users/suggestions/').data
+        self.assertEqual([user['username'] for user in suggestions], ['user3'])
+
+    def test_shared_log_is_replayed(self):
+        self.assertEqual(self.mutuals(), ['user1'])
+        # As another process would see it: the change reaches this graph through the log only
+        with mock.patch('api.follow_graph.per_process_cache', return_value=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                Follow.objects.create(follower=self.users[2], following=self.users[0])
+            self.assertEqual(self.mutuals(), ['user1', 'user2'])
+            self.assertEqual(follow_graph.follow_graph().sequence, 1)
+
+    def test_snapshot_matches_the_follow_table(self):
+        call_command('build_follow_graph', stdout=StringIO())
+        loaded = follow_graph.FollowGraph.load(self.snapshot)
+        built = follow_graph.FollowGraph.build()
+        self.assertEqual(
+            {pk: list(ids) for pk, ids in loaded.followers.items()},
+            {pk: list(ids) for pk, ids in built.followers.items()},
+        )
+        self.assertEqual(loaded.edge_count, 4)
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='user', password='old password', display_name='User')
+        self.client = APIClient()
+
+    def whoami(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.client.get('/api/whoami/').status_code
+
+    def test_password_change_revokes_tokens(self):
+        old = tokens_for(self.user).access_token
+        self.assertEqual(self.whoami(old), 200)
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new password')
+        user.save()
+        self.assertEqual(self.whoami(old), 401)
+        self.assertEqual(self.whoami(tokens_for(user).access_token), 200)
+
+    def test_rehash_keeps_tokens(self):
+        token = tokens_for(self.user).access_token
+        hashers = ['django.contrib.auth.hashers.MD5PasswordHasher', 'django.contrib.auth.hashers.PBKDF2PasswordHasher']
+        with self.settings(PASSWORD_HASHERS=hashers):
+            # A different preferred hasher: check_password() saves a rehash
+            self.assertTrue(User.objects.get(pk=self.user.pk).check_password('old password'))
+        self.assertTrue(User.objects.get(pk=self.user.pk).password.startswith('md5$'))
+        self.assertEqual(self.whoami(token), 200)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='user', display_name='User')
+        self.other = User.objects.create(username='other', display_name='Other')
+        self.posts = [Post.objects.create(user=self.user, content=f'post {i}') for i in range(3)]
+        Like.objects.create(user=self.user, post=Post.objects.create(user=self.other, content='liked'))
+        Follow.objects.create(follower=self.user, following=self.other)
+        Follow.objects.create(follower=self.other, following=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, encoding='', **params):
+        response = self.client.get('/api/export/', params, HTTP_ACCEPT_ENCODING=encoding)
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        if response.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return response, [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_every_section_in_order(self):
+        _, records = self.export()
+        self.assertEqual(
+            [record['type'] for record in records],
+            ['user', 'post', 'post', 'post', 'like', 'following', 'follower', 'end'],
+        )
+        self.assertEqual([record['content'] for record in records[1:4]], ['post 0', 'post 1', 'post 2'])
+        self.assertEqual(records[5]['username'], 'other')
+
+    def test_resumes_after_a_cursor(self):
+        _, records = self.export()
+        _, resumed = self.export(cursor=records[2]['cursor'])
+        self.assertEqual(resumed, records[3:])
+
+    def test_gzip_follows_accept_encoding(self):
+        for header, compressed in (
+            ('gzip, deflate', True),
+            ('br;q=1.0, gzip;q=0.5', True),
+            ('*', True),
+            ('gzip;q=0', False),
+            ('gzip;q=0.000, *', False),
+            ('deflate', False),
+            ('', False),
+        ):
+            response, records = self.export(header)
+            self.assertEqual(response.get('Content-Encoding') == 'gzip', compressed, header)
+            self.assertEqual(records[-1], {'type': 'end'})
+
+
+class MetricsTests(TestCase):
+    def status(self, **headers):
+        return self.client.get('/metrics', **headers).status_code
+
+    @override_settings(METRICS_TOKEN='', DEBUG=False)
+    def test_closed_without_a_token(self):
+        self.assertEqual(self.status(), 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.status(), 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required_when_set(self):
+        self.assertEqual(self.status(), 403)
+        self.assertEqual(self.status(HTTP_AUTHORIZATION='Bearer wrong'), 403)
+        self.assertEqual(self.status(HTTP_AUTHORIZATION='Bearer secret'), 200)
+
+
+class SerializationQueryTests(TestCase):
+    """
+    A page of posts costs the same number of queries however many posts and
+    authors it has: posts, media, parents and reposted originals are
+    prefetched, reply trees, the viewer's state and the authors are batched.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [User.objects.create(username=f'author{i}', display_name=f'Author {i}') for i in range(8)]
+        cls.viewer = cls.authors[0]
+        for i in range(24):
+            author = cls.authors[i % len(cls.authors)]
+            post = Post.objects.create(user=author, content=f'post {i}')
+            PostMedia.objects.create(post=post, media_file=f'posts/media/{i}.png', status=PostMedia.READY)
+            Post.objects.create(user=cls.authors[(i + 1) % len(cls.authors)], content=f'reply {i}', parent_post=post)
+            Post.objects.create(user=cls.authors[(i + 2) % len(cls.authors)], repost_of=post)
+            Like.objects.create(user=cls.viewer, post=post)
+
+    def setUp(self):
+        cache.clear()
+
+    def serialize(self, count, viewer=None):
+        request = Request(APIRequestFactory().get('/api/posts/'))
+        request.user = viewer or AnonymousUser()
+        posts = post_queryset(Post.objects.filter(parent_post=None).order_by('-id'))[:count]
+        return PostSerializer(posts, many=True, context={'request': request}).data
+
+    def assertConstantQueries(self, num, viewer=None):
+        for count in (4, 20):
+            with self.assertNumQueries(num):
+                data = self.serialize(count, viewer)
+            self.assertEqual(len(data), count)
+            self.assertEqual(len({post['user']['id'] for post in data}), min(count, len(self.authors)))
+
+    def test_anonymous_page(self):
+        # Posts, reposted originals and reply posts with their media and
+        # prefetched relations, the reply tree walk and the authors
+        self.assertConstantQueries(10)
+
+    def test_viewer_page(self):
+        # As above, plus the viewer's likes and reposts
+        self.assertConstantQueries(12, self.viewer)
+        data = self.serialize(20, self.viewer)
+        self.assertTrue(all(post['liked_by_user'] for post in data if post['repost_of_detail'] is None))
+
+
+def reload_urls():
+    # api/urls.py picks the async or sync views when it is imported
+    from . import urls
+    import monch_backend.urls
+    importlib.reload(urls)
+    importlib.reload(monch_backend.urls)
+    clear_url_caches()
+
+@override_settings(ASYNC_READ_VIEWS=True)
+class AsyncReadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Class cleanups run last first: reload the sync views once the settings are restored
+        cls.addClassCleanup(reload_urls)
+        super().setUpClass()
+        reload_urls()
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create(username='reader', display_name='Reader')
+        self.author = User.objects.create(username='author', display_name='Author')
+        Follow.objects.create(follower=self.reader, following=self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post = Post.objects.create(user=self.author, content='hello')
+        self.client = AsyncClient()
+        self.token = tokens_for(self.reader).access_token
+
+    def get(self, url, token=None, **headers):
+        # Per request: Django 4.2's AsyncClient drops headers given to its constructor
+        return self.client.get(url, headers={'authorization': f'Bearer {token or self.token}', **headers})
+
+    def test_routed_to_async_views(self):
+        for url in ('/api/posts/following/', f'/api/posts/{self.post.pk}/', '/api/users/author/', '/api/whoami/'):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+
+    async def test_home_feed(self):
+        response = await self.get('/api/posts/following/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post['content'] for post in response.json()['results']], ['hello'])
+
+    async def test_post_detail(self):
+        response = await self.get(f'/api/posts/{self.post.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['content'], response.json()['user']['username']), ('hello', 'author'))
+        response = await self.get(f'/api/posts/{self.post.pk + 100}/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'No Post matches the given query.'})
+
+    async def test_profile(self):
+        response = await self.get('/api/users/author/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['username'], 'author')
+        response = await self.get('/api/users/nobody/')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'No User matches the given query.'})
+
+    async def test_whoami(self):
+        response = await self.get('/api/whoami/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['username'], 'reader')
+        # Validators come with the second render (api/conditional.py)
+        etag = (await self.get('/api/whoami/')).headers['ETag']
+        response = await self.get('/api/whoami/', **{'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_unauthenticated_reads_go_to_the_sync_views(self):
+        self.assertEqual((await self.client.get('/api/whoami/')).status_code, 401)
+        self.assertEqual((await self.get(f'/api/posts/{self.post.pk}/', token='not-a-token')).status_code, 401)
+        response = await self.client.get(f'/api/posts/{self.post.pk}/')
+        self.assertEqual((response.status_code, response.json()['content']), (200, 'hello'))
+
+
+@override_settings(FOLLOW_GRAPH_SNAPSHOT='')
+class GeneratedDataTests(TransactionTestCase):
+    """
+    The synthetic dataset of generate_data, and the endpoint benchmark run on
+    it. A transaction test case: the benchmark's writes commit and run their
+    on_commit work as they do in a real run.
+    """
+
+    def setUp(self):
+        cache.clear()
+        call_command('generate_data', users=50, posts_per_user=2, seed=1, stdout=StringIO())
+
+    def test_dataset_is_deterministic(self):
+        counts = [model.objects.count() for model in (User, Follow, Post, Like, TimelineEntry)]
+        self.assertEqual(counts, [50, 862, 100, 209, 1264])
+        self.assertEqual(Post.objects.filter(parent_post__isnull=False).count(), 40)
+        self.assertEqual(Post.objects.filter(repost_of__isnull=False).count(), 2)
+        out = StringIO()
+        call_command('reconcile_counters', dry_run=True, stdout=out)
+        self.assertIn('Post: 0 rows drifted', out.getvalue())
+        self.assertIn('User: 0 rows drifted', out.getvalue())
+
+    def test_benchmark_is_within_budget(self):
+        out, err = StringIO(), StringIO()
+        # Benchmarked on the dataset above, in this test database rather than a new one
+        with mock.patch.object(bench_endpoints.Command, 'test_database', nullcontext):
+            call_command('bench_endpoints', keepdb=True, requests=3, warmup=1, latency_scale=5, stdout=out, stderr=err)
+        self.assertEqual(err.getvalue(), '')
+        self.assertIn('Every scenario within budget', out.getvalue())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'the replica is a file copy of the SQLite test database')
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Routes reads to a "replica" that is a snapshot of the test database
+    taken in setUp, so it never sees later writes: a read that returns stale
+    data came from the replica, a fresh one from the primary.
+    """
+
+    def setUp(self):
+        cache.clear()
+        replicas._health.clear()
+        self.author = User.objects.create(username='author', display_name='Author')
+        self.reader = User.objects.create(username='reader', display_name='Reader')
+        self.post = Post.objects.create(user=self.author, content='original')
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'replica.sqlite3')
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM INTO %s', [path])
+        connections.settings['replica'] = {**connections['default'].settings_dict, 'NAME': path}
+        self.addCleanup(self.remove_replica)
+        settings = override_settings(REPLICA_DATABASES=['replica'])
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def remove_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def client_for(self, user):
+        client = APIClient()
+        if user is not None:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(user).access_token}')
+        return client
+
+    def edit_on_primary(self):
+        Post.objects.filter(pk=self.post.pk).update(content='edited')
+
+    def content(self, user):
+        response = self.client_for(user).get(f'/api/posts/{self.post.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['content']
+
+    def test_reads_go_to_the_replica(self):
+        self.edit_on_primary()
+        self.assertEqual(self.content(None), 'original')
+        self.assertEqual(self.content(self.reader), 'original')
+
+    def test_writer_reads_from_the_primary(self):
+        response = self.client_for(self.author).post('/api/posts/', {'content': 'new post'})
+        self.assertEqual(response.status_code, 201)
+        self.edit_on_primary()
+        self.assertEqual(self.content(self.author), 'edited')
+        # Everyone else keeps reading the replica
+        self.assertEqual(self.content(self.reader), 'original')
+
+        cache.clear()  # the pin expired
+        self.assertEqual(self.content(self.author), 'original')
+
+    def test_writes_go_to_the_primary(self):
+        response = self.client_for(self.reader).post(f'/api/posts/{self.post.pk}/like/')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Like.objects.filter(user=self.reader, post=self.post).exists())
+
+    def test_unreachable_replica_falls_back_to_the_primary(self):
+        connections['replica'].settings_dict['NAME'] = os.path.join(tempfile.gettempdir(), 'missing', 'replica.sqlite3')
+        self.edit_on_primary()
+        with self.assertLogs('api.replicas', 'WARNING'):
+            self.assertEqual(self.content(self.reader), 'edited')
+        self.assertEqual(replicas.healthy_replicas(), [])
+
+
+
+@override_settings(LIKE_WRITE_BEHIND=True, LIKE_FLUSH_THREAD=False)
+class LikeBufferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', display_name='Author')
+        self.liker = User.objects.create(username='liker', display_name='Liker')
+        self.post = Post.objects.create(user=self.author, content='hot post')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(self.liker).access_token}')
+
+    def seen_by(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(user).access_token}')
+        data = client.get(f'/api/posts/{self.post.pk}/').data
+        return data['likes'], data['liked_by_user']
+
+    def test_liker_sees_their_like_before_it_is_written(self):
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.pk}/like/').status_code, 201)
+        self.assertEqual(self.client.post(f'/api/posts/{self.post.pk}/like/').status_code, 400)
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(self.seen_by(self.liker), (1, True))
+        self.assertEqual(self.seen_by(self.author), (0, False))
+
+        like_buffer.flush_all()
+        self.assertTrue(Like.objects.filter(user=self.liker, post=self.post).exists())
+        self.assertEqual(self.seen_by(self.liker), (1, True))
+        self.assertEqual(self.seen_by(self.author), (1, False))
+
+    def test_intents_are_coalesced(self):
+        Like.objects.create(user=self.author, post=self.post)
+        for _ in range(3):
+            self.client.post(f'/api/posts/{self.post.pk}/like/')
+            self.client.delete(f'/api/posts/{self.post.pk}/like/')
+        self.client.post(f'/api/posts/{self.post.pk}/like/')
+        self.client.delete(f'/api/posts/{self.post.pk}/like/')
+        self.assertEqual(self.seen_by(self.liker), (1, False))
+
+        with self.assertNumQueries(5):
+            like_buffer.flush_all()
+        self.assertEqual(list(Like.objects.values_list('user__username', flat=True)), ['author'])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+        response = self.client.delete(f'/api/posts/{self.post.pk}/like/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_likes_and_unlikes(self):
+        other = Post.objects.create(user=self.author, content='other post')
+        Like.objects.create(user=self.liker, post=other)
+        missing = other.pk + 100
+        response = self.client.post('/api/likes/bulk/', {'post_ids': [self.post.pk, other.pk, missing]}, format='json')
+        self.assertEqual(response.data, {'liked': [self.post.pk]})
+        response = self.client.delete('/api/likes/bulk/', {'post_ids': [other.pk]}, format='json')
+        self.assertEqual(response.data, {'unliked': [other.pk]})
+
+        like_buffer.flush_all()
+        self.assertEqual(list(Like.objects.values_list('post_id', flat=True)), [self.post.pk])
+        self.assertEqual(
+            dict(Post.objects.values_list('id', 'likes_count')),
+            {self.post.pk: 1, other.pk: 0},
+        )
+
+    def test_written_intents_leave_the_pending_set(self):
+        self.client.post(f'/api/posts/{self.post.pk}/like/')
+        self.client.delete(f'/api/posts/{self.post.pk}/like/')
+        with self.settings(LIKE_FLUSH_BATCH_SIZE=1):
+            like_buffer.flush()
+        # The unlike isn't written yet: its entry stays
+        self.assertEqual(like_buffer.pending(self.liker.pk, [self.post.pk]), {self.post.pk: False})
+        self.assertEqual(self.seen_by(self.liker), (0, False))
+        like_buffer.flush_all()
+        self.assertEqual(like_buffer.pending(self.liker.pk, [self.post.pk]), {})
+        self.assertEqual(self.seen_by(self.liker), (0, False))
+
+    def test_likes_of_deleted_posts_are_dropped(self):
+        self.client.post(f'/api/posts/{self.post.pk}/like/')
+        Post.objects.filter(pk=self.post.pk).delete()
+        like_buffer.flush_all()
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(like_buffer.flush(), 0)
+
+
+class RepostTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', display_name='Author')
+        self.reposter = User.objects.create(username='reposter', display_name='Reposter')
+        self.post = Post.objects.create(user=self.author, content='original')
+        self.media = PostMedia.objects.create(post=self.post, media_file='posts/media/original.png', status=PostMedia.READY)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens_for(self.reposter).access_token}')
+
+    def test_repost_is_a_pointer_row(self):
+        response = self.client.post(f'/api/posts/{self.post.pk}/toggle_repost/')
+        self.assertEqual(response.status_code, 201)
+        repost = Post.objects.get(pk=response.data['id'])
+        self.assertIsNone(repost.content)
+        self.assertEqual(PostMedia.objects.count(), 1)
+
+        Post.objects.filter(pk=self.post.pk).update(content='edited')
+        data = self.client.get(f'/api/posts/{repost.pk}/').data
+        self.assertEqual(data['content'], 'edited')
+        self.assertEqual([media['id'] for media in data['media']], [self.media.pk])
+
+    def test_repost_of_a_repost_points_at_the_original(self):
+        repost = Post.objects.create(user=self.author, repost_of=self.post)
+        response = self.client.post('/api/posts/', {'repost_of': repost.pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.objects.get(pk=response.data['id']).repost_of_id, self.post.pk)
+        self.assertEqual(response.data['content'], 'original')
+
+    def test_repost_rows_show_the_viewers_repost_of_the_original(self):
+        mine = Post.objects.create(user=self.reposter, repost_of=self.post)
+        theirs = Post.objects.create(user=self.author, repost_of=self.post)
+        for post_id in (self.post.pk, mine.pk, theirs.pk):
+            data = self.client.get(f'/api/posts/{post_id}/').data
+            self.assertEqual((data['reposted_by_user'], data['user_repost_id']), (True, mine.pk), post_id)
+        # Undoing it from a repost row removes the viewer's repost, not the author's
+        response = self.client.post(f'/api/posts/{theirs.pk}/toggle_repost/')
+        self.assertEqual(response.data, {'reposted': False})
+        self.assertEqual(list(Post.objects.filter(repost_of=self.post).values_list('id', flat=True)), [theirs.pk])
+        data = self.client.get(f'/api/posts/{theirs.pk}/').data
+        self.assertEqual((data['reposted_by_user'], data['user_repost_id']), (False, None))
+
+    def test_reposts_go_with_the_original(self):
+        Post.objects.create(user=self.reposter, repost_of=self.post)
+        self.post.delete()
+        self.assertFalse(Post.objects.exists())
+
+def explain(sql, params):
+    """(plan text, problems) for a query on the test database."""
+    if connection.vendor == 'sqlite':
+        return _explain_sqlite(sql, params)
+    return _explain_postgresql(sql, params)
+
+def _explain_sqlite(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        steps = [row[3] for row in cursor.fetchall()]
+    # Scanning a CTE (or an alias of one) reads rows the query built itself
+    ctes = set(re.findall(r'WITH RECURSIVE (\w+)', sql))
+    ctes |= {alias for name in ctes for alias in re.findall(rf'(?:FROM|JOIN) {name} (\w+)', sql)}
+    problems = [
+        step for step in steps
+        if re.match(r'SCAN \w+$', step) and step.split()[1] not in ctes
+    ]
+    by_primary_key = all('PRIMARY KEY' in step for step in steps if step.startswith(('SEARCH', 'SCAN')))
+    if not by_primary_key:
+        problems += [step for step in steps if 'TEMP B-TREE FOR ORDER BY' in step]
+    return '\n'.join(steps), problems
+
+def _explain_postgresql(sql, params):
+    # With tables this small the planner would rather scan and sort; make both
+    # a last resort so the plan shows whether an index can serve the query
+    with connection.cursor() as cursor:
+        cursor.execute('SET enable_seqscan = off; SET enable_sort = off')
+        try:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute('RESET enable_seqscan; RESET enable_sort')
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    problems = []
+    for node in _nodes(plan[0]['Plan']):
+        if node['Node Type'] == 'Seq Scan':
+            problems.append(f"Seq Scan on {node['Relation Name']}")
+        elif node['Node Type'] == 'Sort':
+            scans = [child for child in _nodes(node) if 'Relation Name' in child]
+            if not all(child.get('Index Name', '').endswith('_pkey') for child in scans):
+                problems.append(f"Sort on {', '.join(node['Sort Key'])}")
+    return json.dumps(plan, indent=2), problems
+
+def _nodes(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from _nodes(child)
@@ -0,0 +1,208 @@
+from collections import defaultdict
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, connections, router
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from rest_framework.exceptions import NotFound
+from .models import Post
+from .pagination import KeysetPagination, encode_cursor, decode_cursor
+from .querysets import post_queryset
+
+# Bounded reply trees. The ids of a whole conversation are fetched in one
+# recursive CTE (depth and per-parent fan-out limited inside the query), then
+# the posts themselves are loaded through post_queryset in a single batch and
+# assembled in memory. Each loaded post gets:
+#   thread_replies  - its loaded children, oldest first
+#   replies_cursor  - continuation cursor when children were cut off, else None
+
+CTE_VENDORS = ('postgresql', 'sqlite')
+
+def thread_options(request):
+    """Depth and fan-out from ?depth= / ?fan_out=, clamped to the settings."""
+    max_depth = settings.THREAD_MAX_DEPTH
+    max_fan_out = settings.THREAD_FAN_OUT
+    if request is None:
+        return max_depth, max_fan_out
+    return (
+        _clamp(request.query_params.get('depth'), max_depth),
+        _clamp(request.query_params.get('fan_out'), max_fan_out),
+    )
+
+def _clamp(value, maximum):
+    try:
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return maximum
+
+def _cursor_value(position, name, field=KeysetPagination.id_field):
+    # Checked like keyset cursors, ids included: SQLite doesn't bound integers
+    try:
+        return field.clean(position[name], None)
+    except (KeyError, ValidationError, TypeError, ValueError):
+        raise NotFound('Invalid cursor.')
+
+def _after_position(position):
+    return _cursor_value(position, 'created_at', KeysetPagination.cursor_fields['created_at']), _cursor_value(position, 'id')
+
+def _descendant_rows_cte(seed_sql, seed_params, max_depth, fan_out):
+    table = connection.ops.quote_name(Post._meta.db_table)
+    sql = f"""
+        WITH RECURSIVE thread (id, parent_post_id, depth) AS (
+            {seed_sql}
+            UNION ALL
+            SELECT p.id, p.parent_post_id, t.depth + 1
+            FROM thread t
+            JOIN {table} p ON p.parent_post_id = t.id
+            WHERE t.depth < %s AND p.id IN (
+                SELECT c.id FROM {table} c
+                WHERE c.parent_post_id = t.id
+                ORDER BY c.created_at, c.id
+                LIMIT %s
+            )
+        )
+        SELECT id, parent_post_id, depth FROM thread
+    """
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute(sql, [*seed_params, max_depth, fan_out])
+        return cursor.fetchall()
+
+def _children_rows(parent_ids, fan_out, after=None):
+    children = Post.objects.filter(parent_post_id__in=parent_ids)
+    if after is not None:
+        created_at, post_id = after
+        children = children.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=post_id))
+    return children.annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=F('parent_post_id'),
+            order_by=[F('created_at').asc(), F('id').asc()],
+        )
+    ).filter(position__lte=fan_out).values_list('id', 'parent_post_id')
+
+def _descendant_rows_by_level(rows, max_depth, fan_out):
+    # One query per level, for backends without recursive CTE support.
+    frontier = [row[0] for row in rows]
+    depth = rows[0][2] if rows else max_depth
+    while frontier and depth < max_depth:
+        depth += 1
+        level = [(post_id, parent_id, depth) for post_id, parent_id in _children_rows(frontier, fan_out)]
+        rows.extend(level)
+        frontier = [row[0] for row in level]
+    return rows
+
+def _root_rows(roots, max_depth, fan_out):
+    ids = [root.id for root in roots]
+    if connection.vendor in CTE_VENDORS:
+        table = connection.ops.quote_name(Post._meta.db_table)
+        placeholders = ', '.join(['%s'] * len(ids))
+        seed_sql = f"SELECT id, parent_post_id, 0 FROM {table} WHERE id IN ({placeholders})"
+        return _descendant_rows_cte(seed_sql, ids, max_depth, fan_out)
+    return _descendant_rows_by_level([(root.id, root.parent_post_id, 0) for root in roots], max_depth, fan_out)
+
+def _continuation_rows(parent, after, max_depth, fan_out):
+    if connection.vendor in CTE_VENDORS:
+        table = connection.ops.quote_name(Post._meta.db_table)
+        created_at, post_id = after
+        created_at = connection.ops.adapt_datetimefield_value(created_at)
+        seed_sql = f"""
+            SELECT id, parent_post_id, 1 FROM {table} WHERE id IN (
+                SELECT id FROM {table}
+                WHERE parent_post_id = %s AND (created_at > %s OR (created_at = %s AND id > %s))
+                ORDER BY created_at, id
+                LIMIT %s
+            )
+        """
+        return _descendant_rows_cte(seed_sql, [parent.id, created_at, created_at, post_id, fan_out], max_depth, fan_out)
+    rows = [(post_id, parent_id, 1) for post_id, parent_id in _children_rows([parent.id], fan_out, after)]
+    return _descendant_rows_by_level(rows, max_depth, fan_out)
+
+def _in_thread(post, root_id):
+    """Whether `post` is the post `root_id` or one of the replies under it, at any depth."""
+    if post.id == root_id:
+        return True
+    if connection.vendor in CTE_VENDORS:
+        table = connection.ops.quote_name(Post._meta.db_table)
+        sql = f"""
+            WITH RECURSIVE ancestors (id, parent_post_id) AS (
+                SELECT id, parent_post_id FROM {table} WHERE id = %s
+                UNION ALL
+                SELECT p.id, p.parent_post_id FROM ancestors a JOIN {table} p ON p.id = a.parent_post_id
+            )
+            SELECT 1 FROM ancestors WHERE id = %s
+        """
+        with connections[router.db_for_read(Post)].cursor() as cursor:
+            cursor.execute(sql, [post.parent_post_id, root_id])
+            return cursor.fetchone() is not None
+    parent_id = post.parent_post_id
+    while parent_id is not None and parent_id != root_id:
+        parent_id = Post.objects.filter(pk=parent_id).values_list('parent_post_id', flat=True).first()
+    return parent_id == root_id
+
+def _branch_cursor(post, last_child):
+    position = {'post': post.id}
+    if last_child is not None:
+        position.update(created_at=last_child.created_at.isoformat(), id=last_child.id)
+    return encode_cursor(position)
+
+def _assemble(parents, rows):
+    child_ids = [post_id for post_id, _, depth in rows if depth > 0]
+
+    children = defaultdict(list)
+    nodes = list(parents)
+    if child_ids:
+        for post in post_queryset(Post.objects.filter(id__in=child_ids)).order_by('created_at', 'id'):
+            children[post.parent_post_id].append(post)
+            nodes.append(post)
+
+    for node in nodes:
+        node.thread_replies = children.get(node.id, [])
+        node.replies_cursor = None
+        if node.replies_count > len(node.thread_replies):
+            last_child = node.thread_replies[-1] if node.thread_replies else None
+            node.replies_cursor = _branch_cursor(node, last_child)
+
+def load_threads(posts, max_depth=None, fan_out=None):
+    """
+    Attach bounded reply trees to every post in `posts` that does not
+    already have one. Costs one id query plus one batch of post queries.
+    """
+    max_depth = settings.THREAD_MAX_DEPTH if max_depth is None else max_depth
+    fan_out = settings.THREAD_FAN_OUT if fan_out is None else fan_out
+    roots = [post for post in posts if not hasattr(post, 'thread_replies')]
+    if not roots:
+        return posts
+    _assemble(roots, _root_rows(roots, max_depth, fan_out))
+    return posts
+
+def load_branch(root_id, cursor, max_depth=None, fan_out=None):
+    """
+    Resolve a replies_cursor found in the thread of post `root_id`: returns
+    (parent, next page of its replies with their own subtrees, cursor for the
+    page after or None). Cursors of other threads are invalid.
+    """
+    max_depth = settings.THREAD_MAX_DEPTH if max_depth is None else max_depth
+    fan_out = settings.THREAD_FAN_OUT if fan_out is None else fan_out
+    position = decode_cursor(cursor)
+    parent = Post.objects.filter(pk=_cursor_value(position, 'post')).first()
+    if parent is None:
+        raise NotFound('Invalid cursor.')
+    if not _in_thread(parent, root_id):
+        raise NotFound('Invalid cursor.')
+
+    if 'id' in position:
+        after = _after_position(position)
+        rows = _continuation_rows(parent, after, max_depth, fan_out)
+    else:
+        rows = _root_rows([parent], max_depth, fan_out)
+
+    # The parent only anchors the page; its own replies_count is not needed.
+    parent.replies_count = 0
+    _assemble([parent], rows)
+    page = parent.thread_replies
+    next_cursor = None
+    if page and Post.objects.filter(parent_post=parent).filter(
+        Q(created_at__gt=page[-1].created_at) | Q(created_at=page[-1].created_at, id__gt=page[-1].id)
+    ).exists():
+        next_cursor = _branch_cursor(parent, page[-1])
+    return parent, page, next_cursor
@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from .models import User, Post, Follow, TimelineEntry
+
+# Hybrid home timeline. Top-level posts are pushed into each follower's
+# TimelineEntry rows when they are created (fan-out on write), except for
+# authors with more than TIMELINE_FANOUT_FOLLOWER_LIMIT followers: their posts
+# are merged in when the feed is read. Timelines are capped at
+# TIMELINE_MAX_LENGTH entries per user: each batch of a fan-out, and each
+# follow backfill, trims the timelines it wrote to.
+#
+# Fan-out runs once the post's transaction commits (api/signals.py), in
+# batches of BATCH_SIZE followers.
+
+BATCH_SIZE = 1000
+
+def high_fanout_author_ids(follower):
+    """Authors `follower` follows whose posts are merged at read time."""
+    return list(
+        User.objects.filter(
+            followers__follower=follower,
+            follower_count__gt=settings.TIMELINE_FANOUT_FOLLOWER_LIMIT,
+        ).values_list('id', flat=True)
+    )
+
+def is_high_fanout(author_id):
+    return User.objects.filter(
+        pk=author_id,
+        follower_count__gt=settings.TIMELINE_FANOUT_FOLLOWER_LIMIT,
+    ).exists()
+
+def timeline_posts(author_ids):
+    return Post.objects.filter(user_id__in=author_ids, parent_post__isnull=True)
+
+def fan_out_post(post):
+    if post.parent_post_id is not None or is_high_fanout(post.user_id):
+        return
+    # At most TIMELINE_FANOUT_FOLLOWER_LIMIT of them
+    follower_ids = list(Follow.objects.filter(following_id=post.user_id).values_list('follower_id', flat=True))
+    for start in range(0, len(follower_ids), BATCH_SIZE):
+        batch = follower_ids[start:start + BATCH_SIZE]
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=follower_id, post=post, created_at=post.created_at) for follower_id in batch],
+            ignore_conflicts=True,
+        )
+        prune(batch)
+
+def backfill(follower_id, author_ids):
+    """Push recent posts of newly followed `author_ids` into `follower_id`'s timeline."""
+    author_ids = set(author_ids) - set(
+        User.objects.filter(
+            pk__in=author_ids,
+            follower_count__gt=settings.TIMELINE_FANOUT_FOLLOWER_LIMIT,
+        ).values_list('id', flat=True)
+    )
+    if not author_ids:
+        return
+    recent = timeline_posts(author_ids).order_by('-created_at', '-id')[:settings.TIMELINE_MAX_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=follower_id, post_id=post_id, created_at=created_at)
+         for post_id, created_at in recent.values_list('id', 'created_at')],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    prune([follower_id])
+
+def remove_authors(follower_id, author_ids):
+    TimelineEntry.objects.filter(user_id=follower_id, post__user_id__in=author_ids).delete()
+
+def prune(user_ids):
+    """Trim each user's timeline to the newest TIMELINE_MAX_LENGTH entries."""
+    overflow = TimelineEntry.objects.filter(user_id__in=user_ids).annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=F('user_id'),
+            order_by=[F('created_at').desc(), F('post_id').desc()],
+        )
+    ).filter(position__gt=settings.TIMELINE_MAX_LENGTH)
+    TimelineEntry.objects.filter(pk__in=overflow.values('pk')).delete()
+
+def rebuild(user):
+    TimelineEntry.objects.filter(user=user).delete()
+    author_ids = set(Follow.objects.filter(follower=user).values_list('following_id', flat=True))
+    author_ids -= set(high_fanout_author_ids(user))
+    recent = timeline_posts(author_ids).order_by('-created_at', '-id')[:settings.TIMELINE_MAX_LENGTH]
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user=user, post_id=post_id, created_at=created_at)
+         for post_id, created_at in recent.values_list('id', 'created_at')],
+        batch_size=BATCH_SIZE,
+    )
+
+def home_timeline(user, limit, after=None):
+    """
+    Newest-first (created_at, post id) keys of `user`'s following feed,
+    at most `limit` of them, strictly after the `after` key if given.
+    """
+    def after_key(queryset, id_field):
+        if after is None:
+            return queryset
+        created_at, post_id = after
+        return queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, **{f'{id_field}__lt': post_id}))
+
+    entries = after_key(TimelineEntry.objects.filter(user=user), 'post_id')
+    keys = set(entries.order_by('-created_at', '-post_id').values_list('created_at', 'post_id')[:limit])
+
+    merged_authors = high_fanout_author_ids(user)
+    if merged_authors:
+        merged = after_key(timeline_posts(merged_authors), 'id')
+        keys.update(merged.order_by('-created_at', '-id').values_list('created_at', 'id')[:limit])
+
+    return sorted(keys, reverse=True)[:limit]
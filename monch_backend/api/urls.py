@@ -1,9 +1,10 @@
 #import router and register URLs
 
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import user_views, post_views, follow_views, like_views, auth_views, whoami_view
+from .views import user_views, post_views, follow_views, like_views, auth_views, whoami_view, cache_stats_view, export_view, async_views
 
 router = DefaultRouter()
 router.register(r'users', user_views.UserViewSet, basename='user')
@@ -15,6 +16,17 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
-    path("whoami/", whoami_view.WhoAmIView.as_view()),
+    path("whoami/", async_views.whoami(whoami_view.WhoAmIView.as_view()) if settings.ASYNC_READ_VIEWS else whoami_view.WhoAmIView.as_view()),
+    path("cache-stats/", cache_stats_view.CacheStatsView.as_view()),
+    path("export/", export_view.ExportView.as_view(), name='export'),
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
+
+if settings.ASYNC_READ_VIEWS:
+    # Async reads in front of the router's views for the same URLs (api/views/async_views.py)
+    router_views = {url.name: url.callback for url in router.urls}
+    urlpatterns[-1:-1] = [
+        path('posts/following/', async_views.home_feed(router_views['posts-following-posts'])),
+        re_path(r'^posts/(?P<pk>[0-9]+)/$', async_views.post_detail(router_views['posts-detail'])),
+        re_path(r'^users/(?P<username>[^/.]+)/$', async_views.profile(router_views['user-detail'])),
+    ]
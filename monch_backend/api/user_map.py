@@ -0,0 +1,35 @@
+from .models import User
+from .viewer_state import related_posts
+
+# Per-request identity map of post authors. Every distinct author on a page
+# (posts, parents, reposted originals, reply trees) is loaded once with a
+# single query and serialized once as a compact UserSummarySerializer, no
+# matter how many posts they appear on.
+
+SUMMARY_FIELDS = ('id', 'username', 'display_name', 'avatar', 'avatar_renditions')
+
+class UserMap:
+    def __init__(self):
+        self.users = {}
+        # Serialized summaries by user id, filled in by AuthorMixin
+        self.summaries = {}
+
+    def load(self, user_ids):
+        missing = set(user_ids) - set(self.users)
+        if missing:
+            self.users.update(User.objects.only(*SUMMARY_FIELDS).in_bulk(missing))
+
+    def load_posts(self, posts):
+        """Load the authors of `posts` and every related post already attached to them."""
+        self.load({post.user_id for post in related_posts(posts)})
+
+    def get(self, user_id):
+        self.load([user_id])
+        return self.users[user_id]
+
+def user_map(request):
+    """The request's UserMap, created on first use."""
+    state = getattr(request, '_user_map', None)
+    if state is None:
+        state = request._user_map = UserMap()
+    return state
@@ -0,0 +1,84 @@
+from django.conf import settings
+from .models import Post, Like
+from . import like_buffer
+
+# The requesting user's relation to the posts being serialized: which of them
+# they liked and the id of their repost of each. Loaded for every post on a
+# page at once (including parents, reposted originals and reply trees) with
+# one query for likes and one for reposts, and kept on the request so nested
+# serializers and later batches reuse it.
+#
+# With LIKE_WRITE_BEHIND, the viewer's likes still in api/like_buffer.py win
+# over the likes table, and the like counts they show are moved to match.
+
+class ViewerState:
+    def __init__(self, viewer):
+        self.viewer = viewer if viewer is not None and viewer.is_authenticated else None
+        self.liked_ids = set()
+        self.repost_ids = {}
+        self.like_deltas = {}
+        self.loaded_ids = set()
+
+    def load(self, post_ids):
+        post_ids = set(post_ids) - self.loaded_ids
+        if not post_ids or self.viewer is None:
+            self.loaded_ids |= post_ids
+            return
+        liked = set(Like.objects.filter(user=self.viewer, post_id__in=post_ids).values_list('post_id', flat=True))
+        if settings.LIKE_WRITE_BEHIND:
+            for post_id, pending in like_buffer.pending(self.viewer.pk, post_ids).items():
+                if pending != (post_id in liked):
+                    self.like_deltas[post_id] = 1 if pending else -1
+                    liked ^= {post_id}
+        self.liked_ids |= liked
+        self.repost_ids.update(
+            Post.objects.filter(user=self.viewer, repost_of_id__in=post_ids).values_list('repost_of_id', 'id')
+        )
+        self.loaded_ids |= post_ids
+
+    def load_posts(self, posts):
+        """Load the state of `posts` and every related post already attached to them."""
+        self.load({post.id for post in related_posts(posts)})
+
+    def liked(self, post):
+        self.load([post.id])
+        return post.id in self.liked_ids
+
+    def likes_delta(self, post):
+        """What the viewer's unflushed like or unlike adds to the post's likes_count."""
+        self.load([post.id])
+        return self.like_deltas.get(post.id, 0)
+
+    def repost_id(self, post):
+        """The id of the viewer's repost of what `post` shows: the original, for a repost row."""
+        original_id = post.repost_of_id if post.repost_of_id is not None else post.id
+        self.load([original_id])
+        return self.repost_ids.get(original_id)
+
+def related_posts(posts):
+    """
+    `posts` and every post already attached to them (parent, reposted
+    original, reply tree). The same post can appear as several instances.
+    Relations that are not loaded are skipped rather than queried.
+    """
+    found = {}
+    stack = list(posts)
+    while stack:
+        post = stack.pop()
+        if id(post) in found:
+            continue
+        found[id(post)] = post
+        cache = post._state.fields_cache
+        for name in ('parent_post', 'repost_of'):
+            related = cache.get(name)
+            if related is not None:
+                stack.append(related)
+        stack.extend(getattr(post, 'thread_replies', ()))
+    return list(found.values())
+
+def viewer_state(request):
+    """The request's ViewerState, created on first use."""
+    state = getattr(request, '_viewer_state', None)
+    if state is None:
+        state = request._viewer_state = ViewerState(request.user)
+    return state
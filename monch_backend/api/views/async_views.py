@@ -0,0 +1,128 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from ..authentication import CachedJWTAuthentication
+from ..conditional import aconditional_response
+from ..models import Post, User
+from ..pagination import KeysetPagination
+from ..querysets import post_queryset, user_queryset
+from ..serializers import PostSerializer, UserSerializer, includes_posts, prepare_posts
+from ..timeline import home_timeline
+from .whoami_view import WhoAmIView
+
+# Async versions of the hottest reads (home feed, post detail, profile,
+# whoami) for ASGI deployments, routed in place of the DRF views when
+# ASYNC_READ_VIEWS is on (api/urls.py). Authentication, queries and cache
+# lookups are awaited so a request waiting on the database or the cache
+# doesn't hold a worker; serialization runs on preloaded objects.
+#
+# Only authenticated JSON GETs are served here. Everything else (writes,
+# anonymous reads that the response cache serves, the browsable API, auth
+# errors) is passed to the synchronous view, so both paths answer the same.
+
+authenticator = CachedJWTAuthentication()
+renderer = JSONRenderer()
+
+
+class NotFound(Exception):
+    def __init__(self, model):
+        # Same message as get_object_or_404 in the DRF views
+        super().__init__(f'No {model._meta.object_name} matches the given query.')
+
+
+def async_read(sync_view, conditional=True):
+    """
+    Async view running `read(request, **kwargs)` in front of the DRF
+    `sync_view`, with conditional GET support like the sync view's if `conditional`.
+    """
+    def decorator(read):
+        async def view(request, *args, **kwargs):
+            drf_request = await _authenticated_json_get(request)
+            if drf_request is None:
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            try:
+                if conditional:
+                    response = await aconditional_response(drf_request, lambda: read(drf_request, **kwargs))
+                else:
+                    response = await read(drf_request, **kwargs)
+            except NotFound as error:
+                response = Response({'detail': str(error)}, status=404)
+            return _render(response)
+        view.csrf_exempt = True
+        # Same endpoint name in request metrics as the view it stands in for
+        view.cls, view.actions = getattr(sync_view, 'cls', None), getattr(sync_view, 'actions', None)
+        return view
+    return decorator
+
+async def _authenticated_json_get(request):
+    if request.method not in ('GET', 'HEAD') or request.GET.get('format', 'json') != 'json':
+        return None
+    if 'text/html' in request.headers.get('Accept', ''):
+        return None
+    try:
+        result = await authenticator.aauthenticate(request)
+    except APIException:
+        return None
+    if result is None:
+        return None
+    drf_request = Request(request)
+    drf_request.user, drf_request.auth = result
+    drf_request.accepted_renderer = renderer
+    drf_request.accepted_media_type = renderer.media_type
+    return drf_request
+
+def _render(response):
+    if not isinstance(response, Response):
+        return response
+    rendered = HttpResponse(renderer.render(response.data), status=response.status_code, content_type=renderer.media_type)
+    for name, value in response.items():
+        if name.lower() != 'content-type':
+            rendered[name] = value
+    return rendered
+
+async def _serialize_posts(posts, request):
+    await sync_to_async(prepare_posts)(posts, request)
+    return PostSerializer(posts, many=True, context={'request': request}).data
+
+
+def home_feed(sync_view):
+    @async_read(sync_view, conditional=False)
+    async def read(request):
+        paginator = KeysetPagination()
+        keys = await sync_to_async(home_timeline)(
+            request.user, paginator.get_page_size(request) + 1, paginator.get_position(request),
+        )
+        posts = post_queryset(Post.objects.filter(id__in=[post_id for _, post_id in keys]))
+        page = await paginator.apaginate_queryset(posts, request)
+        return paginator.get_paginated_response(await _serialize_posts(page, request))
+    return read
+
+def post_detail(sync_view):
+    @async_read(sync_view)
+    async def read(request, pk):
+        try:
+            post = await post_queryset(Post.objects.all()).aget(pk=pk)
+        except Post.DoesNotExist:
+            raise NotFound(Post)
+        await sync_to_async(prepare_posts)([post], request)
+        return Response(PostSerializer(post, context={'request': request}).data)
+    return read
+
+def profile(sync_view):
+    @async_read(sync_view)
+    async def read(request, username):
+        try:
+            user = await user_queryset(includes_posts(request)).aget(username=username)
+        except User.DoesNotExist:
+            raise NotFound(User)
+        return Response(UserSerializer(user, context={'request': request}).data)
+    return read
+
+def whoami(sync_view):
+    @async_read(sync_view)
+    async def read(request):
+        return WhoAmIView().build_response(request)
+    return read
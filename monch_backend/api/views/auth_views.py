@@ -7,6 +7,7 @@ from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken, TokenError
 # from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework import status
+from ..authentication import tokens_for
 
 @method_decorator(csrf_exempt, name='dispatch')
 class LoginView(APIView):
@@ -20,7 +21,7 @@ class LoginView(APIView):
         if user is None:
             return Response({"detail": "Invalid credentials"}, status=401)
 
-        refresh = RefreshToken.for_user(user)
+        refresh = tokens_for(user)
         return Response({
             "access": str(refresh.access_token),
             "refresh": str(refresh),
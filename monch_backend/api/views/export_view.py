@@ -0,0 +1,72 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from ..export import export_chunks, parse_cursor
+
+class NDJSONRenderer(JSONRenderer):
+    # Lets clients ask for the export's own media type; errors are one JSON line
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+class ExportView(APIView):
+    """
+    GET streams the authenticated user's history as NDJSON (api/export.py),
+    gzipped when the client accepts it. ?cursor= resumes after a record.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, NDJSONRenderer]
+
+    def get(self, request):
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            parse_cursor(cursor)  # a bad cursor is a 404 before streaming starts
+        compress = _accepts_gzip(request.headers.get('Accept-Encoding', ''))
+        chunks = export_chunks(request.user, cursor, request=request, compress=compress)
+        if isinstance(request._request, ASGIRequest):
+            # Django's ASGI handler reads sync iterators to the end before sending
+            chunks = _async_chunks(chunks)
+
+        response = StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}.ndjson"'
+        response['Cache-Control'] = 'private, no-store'
+        response['X-Accel-Buffering'] = 'no'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+def _accepts_gzip(header):
+    """Whether an Accept-Encoding header allows gzip: listed, or matched by *, with q > 0."""
+    qualities = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+async def _async_chunks(chunks):
+    # One executor hop per chunk, on the request's thread so the database
+    # cursor stays on its connection
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await next_chunk(chunks, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close, thread_sensitive=True)()
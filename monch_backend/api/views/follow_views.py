@@ -5,11 +5,12 @@ from rest_framework import viewsets, permissions, status
 from django.contrib.auth import get_user_model
 from ..models import Follow
 from ..serializers import FollowSerializer
+from ..batch import batch_values, follow_state, follow_users, unfollow_users
 
 User = get_user_model()
 
 class FollowViewSet(viewsets.ModelViewSet):
-    queryset = Follow.objects.all()
+    queryset = Follow.objects.select_related('follower', 'following')
     serializer_class = FollowSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -50,6 +51,20 @@ class FollowViewSet(viewsets.ModelViewSet):
         is_following = Follow.objects.filter(follower=request.user, following=target).exists()
         return Response({"is_following": is_following})
 
+    @action(detail=False, methods=['get'])
+    def state(self, request):
+        # ?usernames=a,b,c -> {"a": true, "b": false}; unknown usernames are left out
+        usernames = batch_values(request.query_params, 'usernames')
+        return Response(follow_state(request.user, usernames))
+
+    @action(detail=False, methods=['post', 'delete'])
+    def bulk(self, request):
+        # POST follows, DELETE unfollows every user in {"usernames": [...]}
+        usernames = batch_values(request.data, 'usernames')
+        if request.method == 'POST':
+            return Response({'followed': follow_users(request.user, usernames)})
+        return Response({'unfollowed': unfollow_users(request.user, usernames)})
+
 
     class Meta:
         unique_together = ('follower', 'following')
\ No newline at end of file
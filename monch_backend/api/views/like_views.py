@@ -1,18 +1,43 @@
+from django.conf import settings
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import viewsets, permissions, filters
-from ..models import Like
+from django.db.models import F
+from ..models import Like, Post
 from ..serializers import LikeSerializer, PostSerializer
+from ..querysets import post_queryset
+from ..pagination import KeysetPagination
+from ..batch import batch_values, like_posts, unlike_posts
+from .. import like_buffer
 
 class LikeViewSet(viewsets.ModelViewSet):
-    queryset = Like.objects.all()
+    queryset = Like.objects.select_related('user')
     serializer_class = LikeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     @action(detail=False, methods=['get'], url_path='liked-posts')
     def liked_posts(self, request):
         user = request.user
-        likes = Like.objects.filter(user=user).select_related('post').order_by('-created_at')
-        posts = [like.post for like in likes]
-        serializer = PostSerializer(posts, many=True, context={'request': request})
-        return Response(serializer.data)
\ No newline at end of file
+        posts = Post.objects.filter(likes__user=user).annotate(
+            liked_at=F('likes__created_at'),
+            like_id=F('likes__id'),
+        )
+        posts = post_queryset(posts)
+
+        paginator = KeysetPagination(ordering=('-liked_at', '-like_id'))
+        page = paginator.paginate_queryset(posts, request)
+        serializer = PostSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post', 'delete'])
+    def bulk(self, request):
+        # POST likes, DELETE unlikes every post in {"post_ids": [...]}
+        post_ids = batch_values(request.data, 'post_ids', int)
+        if settings.LIKE_WRITE_BEHIND:
+            if request.method == 'POST':
+                found = sorted(Post.objects.filter(pk__in=post_ids).values_list('id', flat=True))
+                return Response({'liked': like_buffer.set_liked(request.user, found, True)})
+            return Response({'unliked': like_buffer.set_liked(request.user, sorted(post_ids), False)})
+        if request.method == 'POST':
+            return Response({'liked': like_posts(request.user, post_ids)})
+        return Response({'unliked': unlike_posts(request.user, post_ids)})
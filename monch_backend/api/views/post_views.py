@@ -1,30 +1,79 @@
+from django.conf import settings
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.pagination import PageNumberPagination
-from rest_framework import viewsets, permissions, filters, status
-from ..models import Post, Follow, Like, PostMedia
-from ..serializers import PostSerializer
-
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 50
-    
+from rest_framework import viewsets, permissions, status
+from rest_framework.exceptions import NotFound
+from ..models import Post, Like
+from ..serializers import PostSerializer, PostMediaSerializer, SearchResultSerializer
+from ..querysets import post_queryset
+from ..threads import load_threads, load_branch, thread_options
+from ..pagination import KeysetPagination
+from ..timeline import home_timeline
+from ..search import search_posts
+from ..media import attach_upload, retry_failed
+from ..response_cache import cached_response
+from ..conditional import conditional_response
+from ..batch import batch_values
+from .. import like_buffer
+
 class PostViewSet(viewsets.ModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['content', 'user__username']
     parser_classes = [MultiPartParser, FormParser]
 
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
+        queryset = Post.objects.all()
         if self.action == 'list':
-            return Post.objects.filter(parent_post__isnull=True).order_by('-created_at')
-        return Post.objects.all().order_by('-created_at')
+            queryset = queryset.filter(parent_post__isnull=True)
+        if self.action in ('list', 'retrieve', 'replies', 'thread'):
+            queryset = post_queryset(queryset)
+        return queryset.order_by('-created_at')
+
+    def list(self, request, *args, **kwargs):
+        # ?search= is served by the full-text index, see search()
+        if request.query_params.get('search'):
+            return self.search(request)
+        # ?ids=1,2,3 fetches those posts (replies included), in that order
+        if 'ids' in request.query_params:
+            return conditional_response(request, lambda: self.multi_get(request))
+        return conditional_response(request, lambda: cached_response(
+            request, lambda: super(PostViewSet, self).list(request, *args, **kwargs), ['feed'],
+        ), ['feed'])
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(request, lambda: cached_response(
+            request, lambda: super(PostViewSet, self).retrieve(request, *args, **kwargs),
+        ))
+
+    def multi_get(self, request):
+        ids = batch_values(request.query_params, 'ids', int)
+        posts = post_queryset(Post.objects.filter(id__in=ids)).in_bulk()
+        found = [posts[post_id] for post_id in ids if post_id in posts]
+        return Response({"results": PostSerializer(found, many=True, context={'request': request}).data})
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        text = request.query_params.get('q') or request.query_params.get('search', '')
+        paginator = KeysetPagination(ordering=('-rank', '-id'))
+        rows = search_posts(text, paginator.get_page_size(request) + 1, paginator.get_position(request))
+        rows = paginator.paginate_list(rows, request, lambda row: (row[1], row[0]))
+
+        posts = post_queryset(Post.objects.filter(id__in=[row[0] for row in rows])).in_bulk()
+        results = []
+        for post_id, rank, snippet in rows:
+            # Deleted since the index was read, or an index row left behind by a bulk delete
+            post = posts.get(post_id)
+            if post is None:
+                continue
+            post.search_rank, post.search_snippet = rank, snippet
+            results.append(post)
+
+        serializer = SearchResultSerializer(results, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     #override perform_create to attach user to post
     def perform_create(self, serializer):
@@ -33,20 +82,44 @@ class PostViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def replies(self, request, pk=None):
         post = self.get_object()
-        replies = post.replies.all().order_by('created_at')
-        serializer = PostSerializer(replies, many=True)
+        load_threads([post], *thread_options(request))
+        serializer = PostSerializer(post.thread_replies, many=True, context={'request': request})
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def thread(self, request, pk=None):
+        # ?cursor= continues a branch cut off by the depth/fan-out limits
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            if not pk.isdigit():
+                raise NotFound('Invalid cursor.')
+            parent, replies, next_cursor = load_branch(int(pk), cursor, *thread_options(request))
+            return Response({
+                "replies": PostSerializer(replies, many=True, context={'request': request}).data,
+                "cursor": next_cursor,
+            })
+
         post = self.get_object()
-        replies = post.replies.all().order_by('created_at')
+        original = PostSerializer(post, context={'request': request}).data
         data = {
-            "original": PostSerializer(post).data,
-            "replies": PostSerializer(replies, many=True).data
+            "original": original,
+            "replies": original['replies'],
+            "replies_cursor": original['replies_cursor'],
         }
         return Response(data)
     
+    @action(detail=True, methods=['get', 'post'])
+    def media(self, request, pk=None):
+        # GET: processing status of the post's media, for clients to poll until
+        # everything is ready. POST (author only): queue failed media again.
+        post = self.get_object()
+        if request.method == 'POST':
+            if post.user_id != request.user.id:
+                return Response({"detail": "You can only retry your own media."}, status=status.HTTP_403_FORBIDDEN)
+            retry_failed(post.media.all())
+        serializer = PostMediaSerializer(post.media.all(), many=True, context={'request': request})
+        return Response(serializer.data)
+
     @action(detail=False, methods=["get"], url_path="following")
     def following_posts(self, request):
         user = request.user
@@ -54,17 +127,14 @@ class PostViewSet(viewsets.ModelViewSet):
         if not user.is_authenticated:
             return Response({"detail": "Authentication required."}, status=401)
 
-        followed_user_ids = Follow.objects.filter(follower=user).values_list("following_id", flat=True)
-        posts = Post.objects.filter(user__id__in=followed_user_ids, parent_post__isnull=True).order_by("-created_at")
-
+        # Read a page of keys off the materialized timeline, then load just those posts
         paginator = self.pagination_class()
+        keys = home_timeline(user, paginator.get_page_size(request) + 1, paginator.get_position(request))
+        posts = post_queryset(Post.objects.filter(id__in=[post_id for _, post_id in keys]))
+
         page = paginator.paginate_queryset(posts, request)
-        if page is not None:
-            serializer = PostSerializer(page, many=True, context={'request': request})
-            return paginator.get_paginated_response(serializer.data)
-        else:
-            serializer = PostSerializer(posts, many=True, context={'request': request})
-            return Response(serializer.data)
+        serializer = PostSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     
     @action(detail=True, methods=['post', 'delete'], permission_classes=[permissions.IsAuthenticated])
@@ -73,13 +143,20 @@ class PostViewSet(viewsets.ModelViewSet):
         user = request.user
 
         if request.method == 'POST':
-            like, created = Like.objects.get_or_create(user=user, post=post)
+            if settings.LIKE_WRITE_BEHIND:
+                created = bool(like_buffer.set_liked(user, [post.id], True))
+            else:
+                like, created = Like.objects.get_or_create(user=user, post=post)
             if created:
                 return Response({'detail': 'Post liked'}, status=status.HTTP_201_CREATED)
             else:
                 return Response({'detail': 'Already liked'}, status=status.HTTP_400_BAD_REQUEST)
 
         elif request.method == 'DELETE':
+            if settings.LIKE_WRITE_BEHIND:
+                if like_buffer.set_liked(user, [post.id], False):
+                    return Response({'detail': 'Like removed'}, status=status.HTTP_204_NO_CONTENT)
+                return Response({'detail': 'Not liked yet'}, status=status.HTTP_400_BAD_REQUEST)
             try:
                 like = Like.objects.get(user=user, post=post)
                 like.delete()
@@ -100,23 +177,16 @@ class PostViewSet(viewsets.ModelViewSet):
 
         try:
             if repost_of:
-                
-                original_post = Post.objects.get(id=repost_of)
+                # A pointer to the original (a repost of a repost points at
+                # its original too); nothing is copied
+                original_post = Post.objects.select_related('repost_of').get(id=repost_of).original
 
                 post = Post.objects.create(
                     user=user,
-                    content=original_post.content,
                     parent_post_id=parent_post if parent_post else None,
                     repost_of=original_post,
                 )
 
-                for media in original_post.media.all():
-                    PostMedia.objects.create(
-                        post=post,
-                        media_file=media.media_file,
-                        media_type=media.media_type
-                    )
-
             else:
                 post = Post.objects.create(
                     user=user,
@@ -126,7 +196,7 @@ class PostViewSet(viewsets.ModelViewSet):
                 )
 
                 if media_file:
-                    PostMedia.objects.create(post=post, media_file=media_file)
+                    attach_upload(post, media_file)
 
         except Post.DoesNotExist:
             return Response({"detail": "Original post to repost not found."}, status=status.HTTP_404_NOT_FOUND)
@@ -142,7 +212,7 @@ class PostViewSet(viewsets.ModelViewSet):
     def toggle_repost(self, request, pk=None):
         user = request.user
         try:
-            original_post = Post.objects.get(pk=pk)
+            original_post = Post.objects.select_related('repost_of').get(pk=pk).original
         except Post.DoesNotExist:
             return Response({"detail": "Post not found."}, status=status.HTTP_404_NOT_FOUND)
 
@@ -153,19 +223,7 @@ class PostViewSet(viewsets.ModelViewSet):
             existing_repost.delete()
             return Response({"reposted": False}, status=status.HTTP_200_OK)
 
-        # Create a new repost
-        repost = Post.objects.create(
-            user=user,
-            content=original_post.content, 
-            repost_of=original_post
-        )
-
-        # Copy media from original post
-        for media in original_post.media.all():
-            PostMedia.objects.create(
-                post=repost,
-                media_file=media.media_file,
-                media_type=media.media_type
-            )
+        # Create a new repost: a pointer row, its content and media are the original's
+        repost = Post.objects.create(user=user, repost_of=original_post)
 
         return Response({"reposted": True, "id": repost.id}, status=status.HTTP_201_CREATED)
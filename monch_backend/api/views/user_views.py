@@ -1,20 +1,24 @@
 # your_app/views/user_views.py
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
-from django.db.models import Q
+from django.db.models import F, Q
 from rest_framework.response import Response
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
 from ..models import User, Post
-from ..serializers import UserSerializer, PostSerializer
+from ..serializers import UserSerializer, PostSerializer, SuggestionSerializer, includes_posts
+from ..querysets import post_queryset, user_queryset
+from ..pagination import KeysetPagination, UserPagination
+from ..media import set_avatar
+from ..response_cache import cached_response
+from ..conditional import conditional_response
+from ..batch import batch_values
+from ..follow_graph import follow_graph
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import ValidationError
-from PIL import Image, UnidentifiedImageError
-from io import BytesIO
-from django.core.files.base import ContentFile
-from PIL import ExifTags
-import uuid
+from PIL import UnidentifiedImageError
 import os
+from bisect import bisect_right
 
 
 User = get_user_model()
@@ -25,39 +29,113 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     lookup_field = 'username'
     parser_classes = [JSONParser, MultiPartParser, FormParser]
+    pagination_class = UserPagination
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return user_queryset(includes_posts(self.request))
+        return User.objects.all()
+
+    def list(self, request, *args, **kwargs):
+        # ?usernames=a,b,c fetches those users, in that order, in one query
+        if 'usernames' in request.query_params:
+            return conditional_response(request, lambda: self.multi_get(request))
+        return super().list(request, *args, **kwargs)
+
+    def multi_get(self, request):
+        usernames = batch_values(request.query_params, 'usernames')
+        users = {user.username: user for user in self.get_queryset().filter(username__in=usernames)}
+        found = [users[username] for username in usernames if username in users]
+        return Response({"results": self.get_serializer(found, many=True).data})
+
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(request, lambda: cached_response(
+            request, lambda: super(UserViewSet, self).retrieve(request, *args, **kwargs),
+        ))
 
     @action(detail=True, methods=['get'], url_path='followers')
     def followers(self, request, username=None):
         user = self.get_object()
-        followers = User.objects.filter(following__following=user)
-        serializer = UserSerializer(followers, many=True)
-        return Response(serializer.data)
+        followers = user_queryset(includes_posts(request)).filter(following__following=user).annotate(
+            followed_at=F('following__created_at'),
+            follow_id=F('following__id'),
+        )
+
+        paginator = KeysetPagination(ordering=('-followed_at', '-follow_id'))
+        page = paginator.paginate_queryset(followers, request)
+        serializer = UserSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['get'], url_path='following')
     def following(self, request, username=None):
         user = self.get_object()
-        following = User.objects.filter(followers__follower=user)
-        serializer = UserSerializer(following, many=True)
+        following = user_queryset(includes_posts(request)).filter(followers__follower=user).annotate(
+            followed_at=F('followers__created_at'),
+            follow_id=F('followers__id'),
+        )
+
+        paginator = KeysetPagination(ordering=('-followed_at', '-follow_id'))
+        page = paginator.paginate_queryset(following, request)
+        serializer = UserSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def mutuals(self, request, username=None):
+        # Users who follow this user and are followed back, from the follow graph
+        user = self.get_object()
+        paginator = KeysetPagination(ordering=('id',))
+        position = paginator.get_position(request)
+        ids = follow_graph().mutuals(user.pk)
+        if position is not None:
+            ids = ids[bisect_right(ids, position[0]):]
+        ids = paginator.paginate_list(ids[:paginator.get_page_size(request) + 1], request, lambda pk: (pk,))
+
+        users = user_queryset(includes_posts(request)).in_bulk(ids)
+        serializer = UserSerializer([users[pk] for pk in ids if pk in users], many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def suggestions(self, request):
+        # Who to follow: friends of friends, ranked by how many of the
+        # people the viewer follows follow them
+        limit = KeysetPagination().get_page_size(request)
+        ranked = follow_graph().suggestions(request.user.pk, limit)
+
+        via_ids = {pk for _, via in ranked for pk in via[:3]}
+        users = User.objects.in_bulk([pk for pk, _ in ranked] + list(via_ids))
+        suggested = []
+        for pk, via in ranked:
+            if pk in users:
+                users[pk].suggested_via = via
+                suggested.append(users[pk])
+        serializer = SuggestionSerializer(suggested, many=True, context={
+            'request': request,
+            'suggested_via_users': {pk: users[pk].username for pk in via_ids if pk in users},
+        })
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'], url_path='posts')
     def posts(self, request, username=None):
         user = self.get_object()
-        posts = Post.objects.filter(user=user, parent_post__isnull=True).order_by('-created_at')
-        serializer = PostSerializer(posts, many=True, context={'request': request})
-        return Response(serializer.data)
+        posts = Post.objects.filter(user=user, parent_post__isnull=True)
+        posts = post_queryset(posts)
+
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(posts, request)
+        serializer = PostSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['get'], url_path='replies')
     def replies(self, request, username=None):
         user = self.get_object()
 
-        replies = Post.objects.filter(user=user, parent_post__isnull=False)\
-                              .select_related('parent_post', 'parent_post__user')\
-                              .prefetch_related('media')\
-                              .order_by('-created_at')
+        replies = Post.objects.filter(user=user, parent_post__isnull=False)
+        replies = post_queryset(replies)
 
-        serializer = PostSerializer(replies, many=True, context={'request': request})
-        return Response(serializer.data)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(replies, request)
+        serializer = PostSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
     
     @action(detail=False, methods=['get'], url_path='check-username', permission_classes=[permissions.AllowAny])
     def check_username(self, request):
@@ -100,8 +178,6 @@ class UserViewSet(viewsets.ModelViewSet):
         return super().update(request, *args, **kwargs)
 
     def partial_update(self, request, *args, **kwargs):
-        print("Request Data:", request.data)
-        print("Request Files:", request.FILES)
         user = self.get_object()
 
         if request.user != user:
@@ -116,62 +192,15 @@ class UserViewSet(viewsets.ModelViewSet):
                 raise ValidationError("Invalid avatar format. Only JPEG, PNG, and GIF are allowed.")
             
             try:
-                img = Image.open(avatar)
-                try:
-                    for orientation in ExifTags.TAGS.keys():
-                        if ExifTags.TAGS[orientation] == 'Orientation':
-                            break
-
-                    exif = img._getexif()
-                    if exif is not None:
-                        orientation_value = exif.get(orientation)
-                        if orientation_value == 3:
-                            img = img.rotate(180, expand=True)
-                        elif orientation_value == 6:
-                            img = img.rotate(270, expand=True)
-                        elif orientation_value == 8:
-                            img = img.rotate(90, expand=True)
-                except Exception:
-                    pass
-                
-                img_format = img.format 
-
-                # GIFs stay as is
-                if img_format == 'GIF':
-                    ext = 'gif'
-                    filename = f"{uuid.uuid4().hex}.{ext}"
-                    user.avatar.save(filename, ContentFile(avatar.read()), save=False)
-                else:
-                    # Compress
-                    max_size = (360, 360)
-                    img.thumbnail(max_size, Image.LANCZOS)
-
-                    if img.mode in ("RGBA", "P"):
-                        img = img.convert("RGB")
-
-                    output = BytesIO()
-                    if img_format == "PNG":
-                        img.save(output, format='PNG', optimize=True)
-                        ext = "png"
-                    else:
-                        img.save(output, format='JPEG', quality=75)
-                        ext = "jpg"
-
-                    output.seek(0)
-                    filename = f"{uuid.uuid4().hex}.{ext}"
-                    print("Saving avatar with filename:", filename)
-                    user.avatar.save(filename, ContentFile(output.read()), save=False)
-                    print("user.avatar.name after save:", user.avatar.name)
-
+                set_avatar(user, avatar)
             except UnidentifiedImageError:
                 raise ValidationError("Uploaded file is not a valid image.")
         
-        if 'display_name' in request.data:
-            user.display_name = request.data['display_name']
-        if 'bio' in request.data:
-            user.bio = request.data['bio']
-
-        user.save()
+        changed = [field for field in ('display_name', 'bio') if field in request.data]
+        for field in changed:
+            setattr(user, field, request.data[field])
+        if changed:
+            user.save(update_fields=changed)
 
         serializer = self.get_serializer(user)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -182,7 +211,7 @@ class UserViewSet(viewsets.ModelViewSet):
         if not query:
             return Response([])
 
-        matches = User.objects.filter(
+        matches = user_queryset(includes_posts(request)).filter(
             Q(username__icontains=query) |
             Q(display_name__icontains=query) |
             Q(bio__icontains=query)
@@ -1,11 +1,16 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from ..media import srcset
+from ..conditional import conditional_response
 
 class WhoAmIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        return conditional_response(request, lambda: self.build_response(request))
+
+    def build_response(self, request):
         user = request.user
         return Response({
             "id": user.id,
@@ -13,4 +18,5 @@ class WhoAmIView(APIView):
             "display_name": user.display_name,
             "bio": user.bio,
             "avatar": user.avatar.url if user.avatar else None,
+            "avatar_srcset": srcset(user.avatar.storage, user.avatar_renditions, request),
         })
\ No newline at end of file
@@ -1,5 +1,5 @@
 """
-ASGI config for threads_clone project.
+ASGI config for monch_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
@@ -11,6 +11,10 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'threads_clone.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'monch_backend.settings')
 
 application = get_asgi_application()
+
+# Load the follow graph before the first request needs it
+from api import follow_graph  # noqa: E402
+follow_graph.warm_up()
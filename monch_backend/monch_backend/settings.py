@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import dj_database_url
-from decouple import config
+from decouple import Csv, config
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,12 +43,13 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'api',
     'corsheaders',
-    'debug_toolbar',
     'rest_framework_simplejwt.token_blacklist',
     'storages',
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.RequestMetricsMiddleware',
+    'api.replicas.ReplicaRoutingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -57,9 +58,15 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+if DEBUG:
+    # Local profiling only; production requests are measured by
+    # api.instrumentation (Server-Timing headers, slow request log, /metrics)
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+    INTERNAL_IPS = ['127.0.0.1']
+
 ROOT_URLCONF = 'monch_backend.urls'
 
 AUTHENTICATION_BACKENDS = [
@@ -92,6 +99,20 @@ DATABASES = {
     'default': dj_database_url.config(default=config('DATABASE_URL'))
 }
 
+# Read replicas (api/replicas.py): comma-separated database URLs. Safe-method
+# API reads go to a healthy replica unless the user wrote in the last
+# REPLICA_PIN_SECONDS; replicas are checked every REPLICA_HEALTH_CHECK_INTERVAL
+# seconds and skipped when (on PostgreSQL) more than REPLICA_MAX_LAG seconds behind.
+REPLICA_DATABASES = []
+for index, url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv())):
+    alias = f'replica{index + 1}'
+    DATABASES[alias] = {**dj_database_url.parse(url), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(alias)
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+REPLICA_HEALTH_CHECK_INTERVAL = 10
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=3, cast=float)
+
 AUTH_USER_MODEL = 'api.User'
 
 # Password validation
@@ -114,8 +135,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'api.authentication.CookieJWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly', 
@@ -124,10 +144,98 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
     'PAGE_SIZE': 10,
 }
 
+# Reply trees (api/threads.py): deepest level and replies per post loaded at once
+THREAD_MAX_DEPTH = 3
+THREAD_FAN_OUT = 10
+
+# Home timeline (api/timeline.py): entries kept per user, and the follower count
+# above which an author's posts are merged in at read time instead of pushed
+TIMELINE_MAX_LENGTH = 800
+TIMELINE_FANOUT_FOLLOWER_LIMIT = 5000
+
+# Media processing (api/media.py, run by manage.py process_media): attempts
+# before an upload is marked failed, and seconds after which a claimed upload
+# that was never finished (crashed worker) is picked up again
+MEDIA_MAX_ATTEMPTS = 5
+MEDIA_CLAIM_TIMEOUT = 300
+
+# Image renditions (api/media.py): sizes (longest side, px) post media and
+# avatars are resized to, and the formats written at each size when Pillow
+# supports them. The largest size is also kept in the original format.
+POST_MEDIA_SIZES = (320, 640, 1080)
+AVATAR_SIZES = (48, 96, 360)
+IMAGE_RENDITION_FORMATS = ('avif', 'webp')
+
+# Response cache for anonymous reads (api/response_cache.py), conditional GET
+# versions, cached users, the follow graph change log and buffered likes.
+# Per-process by default, which only works with a single worker and without
+# LIKE_WRITE_BEHIND: startup fails otherwise (api/checks.py).
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='monch'),
+    }
+}
+# Worker processes serving the API; gunicorn and uvicorn start this many by default
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)
+# Seconds an entry is served as fresh, seconds a changed or expired entry may
+# still be served while one request rebuilds it, and how long that rebuild
+# holds its lock
+RESPONSE_CACHE_TIMEOUT = 60
+RESPONSE_CACHE_STALE = 30
+RESPONSE_CACHE_LOCK_TIMEOUT = 10
+
+# Most ids/usernames accepted by one batch request (api/batch.py)
+BATCH_MAX_SIZE = 100
+
+# Seconds an authenticated user is cached in the shared cache (not used when
+# the default cache is per-process) and in each process (api/authentication.py);
+# a process may use a changed user for up to the local timeout
+AUTH_USER_CACHE_TIMEOUT = 300
+AUTH_USER_LOCAL_TIMEOUT = 5
+
+# Serve authenticated home feed, post detail, profile and whoami reads from
+# async views (api/views/async_views.py); turn on when running under ASGI
+ASYNC_READ_VIEWS = config('ASYNC_READ_VIEWS', default=False, cast=bool)
+
+# In-memory follow graph (api/follow_graph.py): snapshot written by
+# build_follow_graph, how long logged follow changes are kept for other
+# processes to replay, how many of them a process replays before rebuilding
+# instead, and how many followed accounts (and of their follows) suggestions
+# look through
+FOLLOW_GRAPH_SNAPSHOT = config('FOLLOW_GRAPH_SNAPSHOT', default=os.path.join(BASE_DIR, 'follow_graph.bin'))
+FOLLOW_GRAPH_LOG_TIMEOUT = 60 * 60 * 24
+FOLLOW_GRAPH_MAX_REPLAY = 50000
+FOLLOW_GRAPH_SUGGESTION_FAN_OUT = 500
+
+# Write-behind likes (api/like_buffer.py): likes and unlikes are buffered in
+# the cache and written by up to LIKE_FLUSH_BATCH_SIZE at a time, every
+# LIKE_FLUSH_INTERVAL seconds, by a thread in each process (LIKE_FLUSH_THREAD)
+# and/or `manage.py flush_likes`. Buffered likes are kept LIKE_BUFFER_TIMEOUT
+# seconds, in the cache only: turning this on requires a persistent shared
+# cache such as Redis (startup fails on locmem, see api/checks.py).
+LIKE_WRITE_BEHIND = config('LIKE_WRITE_BEHIND', default=False, cast=bool)
+LIKE_FLUSH_THREAD = config('LIKE_FLUSH_THREAD', default=True, cast=bool)
+LIKE_FLUSH_INTERVAL = 1.0
+LIKE_FLUSH_BATCH_SIZE = 5000
+LIKE_BUFFER_TIMEOUT = 60 * 60
+
+# Rows fetched per round trip by the streaming NDJSON export (api/export.py)
+EXPORT_CHUNK_SIZE = 2000
+
+# Request instrumentation (api/instrumentation.py): requests slower than this
+# are logged with their repeated SQL, and the bearer token Prometheus must
+# send to /metrics (no token: only served with DEBUG on)
+SLOW_REQUEST_MS = config('SLOW_REQUEST_MS', default=500, cast=int)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Seconds the dependencies and ETag of a URL are remembered for conditional GETs
+CONDITIONAL_GET_TIMEOUT = 60 * 60 * 24
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
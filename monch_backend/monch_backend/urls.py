@@ -14,15 +14,21 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.http import JsonResponse
 from django.urls import path, include
+from api.instrumentation import metrics_view
 
 def health(request):
     return JsonResponse({"status": "ok"})
 
 urlpatterns = [
     path("health/", health),
+    path("metrics", metrics_view),
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
 ]
+
+if settings.DEBUG:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))
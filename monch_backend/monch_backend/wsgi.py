@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'monch_backend.settings')
 
 application = get_wsgi_application()
+
+# Load the follow graph before the first request needs it
+from api import follow_graph  # noqa: E402
+follow_graph.warm_up()
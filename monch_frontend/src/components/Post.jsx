@@ -13,6 +13,7 @@ import { formatDistanceToNow, format } from "date-fns";
 import { Link, useNavigate } from "react-router-dom";
 import toast from "react-hot-toast";
 import ConfirmDialog from "../popups/ConfirmDialog.jsx";
+import ResponsiveImage from "./ResponsiveImage.jsx";
 
 export default function Post({
   post,
@@ -154,8 +155,10 @@ export default function Post({
           {/* OP Avatar */}
           <div className="self-start flex-none w-10 h-10 rounded-full bg-neutral-700 flex items-center justify-center text-white font-semibold overflow-hidden mr-4">
             {post.user.avatar ? (
-              <img
+              <ResponsiveImage
                 src={post.user.avatar}
+                srcset={post.user.avatar_srcset}
+                sizes="40px"
                 alt="Avatar"
                 className="w-full h-full object-cover rounded-full"
               />
@@ -198,9 +201,10 @@ export default function Post({
                     rel="noopener noreferrer"
                     className="block"
                   >
-                    <img
+                    <ResponsiveImage
                       src={mediaItem.media_file}
-                      alt=""
+                      srcset={mediaItem.srcset}
+                      sizes="(max-width: 640px) 100vw, 560px"
                       className="max-w-full my-2 rounded-md object-cover"
                     />
                   </a>
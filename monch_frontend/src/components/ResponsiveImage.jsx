@@ -0,0 +1,20 @@
+// Renders an <img> with the AVIF / WebP renditions from the API's srcset map
+// ({ "image/avif": "url 48w, url 96w", ... }) as <source> candidates.
+function ResponsiveImage({ src, srcset, sizes, alt = "", className }) {
+  const sources = Object.entries(srcset || {});
+
+  if (sources.length === 0) {
+    return <img src={src} alt={alt} className={className} loading="lazy" />;
+  }
+
+  return (
+    <picture>
+      {sources.map(([type, candidates]) => (
+        <source key={type} type={type} srcSet={candidates} sizes={sizes} />
+      ))}
+      <img src={src} alt={alt} className={className} loading="lazy" />
+    </picture>
+  );
+}
+
+export default ResponsiveImage;
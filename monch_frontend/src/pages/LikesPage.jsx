@@ -1,5 +1,5 @@
 // pages/LikesPage.jsx
-import { useEffect, useState } from "react";
+import { useEffect, useState, useRef } from "react";
 import apiClient from "../api/apiClient";
 import Feed from "../components/Feed";
 import Spinner from "../components/Spinner";
@@ -7,6 +7,8 @@ import Spinner from "../components/Spinner";
 export default function LikesPage() {
   const [likedPosts, setLikedPosts] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextPage, setNextPage] = useState(null);
+  const loadingMoreRef = useRef(false);
 
   useEffect(() => {
   const fetchLikedPosts = async () => {
@@ -15,9 +17,10 @@ export default function LikesPage() {
         withCredentials: true,
       });
 
-      const parentPostsOnly = res.data.filter(post => !post.parent_post_detail);
+      const parentPostsOnly = res.data.results.filter(post => !post.parent_post_detail);
 
       setLikedPosts(parentPostsOnly);
+      setNextPage(res.data.next);
     } catch (error) {
       console.error("Error fetching liked posts:", error);
       setLikedPosts([]);
@@ -29,6 +32,34 @@ export default function LikesPage() {
   fetchLikedPosts();
 }, []);
 
+  // Infinite scroll handler
+  useEffect(() => {
+    const onScroll = async () => {
+      if (
+        window.innerHeight + window.scrollY <
+          document.documentElement.scrollHeight - 300 ||
+        !nextPage ||
+        loadingMoreRef.current
+      )
+        return;
+
+      loadingMoreRef.current = true;
+      try {
+        const res = await apiClient.get(nextPage, { withCredentials: true });
+        const parentPostsOnly = res.data.results.filter(post => !post.parent_post_detail);
+        setLikedPosts((prev) => [...prev, ...parentPostsOnly]);
+        setNextPage(res.data.next);
+      } catch (error) {
+        console.error("Error fetching more liked posts:", error);
+      } finally {
+        loadingMoreRef.current = false;
+      }
+    };
+
+    window.addEventListener("scroll", onScroll);
+    return () => window.removeEventListener("scroll", onScroll);
+  }, [nextPage]);
+
 return (
   <div className="home flex flex-col flex-grow w-full h-full text-whitesm:px-0">
     <div className="flex flex-col flex-1 w-full mx-auto">
@@ -29,6 +29,9 @@ export default function PostDetail() {
   const [liked, setLiked] = useState(false);
   const [likesCount, setLikesCount] = useState(0);
   const [replies, setReplies] = useState([]);
+  // Continues the replies cut off by the thread's fan-out limit
+  const [repliesCursor, setRepliesCursor] = useState(null);
+  const [loadingReplies, setLoadingReplies] = useState(false);
   const [replyText, setReplyText] = useState("");
   const [loading, setLoading] = useState(true);
   const [submitting, setSubmitting] = useState(false);
@@ -58,6 +61,7 @@ export default function PostDetail() {
         });
         setPost(res.data);
         setReplies(res.data.replies || []);
+        setRepliesCursor(res.data.replies_cursor || null);
         setLiked(res.data.liked_by_user || false);
         setLikesCount(res.data.likes || 0);
       } catch (error) {
@@ -70,6 +74,27 @@ export default function PostDetail() {
     fetchPost();
   }, [postId]);
 
+  const loadMoreReplies = async () => {
+    if (!repliesCursor || loadingReplies) return;
+    setLoadingReplies(true);
+    try {
+      const res = await apiClient.get(`/posts/${postId}/thread/`, {
+        params: { cursor: repliesCursor, depth: 1 },
+        withCredentials: true,
+      });
+      setReplies((prev) => {
+        // A reply posted from this page may come back in a later page
+        const seen = new Set(prev.map((reply) => reply.id));
+        return [...prev, ...res.data.replies.filter((reply) => !seen.has(reply.id))];
+      });
+      setRepliesCursor(res.data.cursor || null);
+    } catch (error) {
+      toast.error("Failed to load replies");
+    } finally {
+      setLoadingReplies(false);
+    }
+  };
+
   useEffect(() => {
     if (!loading) {
       const timer = setTimeout(() => setFadeIn(true), 50);
@@ -515,6 +540,17 @@ export default function PostDetail() {
                         ))}
                       </div>
                     )}
+                    {repliesCursor && (
+                      <div className="flex justify-center py-4">
+                        <button
+                          onClick={loadMoreReplies}
+                          disabled={loadingReplies}
+                          className="h-10 px-4 border-[0.5px] border-neutral-700 rounded-xl text-white hover:bg-neutral-700 disabled:opacity-50 disabled:cursor-not-allowed cursor-pointer"
+                        >
+                          {loadingReplies ? "Loading..." : "Show more replies"}
+                        </button>
+                      </div>
+                    )}
                   </div>
                 </>
               </div>
@@ -27,6 +27,10 @@ export default function UserProfile() {
     bites: [],
     replies: [],
   });
+  const [nextPageByTab, setNextPageByTab] = useState({
+    bites: null,
+    replies: null,
+  });
   const [loadingPosts, setLoadingPosts] = useState(false);
   const [hasLoadedOnceByTab, setHasLoadedOnceByTab] = useState({
     bites: false,
@@ -86,8 +90,9 @@ export default function UserProfile() {
 
       setPostsByTab((prev) => ({
         ...prev,
-        [tabToFetch]: res.data,
+        [tabToFetch]: res.data.results,
       }));
+      setNextPageByTab((prev) => ({ ...prev, [tabToFetch]: res.data.next }));
 
       setHasLoadedOnceByTab((prev) => ({
         ...prev,
@@ -101,6 +106,41 @@ export default function UserProfile() {
     }
   };
 
+  // Append the next page of the current tab
+  const loadMorePosts = async () => {
+    const nextUrl = nextPageByTab[tab];
+    if (!nextUrl || isFetchingRef.current[tab]) return;
+
+    isFetchingRef.current[tab] = true;
+    try {
+      const res = await apiClient.get(nextUrl, { withCredentials: true });
+      setPostsByTab((prev) => ({
+        ...prev,
+        [tab]: [...prev[tab], ...res.data.results],
+      }));
+      setNextPageByTab((prev) => ({ ...prev, [tab]: res.data.next }));
+    } catch (error) {
+      console.error("Failed to load more posts:", error);
+    } finally {
+      isFetchingRef.current[tab] = false;
+    }
+  };
+
+  // Infinite scroll handler
+  useEffect(() => {
+    const onScroll = () => {
+      if (
+        window.innerHeight + window.scrollY >=
+        document.documentElement.scrollHeight - 300
+      ) {
+        loadMorePosts();
+      }
+    };
+
+    window.addEventListener("scroll", onScroll);
+    return () => window.removeEventListener("scroll", onScroll);
+  }, [tab, nextPageByTab]);
+
   // Combined fetch for user and posts
   const fetchUserAndPosts = async () => {
     await fetchUserData();
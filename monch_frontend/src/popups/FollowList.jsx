@@ -9,38 +9,74 @@ export default function FollowList({
 }) {
   const [tab, setTab] = useState(initialTab);
   const [list, setList] = useState([]);
+  const [nextPage, setNextPage] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [followState, setFollowState] = useState({});
   const [loadingFollow, setLoadingFollow] = useState({});
   const contentRef = useRef(null);
   const [containerHeight, setContainerHeight] = useState("auto");
 
+  // Follow state of a page of users, in one request
+  const loadFollowState = (users) => {
+    if (users.length === 0) return;
+    apiClient
+      .get("/follows/state/", {
+        withCredentials: true,
+        params: { usernames: users.map((user) => user.username).join(",") },
+      })
+      .then((res) => {
+        setFollowState((prev) => ({
+          ...prev,
+          ...Object.fromEntries(
+            users.map((user) => [user.id, !!res.data[user.username]])
+          ),
+        }));
+      })
+      .catch(console.error);
+  };
+
   useEffect(() => {
+    let cancelled = false;
     setLoading(true);
+    setList([]);
+    setNextPage(null);
     apiClient
-      .get(`/users/${username}/${tab}/`, { withCredentials: true })
+      .get(`/users/${username}/${tab}/`, {
+        withCredentials: true,
+        params: { limit: 50 },
+      })
       .then((res) => {
-        setList(res.data);
-
-        // Check follow state for all users in list
-        Promise.all(
-          res.data.map((user) =>
-            apiClient
-              .get("/follows/is_following/", {
-                withCredentials: true,
-                params: { username: user.username },
-              })
-              .then((res) => [user.id, res.data.is_following])
-              .catch(() => [user.id, false])
-          )
-        ).then((results) => {
-          setFollowState(Object.fromEntries(results));
-        });
+        if (cancelled) return;
+        setList(res.data.results);
+        setNextPage(res.data.next);
+        loadFollowState(res.data.results);
       })
       .catch(console.error)
-      .finally(() => setLoading(false));
+      .finally(() => {
+        if (!cancelled) setLoading(false);
+      });
+    return () => {
+      cancelled = true;
+    };
   }, [tab, username]);
 
+  // Append the next page of the current tab
+  const loadMore = async () => {
+    if (!nextPage || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const res = await apiClient.get(nextPage, { withCredentials: true });
+      setList((prev) => [...prev, ...res.data.results]);
+      setNextPage(res.data.next);
+      loadFollowState(res.data.results);
+    } catch (error) {
+      console.error("Failed to load more users:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
   if (contentRef.current) {
     const resize = () => {
@@ -51,7 +87,7 @@ export default function FollowList({
     const timeout = setTimeout(resize, 50);
     return () => clearTimeout(timeout);
   }
-}, [list.length, loading]);
+}, [list.length, loading, nextPage]);
 
 
   const handleFollowToggle = async (targetUser) => {
@@ -209,6 +245,17 @@ export default function FollowList({
   />
               ))
             )}
+            {!loading && nextPage && (
+              <div className="flex justify-center py-4">
+                <button
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  className="h-10 px-4 border-[0.5px] border-neutral-700 rounded-xl text-white hover:bg-neutral-700 disabled:opacity-50 disabled:cursor-not-allowed cursor-pointer"
+                >
+                  {loadingMore ? "Loading..." : "Load more"}
+                </button>
+              </div>
+            )}
           </div>
           </div>
       </div>